@@ -1,23 +1,93 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, ValidationError
+from typing import Any, Dict, List, Optional
+from contextlib import asynccontextmanager
 import sys
 import os
 import json
+import asyncio
 import logging
 import re
 
 # Aggiungi la root del progetto al path per importare i moduli di execution
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from execution.transcribe_video import transcribe_video
-from execution.extract_topics import extract_topics
-from execution.research_topics import research_topics
-from execution.generate_script import generate_video_script
+from execution.transcribe_video import transcribe_video_async
+from execution.transcribe_batch import transcribe_batch_async
+from execution.apify_utils import apify_progress
+from execution.extract_topics import extract_topics_async
+from execution.research_topics import research_topics_async, iter_research_topics
+from execution.generate_script import (
+    generate_video_script_async,
+    generate_video_script_stream,
+    SCRIPT_TRANSCRIPT_MAX_CHARS,
+)
+from execution.llm_utils import (
+    chat_completion,
+    chat_completion_stream,
+    warmup_openrouter_client,
+    close_openrouter_client,
+)
+from execution.language_detect import detect_language
+from execution.caption_store import CaptionStore
+from execution.media_download import (
+    download_video_data_url,
+    video_slot,
+    close_download_client,
+    VideoTooLargeError,
+    VideoDownloadError,
+)
+from execution.jobs import JobManager, FINISHED_STATES
+from execution.singleflight import SingleFlight, StreamSingleFlight
+from execution.video_ids import canonical_video_id
+from execution.chunking import (
+    split_text,
+    split_captions,
+    map_chunks,
+    map_chunks_stream,
+    map_reduce,
+)
+from execution.model_router import router
+from execution.hedging import hedge_stats
+from execution.admission import Overloaded, RateLimited, ensure_capacity, admission_stats
+from execution.deadline import (
+    DEADLINE_HEADER,
+    MAX_REQUEST_DEADLINE_SECONDS,
+    DeadlineExceeded,
+    parse_deadline,
+    set_deadline,
+    stage_deadline,
+    optional_stage,
+    record_degraded,
+    record_failed,
+)
+from execution.tracing import render_metrics, start_trace, stage_span, STREAM_CANCELLATIONS
+from execution.usage_ledger import set_endpoint, start_usage_flusher, stop_usage_flusher, usage_stats
+from execution.stream_utils import (
+    ndjson_event,
+    merge_async_iterators,
+    iterate_queue,
+    iterate_queue_until,
+    cancel_on_disconnect,
+    ordered_map_stream,
+    ParagraphSplitter,
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open the pooled OpenRouter connections before the first request
+    await warmup_openrouter_client()
+    await job_manager.start()
+    start_usage_flusher()
+    yield
+    await job_manager.stop()
+    await stop_usage_flusher()
+    await close_openrouter_client()
+    await close_download_client()
 
-app = FastAPI(title="Antigravity AI API")
+app = FastAPI(title="Antigravity AI API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -27,6 +97,42 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def attribute_llm_usage(request: Request, call_next):
+    # LLM calls made while serving this request are booked to its endpoint in the usage ledger
+    set_endpoint(request.url.path)
+    return await call_next(request)
+
+# Default time budget per endpoint, in seconds (REQUEST_DEADLINE_SECONDS for the others).
+# Clients can ask for a different one with the X-Request-Timeout header.
+ENDPOINT_DEADLINES = {
+    "/api/translate": 60,
+    "/api/transcribe-batch": MAX_REQUEST_DEADLINE_SECONDS,
+}
+
+@app.middleware("http")
+async def request_deadline(request: Request, call_next):
+    # Every upstream call made for this request (Apify, OpenRouter, CDN) must finish by the deadline
+    set_deadline(parse_deadline(request.headers.get(DEADLINE_HEADER), ENDPOINT_DEADLINES.get(request.url.path)))
+    return await call_next(request)
+
+def _retry_later(status_code, e):
+    return JSONResponse(
+        status_code=status_code,
+        content={"detail": str(e)},
+        headers={"Retry-After": str(max(round(e.retry_after), 1))},
+    )
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, e: Overloaded):
+    # Shed before reaching the upstream: queue full or no way to finish within the deadline
+    return _retry_later(503, e)
+
+@app.exception_handler(RateLimited)
+async def rate_limited_handler(request: Request, e: RateLimited):
+    # The upstream kept answering 429 after the backoff retries
+    return _retry_later(429, e)
+
 # Setup Logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -35,6 +141,11 @@ logger = logging.getLogger(__name__)
 class VideoRequest(BaseModel):
     url: str
     target_language: Optional[str] = "en"
+    pipelined_translation: Optional[bool] = True  # translate paragraphs while formatting streams
+    include_timings: Optional[bool] = False  # emit per-span "timing" events in transcribe-stream
+
+class BatchTranscribeRequest(BaseModel):
+    urls: List[str]  # YouTube and Instagram URLs, mixed
 
 class TranscriptResponse(BaseModel):
     title: Optional[str] = None
@@ -75,6 +186,21 @@ class TopicGenerateResponse(BaseModel):
 class ScriptResponse(BaseModel):
     script_content: str
 
+class JobRequest(BaseModel):
+    type: str  # transcribe, research, generate, generate-from-topic
+    payload: Dict[str, Any]  # same body as the matching synchronous endpoint
+
+class JobResponse(BaseModel):
+    id: str
+    type: str
+    status: str  # queued, running, succeeded, failed
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
 class TranslateRequest(BaseModel):
     text: str
     target_language: str  # e.g., 'it', 'en', 'ru', 'fr', 'zh'
@@ -83,29 +209,242 @@ class TranslateResponse(BaseModel):
     translated_text: str
     original_language: Optional[str] = None
 
+# Identical transcriptions already in flight are shared instead of started again
+transcribe_flights = SingleFlight()
+transcribe_stream_flights = StreamSingleFlight()
+
+async def _timed_stage(stage, events):
+    # Records the duration of a stage generator in pipeline_stage_duration_seconds
+    with stage_span(stage):
+        async for event in events:
+            yield event
+
+async def _optional_stage_events(stage, events):
+    # A stage that misses its share of the deadline is skipped; the other stages still complete
+    with stage_deadline(stage):
+        try:
+            async for event in events:
+                yield event
+        except DeadlineExceeded:
+            record_degraded(stage)
+            yield ndjson_event("skipped", stage=stage, reason="deadline")
+
+def _http_error(e):
+    # Shed or rate-limited calls are answered by the 503/429 handlers, with Retry-After
+    if isinstance(e, (Overloaded, RateLimited)):
+        return e
+    # Out of time is a gateway timeout, not a server error
+    if isinstance(e, DeadlineExceeded):
+        record_failed(e.stage)
+        return HTTPException(status_code=504, detail=str(e))
+    return HTTPException(status_code=500, detail=str(e))
+
+def _error_event(e):
+    # Out-of-time failures are flagged: the client can retry with a larger X-Request-Timeout
+    if isinstance(e, DeadlineExceeded):
+        record_failed(e.stage)
+        return ndjson_event("error", message=str(e), deadline=True)
+    if isinstance(e, (Overloaded, RateLimited)):
+        return ndjson_event("error", message=str(e), retry_after=round(e.retry_after))
+    return ndjson_event("error", message=str(e))
+
+# Post-formatting stages of /api/transcribe-stream (each one yields NDJSON events)
+async def _paraphrase_stage(current_transcript, detected_lang):
+    # Generate Paraphrase (Original Language)
+    yield ndjson_event("status", message="Generating paraphrase...")
+
+    async def paraphrase_chunk(chunk):
+        paraphrase_prompt = f"""Paraphrase the following transcript strictly in its ORIGINAL LANGUAGE ({detected_lang}). 
+Keep it professional and engaging. DO NOT TRANSLATE.
+
+Transcript:
+{chunk}"""
+        return await chat_completion(
+            stage="paraphrase",
+            messages=[{"role": "user", "content": paraphrase_prompt}]
+        )
+
+    # Long transcripts are paraphrased chunk by chunk in parallel, then stitched in order
+    paraphrases = await map_chunks(split_text(current_transcript), paraphrase_chunk)
+    paraphrase_text = "\n\n".join(p.strip() for p in paraphrases)
+    yield ndjson_event("paraphrase", text=paraphrase_text)
+
+async def _translation_stage(current_transcript, target_lang):
+    # Generate Translation (Target Language)
+    yield ndjson_event("status", message=f"Translating to {target_lang}...")
+    
+    # We reuse the api_translate logic but internally
+    language_names = {'it': 'Italian', 'en': 'English', 'ru': 'Russian', 'fr': 'French', 'zh': 'Chinese'}
+    target_name = language_names.get(target_lang, target_lang)
+    
+    async def translate_chunk(chunk):
+        translate_prompt = f"Translate the following text to {target_name}. Preserve formatting.\n\nText:\n{chunk}"
+        async for c in chat_completion_stream(
+            stage="translate",
+            messages=[{"role": "user", "content": translate_prompt}],
+        ):
+            yield c
+
+    # Chunks are translated in parallel; the first one streams live, the rest follow in order
+    async for c in map_chunks_stream(split_text(current_transcript), translate_chunk):
+        yield ndjson_event("translation", text=c)
+
+TRANSLATION_CONCURRENCY = int(os.getenv("TRANSLATION_CONCURRENCY", "4"))
+# Below this confidence the local language detector defers to the LLM
+LANG_DETECT_MIN_CONFIDENCE = float(os.getenv("LANG_DETECT_MIN_CONFIDENCE", "0.5"))
+
+async def _pipelined_translation_stage(paragraph_source, target_lang):
+    # Translate paragraph by paragraph while the formatter is still streaming.
+    # Paragraphs are translated concurrently but emitted in their original order.
+    yield ndjson_event("status", message=f"Translating to {target_lang}...")
+
+    language_names = {'it': 'Italian', 'en': 'English', 'ru': 'Russian', 'fr': 'French', 'zh': 'Chinese'}
+    target_name = language_names.get(target_lang, target_lang)
+
+    async def numbered_paragraphs():
+        # An oversized paragraph is split at sentence boundaries like any other chunk
+        index = 0
+        async for paragraph in paragraph_source:
+            for piece in split_text(paragraph):
+                yield index, piece
+                index += 1
+
+    async def translate_paragraph(item):
+        index, paragraph = item
+        if index > 0:
+            yield "\n\n"
+        translate_prompt = f"Translate the following text to {target_name}. Preserve formatting. Return ONLY the translated text.\n\nText:\n{paragraph}"
+        async for c in chat_completion_stream(
+            stage="translate",
+            messages=[{"role": "user", "content": translate_prompt}],
+        ):
+            yield c
+
+    async for c in ordered_map_stream(numbered_paragraphs(), translate_paragraph, TRANSLATION_CONCURRENCY):
+        yield ndjson_event("translation", text=c)
+
+async def _tags_stage(current_transcript, target_lang):
+    # Generate Video Tags (Target Language)
+    yield ndjson_event("status", message="Generating tags...")
+    language_names = {'it': 'Italian', 'en': 'English', 'ru': 'Russian', 'fr': 'French', 'zh': 'Chinese'}
+    target_name = language_names.get(target_lang, target_lang)
+    
+    async def tags_for_chunk(chunk):
+        tags_prompt = f"""Generate 5-10 relevant SEO tags/keywords for this video content in {target_name}. 
+Return ONLY as a comma-separated list of keywords.
+
+Content:
+{chunk}"""
+        tags_text = await chat_completion(
+            stage="tags",
+            messages=[{"role": "user", "content": tags_prompt}]
+        )
+        return [t.strip() for t in tags_text.strip().split(",") if t.strip()]
+
+    async def merge_tags(partials):
+        # Reduce: pick the 5-10 best tags among the candidates of every chunk
+        candidates = list(dict.fromkeys(tag for tags in partials for tag in tags))
+        merge_prompt = f"""Select the 5-10 most relevant SEO tags/keywords for the whole video from these candidates, in {target_name}. 
+Return ONLY as a comma-separated list of keywords.
+
+Candidates:
+{", ".join(candidates)}"""
+        tags_text = await chat_completion(
+            stage="tags",
+            messages=[{"role": "user", "content": merge_prompt}]
+        )
+        return [t.strip() for t in tags_text.strip().split(",") if t.strip()]
+
+    tags_list = await map_reduce(split_text(current_transcript) or [""], tags_for_chunk, merge_tags)
+    yield ndjson_event("tags", tags=tags_list)
+
+async def _client_disconnected(request: Request):
+    """Returns once the client has closed the connection."""
+    # The body has already been read, so the next ASGI message is the disconnect.
+    # (Request.is_disconnected() never sees it behind the http middleware.)
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+def _until_disconnect(request: Request, events, endpoint):
+    """
+    Forward `events` while the client is connected. When it goes away the pipeline
+    behind the stream is cancelled: in-flight LLM streams are closed, the remaining
+    stages never start and pending Apify runs are aborted.
+    """
+    return cancel_on_disconnect(
+        events,
+        lambda: _client_disconnected(request),
+        on_cancel=lambda: STREAM_CANCELLATIONS.inc(endpoint=endpoint),
+    )
+
+def _start_extraction(extract, url):
+    """Start `extract(url)` as a task whose Apify runs report progress to a queue."""
+    progress = asyncio.Queue()
+    # The task inherits the extraction's share of the request deadline
+    with apify_progress(progress.put_nowait), stage_deadline("extract"):
+        task = asyncio.create_task(extract(url))
+    return task, progress
+
+def _progress_message(update):
+    message = f"Apify run {update['status'].lower()} ({update['elapsed']:.0f}s)"
+    return f"{message}: {update['message']}" if update["message"] else message
+
+async def _extraction_progress(task, progress):
+    """
+    Status events for the Apify progress of an extraction, until it finishes.
+    If the stream is closed first (client gone), the extraction is cancelled
+    and its Apify run aborted.
+    """
+    try:
+        async for update in iterate_queue_until(progress, task):
+            yield ndjson_event("status", message=_progress_message(update), apify=update)
+    finally:
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
 @app.post("/api/transcribe-stream")
-async def api_transcribe_stream(req: VideoRequest):
+async def api_transcribe_stream(req: VideoRequest, request: Request):
     """Stream transcription and formatting."""
     logger.info(f"Streaming transcription for: {req.url}")
+    # Shed now with a 503 rather than fail halfway through a 200 stream
+    ensure_capacity("apify", "openrouter")
     
     async def transcription_generator():
+        # Spans of every upstream call made for this request (Apify, LLM, download)
+        trace = start_trace("transcribe-stream")
+        async for event in transcription_events():
+            yield event
+            if req.include_timings:
+                for record in trace.drain():
+                    yield ndjson_event("timing", **record)
+        if req.include_timings:
+            yield ndjson_event("timing", name="total", duration_ms=trace.elapsed_ms())
+
+    async def transcription_events():
         try:
-            yield json.dumps({"type": "status", "message": "Initializing..."}) + "\n"
+            yield ndjson_event("status", message="Initializing...")
             
             # 1. Detection & Extraction
             if "youtube.com" in req.url or "youtu.be" in req.url:
-                yield json.dumps({"type": "status", "message": "Fetching YouTube data (this may take a moment)..."}) + "\n"
-                from execution.transcribe_video import transcribe_video
-                data = transcribe_video(req.url)
+                yield ndjson_event("status", message="Fetching YouTube data...")
+                extract = transcribe_video_async
                 platform = "youtube"
             elif "instagram.com" in req.url:
-                yield json.dumps({"type": "status", "message": "Connecting to Instagram via Apify (slow)..."}) + "\n"
-                from execution.transcribe_instagram import transcribe_instagram
-                data = transcribe_instagram(req.url)
+                yield ndjson_event("status", message="Connecting to Instagram via Apify...")
+                from execution.transcribe_instagram import transcribe_instagram_async
+                extract = transcribe_instagram_async
                 platform = "instagram"
             else:
                 raise Exception("Unsupported platform. Use YouTube or Instagram.")
 
+            # The Apify run is polled in the background: its progress is streamed as status events
+            with stage_span("extract"):
+                extraction, progress = _start_extraction(extract, req.url)
+                async for event in _extraction_progress(extraction, progress):
+                    yield event
+                data = extraction.result()
+
             title = data.get("title", "Video")
             channel = data.get("channel", "Sconosciuto")
             thumbnail_url = data.get("thumbnail_url")
@@ -116,57 +455,46 @@ async def api_transcribe_stream(req: VideoRequest):
             fallback_text = data.get("transcript", "")
             text_cleaned = "" # Will be filled by OpenRouter for Instagram
             
+            caption_chunks = None
             if platform == "youtube":
                 raw_text = data.get("transcript", "")
-                if not raw_text and data.get("captions"):
-                    raw_text = " ".join([c.get('text', '') for c in data['captions']])
                 from execution.process_transcript import clean_transcript
-                text_cleaned = clean_transcript(raw_text)
+                if not raw_text and data.get("captions"):
+                    captions = CaptionStore.from_captions(data['captions']).clean()
+                    text_cleaned = captions.text()
+                    # Captions have no punctuation to split on: chunk at caption boundaries instead
+                    caption_chunks = split_captions(captions)
+                else:
+                    text_cleaned = clean_transcript(raw_text)
 
             # Metadata event
-            yield json.dumps({
-                "type": "metadata", 
-                "title": title, 
-                "channel": channel,
-                "video_url": req.url,
-                "thumbnail_url": thumbnail_url,
-                "frame_urls": frame_urls,
-                "platform": platform
-            }) + "\n"
-
-            from execution.llm_utils import get_openrouter_client, get_fast_model, get_extra_headers
-            client = get_openrouter_client()
+            yield ndjson_event(
+                "metadata",
+                title=title,
+                channel=channel,
+                video_url=req.url,
+                thumbnail_url=thumbnail_url,
+                frame_urls=frame_urls,
+                platform=platform
+            )
 
             # 2. Transcription Logic
             if platform == "instagram" and video_mp4_url:
-                yield json.dumps({"type": "status", "message": "Downloading video for AI analysis..."}) + "\n"
+                yield ndjson_event("status", message="Downloading video for AI analysis...")
                 
                 try:
-                    import requests
-                    import base64
-                    
-                    headers = {
-                        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-                    }
-                    resp = requests.get(video_mp4_url, headers=headers, timeout=30)
-                    if resp.status_code == 200:
-                        content_type = resp.headers.get("Content-Type", "video/mp4")
-                        video_bytes = resp.content
-                        
-                        # Check size (OpenRouter limit is ~50MB, but let's be safe)
-                        if len(video_bytes) > 25 * 1024 * 1024:
-                             yield json.dumps({"type": "status", "message": "Video too large for deep analysis, using caption..."}) + "\n"
-                             text_cleaned = fallback_text
-                        else:
-                            yield json.dumps({"type": "status", "message": "AI is watching and transcribing (this takes a moment)..."}) + "\n"
-                            video_b64 = base64.b64encode(video_bytes).decode('utf-8')
-                            data_url = f"data:{content_type};base64,{video_b64}"
+                    # At most VIDEO_MAX_CONCURRENT videos are held in memory at once
+                    with stage_deadline("ig_transcribe"):
+                        async with video_slot():
+                            # Streamed download, size-checked up front and base64-encoded in chunks
+                            data_url = await download_video_data_url(video_mp4_url, timeout=30)
+                            yield ndjson_event("status", message="AI is watching and transcribing (this takes a moment)...")
                             
                             ig_prompt = "Transcribe the spoken words in this video exactly. If there are captions or text overlays, use them as hints. Return ONLY the spoken words as a transcript."
                             
-                            ig_response = client.chat.completions.create(
-                                extra_headers=get_extra_headers(),
-                                model="google/gemini-2.0-flash-001",
+                            ig_text = await chat_completion(
+                                stage="ig_transcribe",
+                                tier="video",
                                 messages=[
                                     {
                                         "role": "user",
@@ -177,10 +505,19 @@ async def api_transcribe_stream(req: VideoRequest):
                                     }
                                 ]
                             )
-                            text_cleaned = ig_response.choices[0].message.content.strip()
-                    else:
-                        logger.error(f"Failed to download video: {resp.status_code}")
-                        text_cleaned = fallback_text
+                            del data_url  # free the encoded video before releasing the slot
+                            text_cleaned = ig_text.strip()
+                except VideoTooLargeError as e:
+                    logger.info(f"Skipping video analysis: {e}")
+                    yield ndjson_event("status", message="Video too large for deep analysis, using caption...")
+                    text_cleaned = fallback_text
+                except VideoDownloadError as e:
+                    logger.error(f"Failed to download video: {e}")
+                    text_cleaned = fallback_text
+                except DeadlineExceeded:
+                    record_degraded("ig_transcribe")
+                    yield ndjson_event("status", message="Video analysis ran out of time, using caption...")
+                    text_cleaned = fallback_text
                 except Exception as e:
                     logger.error(f"OpenRouter IG transcription failed: {e}")
                     text_cleaned = fallback_text or "Impossibile trascrivere il video."
@@ -190,259 +527,590 @@ async def api_transcribe_stream(req: VideoRequest):
                  from execution.process_transcript import clean_transcript
                  text_cleaned = clean_transcript(fallback_text) or "Trascrizione non disponibile."
 
-            # 3. Language Detection
-            detect_prompt = f"Detect the language of the following text. Return ONLY the ISO 639-1 code (e.g., 'en', 'it', 'fr').\n\nText:\n{text_cleaned[:500]}"
-            detection = client.chat.completions.create(
-                extra_headers=get_extra_headers(),
-                model=get_fast_model(),
-                messages=[{"role": "user", "content": detect_prompt}]
-            )
-            detected_lang = detection.choices[0].message.content.strip().lower()[:2]
-            yield json.dumps({"type": "status", "message": f"Detected language: {detected_lang}"}) + "\n"
+            # 3. Language Detection (local n-gram model, LLM only when unsure)
+            with stage_span("detect_language"):
+                detected_lang, confidence = detect_language(text_cleaned[:500])
+                if detected_lang is None or confidence < LANG_DETECT_MIN_CONFIDENCE:
+                    detect_prompt = f"Detect the language of the following text. Return ONLY the ISO 639-1 code (e.g., 'en', 'it', 'fr').\n\nText:\n{text_cleaned[:500]}"
+                    detection = await optional_stage("detect_language", chat_completion(
+                        stage="detect_language",
+                        messages=[{"role": "user", "content": detect_prompt}]
+                    ))
+                    # Out of time: keep the local guess rather than fail the transcript
+                    detected_lang = detection.strip().lower()[:2] if detection else (detected_lang or "en")
+            yield ndjson_event("status", message=f"Detected language: {detected_lang}")
 
             # 3. Stream Formatted (Original) Transcript
-            format_prompt = f"""Format the following raw video transcript into a readable, human-friendly article.
+            # The whole transcript is formatted: chunks run in parallel and stream in order
+            format_chunks = caption_chunks or split_text(text_cleaned)
+
+            async def format_chunk(chunk):
+                format_prompt = f"""Format the following raw video transcript into a readable, human-friendly article.
 Add frequent double line breaks for readability. 
 Preserve the core meaning and the ORIGINAL language of the transcript ({detected_lang}). 
 DO NOT TRANSLATE. Respond ONLY in the original language.
 Return ONLY the formatted text.
 
 Transcript:
-{text_cleaned[:8000]}"""
+{chunk}"""
+                async for c in chat_completion_stream(
+                    stage="format",
+                    messages=[{"role": "user", "content": format_prompt}],
+                ):
+                    yield c
 
-            response = client.chat.completions.create(
-                extra_headers=get_extra_headers(),
-                model=get_fast_model(),
-                messages=[{"role": "user", "content": format_prompt}],
-                stream=True,
-            )
+            target_lang = req.target_language or "en"
+            translate = target_lang != detected_lang
+            pipelined = translate and req.pipelined_translation
 
-            current_transcript = ""
-            for chunk in response:
-                if chunk.choices[0].delta.content:
-                    c = chunk.choices[0].delta.content
-                    current_transcript += c
-                    yield json.dumps({"type": "content", "text": c}) + "\n"
+            # In pipelined mode every paragraph closed by the formatter is queued
+            # for translation right away, while formatting keeps streaming.
+            paragraphs = asyncio.Queue()
 
-            # 4. Generate Paraphrase (Original Language)
-            yield json.dumps({"type": "status", "message": "Generating paraphrase..."}) + "\n"
-            paraphrase_prompt = f"""Paraphrase the following transcript strictly in its ORIGINAL LANGUAGE ({detected_lang}). 
-Keep it professional and engaging. DO NOT TRANSLATE.
+            async def format_then_stages():
+                formatted_parts = []
+                formatted = True
+                splitter = ParagraphSplitter()
+                try:
+                    with stage_deadline("format"):
+                        async for c in _timed_stage("format", map_chunks_stream(format_chunks, format_chunk)):
+                            formatted_parts.append(c)
+                            yield ndjson_event("content", text=c)
+                            if pipelined:
+                                for paragraph in splitter.feed(c):
+                                    paragraphs.put_nowait(paragraph)
+                    if pipelined:
+                        for paragraph in splitter.flush():
+                            paragraphs.put_nowait(paragraph)
+                except DeadlineExceeded:
+                    # The formatted text stops here; the later stages work on the raw transcript
+                    record_degraded("format")
+                    formatted = False
+                    yield ndjson_event("skipped", stage="format", reason="deadline")
+                finally:
+                    paragraphs.put_nowait(None)
 
-Transcript:
-{current_transcript[:5000]}"""
-            paraphrase_res = client.chat.completions.create(
-                extra_headers=get_extra_headers(),
-                model=get_fast_model(),
-                messages=[{"role": "user", "content": paraphrase_prompt}]
-            )
-            paraphrase_text = paraphrase_res.choices[0].message.content
-            yield json.dumps({"type": "paraphrase", "text": paraphrase_text}) + "\n"
+                # 4-6. Paraphrase, translation and tags only depend on the formatted
+                # transcript: run them concurrently and forward their events as they arrive.
+                # Each one has its own share of the deadline and is skipped if it misses it.
+                current_transcript = "".join(formatted_parts) if formatted else text_cleaned
+                stages = [_optional_stage_events("paraphrase", _timed_stage("paraphrase", _paraphrase_stage(current_transcript, detected_lang)))]
+                if translate and not pipelined:
+                    stages.append(_optional_stage_events("translation", _timed_stage("translation", _translation_stage(current_transcript, target_lang))))
+                stages.append(_optional_stage_events("tags", _timed_stage("tags", _tags_stage(current_transcript, target_lang))))
 
-            # 5. Generate Translation (Target Language) if requested and different
-            target_lang = req.target_language or "en"
-            if target_lang != detected_lang:
-                yield json.dumps({"type": "status", "message": f"Translating to {target_lang}..."}) + "\n"
-                
-                # We reuse the api_translate logic but internally
-                language_names = {'it': 'Italian', 'en': 'English', 'ru': 'Russian', 'fr': 'French', 'zh': 'Chinese'}
-                target_name = language_names.get(target_lang, target_lang)
-                
-                translate_prompt = f"Translate the following text to {target_name}. Preserve formatting.\n\nText:\n{current_transcript[:5000]}"
-                translation_res = client.chat.completions.create(
-                    extra_headers=get_extra_headers(),
-                    model=get_fast_model(),
-                    messages=[{"role": "user", "content": translate_prompt}],
-                    stream=True
-                )
-                
-                for chunk in translation_res:
-                    if chunk.choices[0].delta.content:
-                        yield json.dumps({"type": "translation", "text": chunk.choices[0].delta.content}) + "\n"
-
-            # 6. Generate Video Tags (Target Language)
-            yield json.dumps({"type": "status", "message": "Generating tags..."}) + "\n"
-            language_names = {'it': 'Italian', 'en': 'English', 'ru': 'Russian', 'fr': 'French', 'zh': 'Chinese'}
-            target_name = language_names.get(target_lang, target_lang)
-            
-            tags_prompt = f"""Generate 5-10 relevant SEO tags/keywords for this video content in {target_name}. 
-Return ONLY as a comma-separated list of keywords.
+                async for event in merge_async_iterators(*stages):
+                    yield event
 
-Content:
-{current_transcript[:3000]}"""
-            tags_res = client.chat.completions.create(
-                extra_headers=get_extra_headers(),
-                model=get_fast_model(),
-                messages=[{"role": "user", "content": tags_prompt}]
-            )
-            tags_text = tags_res.choices[0].message.content.strip()
-            tags_list = [t.strip() for t in tags_text.split(",") if t.strip()]
-            yield json.dumps({"type": "tags", "tags": tags_list}) + "\n"
-            
-            yield json.dumps({"type": "status", "message": "Done!"}) + "\n"
+            streams = [format_then_stages()]
+            if pipelined:
+                streams.append(_optional_stage_events("translation", _timed_stage(
+                    "translation", _pipelined_translation_stage(iterate_queue(paragraphs), target_lang)
+                )))
+
+            async for event in merge_async_iterators(*streams):
+                yield event
+
+            yield ndjson_event("status", message="Done!")
                     
         except Exception as e:
             logger.error(f"Transcription stream error: {e}")
-            yield json.dumps({"type": "error", "message": str(e)}) + "\n"
+            yield _error_event(e)
 
-    return StreamingResponse(transcription_generator(), media_type="text/event-stream")
+    # Requests for the same video and options attach to one pipeline run;
+    # late joiners get a replay of the events sent so far, then follow live.
+    # The run uses its first caller's deadline: requests that expire later start their own.
+    video_id = canonical_video_id(req.url)
+    flight_key = (
+        video_id,
+        req.target_language or "en",
+        bool(req.include_timings),
+        bool(req.pipelined_translation),
+    ) if video_id else None
+    events = transcribe_stream_flights.subscribe(flight_key, transcription_generator)
+    return StreamingResponse(_until_disconnect(request, events, "transcribe-stream"), media_type="text/event-stream")
 
 @app.get("/")
 def read_root():
     return {"status": "ok", "service": "Antigravity AI Backend"}
 
-@app.post("/api/transcribe", response_model=TranscriptResponse)
-async def api_transcribe(req: VideoRequest):
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    # Prometheus text format, per process: upstream latency, TTFT, stage durations
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/stats")
+async def api_stats(days: int = 7):
+    # Tokens, cost and latency of LLM calls by endpoint, model and stage (cache hits included)
+    return await asyncio.to_thread(usage_stats, max(days, 1))
+
+@app.get("/api/models")
+def api_models():
+    # Model tiers: preferred model, error rate and latency per stage over the router window,
+    # plus hedged requests (volume within budget and how often the duplicate won)
+    return {**router.stats(), "hedging": hedge_stats()}
+
+@app.get("/api/admission/stats")
+def api_admission_stats():
+    # Per upstream and per model: calls in flight, queued, limits and any Retry-After pause
+    return admission_stats()
+
+@app.get("/api/cache/stats")
+async def api_cache_stats():
+    from execution.transcript_cache import transcript_cache_stats
+    from execution.llm_cache import llm_cache_stats
+    return {
+        "transcripts": transcript_cache_stats(),
+        "llm": llm_cache_stats(),
+        "in_flight": {
+            "transcribe": transcribe_flights.stats(),
+            "transcribe_stream": transcribe_stream_flights.stats(),
+        },
+    }
+
+async def run_transcription(req: VideoRequest) -> TranscriptResponse:
+    # Shared by POST /api/transcribe and by "transcribe" jobs (POST /api/jobs).
+    # The result does not depend on target_language, so the video alone is the key
+    # (a caller whose deadline is later than the running pipeline's starts its own run).
+    video_id = canonical_video_id(req.url)
+    response = await transcribe_flights.call(video_id, lambda: _transcribe_pipeline(req))
+    return response.model_copy(update={"video_url": req.url})
+
+def _prepare_transcript(data):
+    from execution.process_transcript import clean_transcript
+    
+    # Captions go into a compact store, built once and cleaned in a single pass
+    # (remove [Music], etc.; segments left empty are dropped)
+    captions = CaptionStore.from_captions(data.get("captions") or []).clean()
+    
+    # 1. Clean (remove [Music], etc.)
+    if data.get("text"):
+        text = clean_transcript(data["text"])
+    else:
+        text = captions.text()
+    return text, captions
+
+def _needs_title(title):
+    return not title or "Unknown Title" in title or title == "Sconosciuto"
+
+def _youtube_images(url):
+    # Extract thumbnail URL from video ID
+    from execution.video_ids import youtube_video_id
+    video_id = youtube_video_id(url)
+    
+    thumbnail_url = None
+    frame_urls = []
+    if video_id:
+        thumbnail_url = f"https://img.youtube.com/vi/{video_id}/maxresdefault.jpg"
+        # YouTube provides 4 automatic frame captures
+        frame_urls = [
+            f"https://img.youtube.com/vi/{video_id}/0.jpg",
+            f"https://img.youtube.com/vi/{video_id}/1.jpg",
+            f"https://img.youtube.com/vi/{video_id}/2.jpg",
+            f"https://img.youtube.com/vi/{video_id}/3.jpg",
+        ]
+    return thumbnail_url, frame_urls
+
+async def _transcribe_pipeline(req: VideoRequest) -> TranscriptResponse:
     logger.info(f"Transcribing video: {req.url}")
-    try:
-        # Nota: transcribe_video è sincrono nel nostro script originale.
-        # In produzione ideale sarebbe async o in task queue, ma per MVP va bene.
-        data = transcribe_video(req.url)
-        
-        # Normalizza output
-        text = ""
-        captions = data.get("captions", [])
-        
-        if data.get("text"):
-            text = data["text"]
-        elif captions:
-            text = " ".join([c.get('text', '') for c in captions])
+    data = await transcribe_video_async(req.url)
+    
+    # Processing (Cleaning, Formatting, Titling)
+    from execution.process_transcript import format_transcript, generate_title_async
+    text, captions = _prepare_transcript(data)
+    
+    # 2. Format title if unknown
+    title = data.get("title")
+    if _needs_title(title):
+        print("Generating title via AI...")
+        title = await optional_stage("title", generate_title_async(text), fallback="Video Transcript")
 
-        # Processing (Cleaning, Formatting, Titling)
-        from execution.process_transcript import clean_transcript, format_transcript, generate_title
-        
-        # 1. Clean (remove [Music], etc.)
-        text = clean_transcript(text)
-        
-        # Also clean captions if available (for formatter)
-        if captions:
-            cleaned_captions = []
-            for cap in captions:
-                cleaned_text = clean_transcript(cap.get('text', ''))
-                if cleaned_text:  # Skip empty segments after cleaning
-                    cleaned_captions.append({**cap, 'text': cleaned_text})
-            captions = cleaned_captions
-        
-        # 2. Format title if unknown
-        title = data.get("title")
-        if not title or "Unknown Title" in title or title == "Sconosciuto":
-            print("Generating title via AI...")
-            title = generate_title(text)
-
-        # 3. Format text for readability (using captions for silence-based breaks)
-        formatted_text = format_transcript(text, captions=captions)
-        
-        # 4. Extract thumbnail URL from video ID
-        import re
-        video_id = None
-        # Match various YouTube URL formats
-        match = re.search(r'(?:v=|youtu\.be/|embed/|shorts/)([a-zA-Z0-9_-]{11})', req.url)
-        if match:
-            video_id = match.group(1)
+    # 3. Format text for readability (using captions for silence-based breaks)
+    formatted_text = format_transcript(text, captions=captions)
+    
+    # 4. Thumbnail and frames from the video ID
+    thumbnail_url, frame_urls = _youtube_images(req.url)
         
-        thumbnail_url = None
-        frame_urls = []
-        if video_id:
-            thumbnail_url = f"https://img.youtube.com/vi/{video_id}/maxresdefault.jpg"
-            # YouTube provides 4 automatic frame captures
-            frame_urls = [
-                f"https://img.youtube.com/vi/{video_id}/0.jpg",
-                f"https://img.youtube.com/vi/{video_id}/1.jpg",
-                f"https://img.youtube.com/vi/{video_id}/2.jpg",
-                f"https://img.youtube.com/vi/{video_id}/3.jpg",
-            ]
-            
-        return TranscriptResponse(
-            title=title,
-            channel=data.get("channelName", "Sconosciuto"),
-            transcript=formatted_text,
-            video_url=req.url,
-            thumbnail_url=thumbnail_url,
-            frame_urls=frame_urls
-        )
+    return TranscriptResponse(
+        title=title,
+        channel=data.get("channelName", "Sconosciuto"),
+        transcript=formatted_text,
+        video_url=req.url,
+        thumbnail_url=thumbnail_url,
+        frame_urls=frame_urls
+    )
+
+@app.post("/api/transcribe", response_model=TranscriptResponse)
+async def api_transcribe(req: VideoRequest):
+    try:
+        return await run_transcription(req)
     except Exception as e:
         logger.error(f"Error extracting transcript: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _http_error(e)
+
+# Paragraphs are sent in batches of this size, yielding to the event loop in between
+PARAGRAPH_BATCH = 50
+
+@app.post("/api/transcribe-paragraphs")
+async def api_transcribe_paragraphs(req: VideoRequest, request: Request):
+    """Streaming /api/transcribe: NDJSON paragraphs as the formatter closes them."""
+    logger.info(f"Streaming paragraphs for: {req.url}")
+    ensure_capacity("apify")
+    from execution.process_transcript import iter_format_transcript, generate_title_async
+
+    async def paragraph_generator():
+        title_task = None
+        try:
+            extraction, progress = _start_extraction(transcribe_video_async, req.url)
+            async for event in _extraction_progress(extraction, progress):
+                yield event
+            data = extraction.result()
+            text, captions = _prepare_transcript(data)
+            thumbnail_url, frame_urls = _youtube_images(req.url)
+
+            # The AI title runs in the background: it must not delay the first paragraph
+            title = data.get("title")
+            if _needs_title(title):
+                with stage_deadline("title"):
+                    title_task = asyncio.create_task(generate_title_async(text))
+                title = None
+
+            yield ndjson_event(
+                "metadata",
+                title=title,
+                channel=data.get("channelName", "Sconosciuto"),
+                video_url=req.url,
+                thumbnail_url=thumbnail_url,
+                frame_urls=frame_urls,
+                platform="youtube"
+            )
+
+            for index, paragraph in enumerate(iter_format_transcript(text, captions=captions)):
+                yield ndjson_event("paragraph", index=index, text=paragraph)
+                if index % PARAGRAPH_BATCH == PARAGRAPH_BATCH - 1:
+                    await asyncio.sleep(0)
+
+            if title_task is not None:
+                yield ndjson_event("title", title=await title_task)
+            yield ndjson_event("status", message="Done!")
+        except Exception as e:
+            logger.error(f"Paragraph stream error: {e}")
+            yield _error_event(e)
+        finally:
+            if title_task is not None and not title_task.done():
+                title_task.cancel()
+
+    return StreamingResponse(
+        _until_disconnect(request, paragraph_generator(), "transcribe-paragraphs"), media_type="text/event-stream"
+    )
+
+# Upper bound on URLs per batch request
+MAX_BATCH_URLS = int(os.getenv("MAX_BATCH_URLS", "200"))
+
+def _batch_result(url, data):
+    """Extraction result for one URL of a batch (no LLM calls: the batch is about Apify)."""
+    from execution.process_transcript import clean_transcript, format_transcript
+    if data.get("platform") == "instagram":
+        return dict(
+            platform="instagram",
+            title=data.get("title"),
+            channel=data.get("channel"),
+            transcript=clean_transcript(data.get("transcript") or ""),
+            thumbnail_url=data.get("thumbnail_url"),
+            video_mp4_url=data.get("video_mp4_url"),
+        )
+    text, captions = _prepare_transcript(data)
+    thumbnail_url, frame_urls = _youtube_images(url)
+    title = data.get("title")
+    return dict(
+        platform="youtube",
+        title=None if _needs_title(title) else title,
+        channel=data.get("channelName", "Sconosciuto"),
+        transcript=format_transcript(text, captions=captions),
+        thumbnail_url=thumbnail_url,
+        frame_urls=frame_urls,
+    )
+
+@app.post("/api/transcribe-batch")
+async def api_transcribe_batch(req: BatchTranscribeRequest, request: Request):
+    """
+    Extract many videos with as few Apify runs as possible (Instagram posts share one
+    actor run per batch). One NDJSON "result" or "error" event per URL, as soon as it is ready.
+    """
+    if not req.urls:
+        raise HTTPException(status_code=400, detail="No URLs given")
+    if len(req.urls) > MAX_BATCH_URLS:
+        raise HTTPException(status_code=400, detail=f"Too many URLs (max {MAX_BATCH_URLS})")
+    logger.info(f"Batch transcription for {len(req.urls)} URLs")
+    ensure_capacity("apify")
+
+    async def batch_generator():
+        yield ndjson_event("status", message=f"Extracting {len(req.urls)} videos...")
+        counts = {"succeeded": 0, "failed": 0}
+        progress = asyncio.Queue()
+
+        async def results():
+            try:
+                async for url, data, error in transcribe_batch_async(req.urls):
+                    if error is None:
+                        try:
+                            event = ndjson_event("result", url=url, **_batch_result(url, data))
+                        except Exception as e:
+                            error = str(e)
+                    if error is None:
+                        counts["succeeded"] += 1
+                        yield event
+                    else:
+                        counts["failed"] += 1
+                        yield ndjson_event("error", url=url, message=error)
+            finally:
+                progress.put_nowait(None)
+
+        async def progress_events():
+            async for update in iterate_queue(progress):
+                yield ndjson_event("status", message=_progress_message(update), apify=update)
+
+        try:
+            # Runs started while iterating report to `progress`; both streams are interleaved
+            with stage_span("extract_batch"), apify_progress(progress.put_nowait):
+                async for event in merge_async_iterators(results(), progress_events()):
+                    yield event
+            yield ndjson_event("status", message="Done!", **counts)
+        except Exception as e:
+            logger.error(f"Batch transcription error: {e}")
+            yield _error_event(e)
+
+    return StreamingResponse(
+        _until_disconnect(request, batch_generator(), "transcribe-batch"), media_type="text/event-stream"
+    )
+
+async def run_research(req: ResearchRequest) -> ResearchResponse:
+    logger.info("Starting research phase")
+    # 1. Estrai topics
+    target_lang = req.target_language or "it"
+    with stage_deadline("topics"):
+        topics = await extract_topics_async(req.transcript, target_lang)
+    if isinstance(topics, dict) and "error" in topics:
+         raise Exception(topics["error"])
+         
+    logger.info(f"Extracted topics: {topics}")
+    
+    # 2. Ricerca su Perplexity (topics still searching at the deadline come back as errors)
+    with stage_deadline("research"):
+        results = await research_topics_async(topics, target_lang)
+    
+    return ResearchResponse(
+        topics=topics,
+        market_research=results
+    )
 
 @app.post("/api/research", response_model=ResearchResponse)
 async def api_research(req: ResearchRequest):
-    logger.info("Starting research phase")
     try:
-        # 1. Estrai topics
-        target_lang = req.target_language or "it"
-        topics = extract_topics(req.transcript, target_lang)
-        if isinstance(topics, dict) and "error" in topics:
-             raise Exception(topics["error"])
-             
-        logger.info(f"Extracted topics: {topics}")
-        
-        # 2. Ricerca su Perplexity
-        results = research_topics(topics, target_lang)
-        
-        return ResearchResponse(
-            topics=topics,
-            market_research=results
-        )
+        return await run_research(req)
     except Exception as e:
         logger.error(f"Error in research phase: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _http_error(e)
+
+async def run_generate(req: ScriptRequest) -> ScriptResponse:
+    logger.info("Generating script")
+    # Converti i risultati ricerca in stringa per il prompt
+    research_str = json.dumps(req.research_data, indent=2, ensure_ascii=False)
+    target_lang = req.target_language or "it"
+    tone = req.tone or "educational"
+    
+    script = await generate_video_script_async(req.transcript, research_str, target_lang, tone)
+    
+    return ScriptResponse(script_content=script)
 
 @app.post("/api/generate", response_model=ScriptResponse)
 async def api_generate(req: ScriptRequest):
-    logger.info("Generating script")
     try:
-        # Converti i risultati ricerca in stringa per il prompt
-        research_str = json.dumps(req.research_data, indent=2, ensure_ascii=False)
-        target_lang = req.target_language or "it"
-        tone = req.tone or "educational"
-        
-        script = generate_video_script(req.transcript, research_str, target_lang, tone)
-        
-        return ScriptResponse(script_content=script)
+        return await run_generate(req)
     except Exception as e:
         logger.error(f"Error generating script: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _http_error(e)
+
+@app.post("/api/generate-stream")
+async def api_generate_stream(req: ScriptRequest, request: Request):
+    """Streaming /api/generate: NDJSON script tokens as the model writes them."""
+    logger.info("Streaming script generation")
+    ensure_capacity("openrouter")
+    research_str = json.dumps(req.research_data, indent=2, ensure_ascii=False)
+    target_lang = req.target_language or "it"
+    tone = req.tone or "educational"
+
+    async def script_generator():
+        try:
+            if len(req.transcript) > SCRIPT_TRANSCRIPT_MAX_CHARS:
+                yield ndjson_event("status", message="Condensing long transcript...")
+            yield ndjson_event("status", message="Writing script...")
+            async for c in generate_video_script_stream(req.transcript, research_str, target_lang, tone):
+                yield ndjson_event("script", text=c)
+            yield ndjson_event("status", message="Done!")
+        except Exception as e:
+            logger.error(f"Script stream error: {e}")
+            yield _error_event(e)
+
+    return StreamingResponse(
+        _until_disconnect(request, script_generator(), "generate-stream"), media_type="text/event-stream"
+    )
+
+async def run_generate_from_topic(req: TopicGenerateRequest) -> TopicGenerateResponse:
+    logger.info(f"Generating from topic: {req.topic}")
+    target_lang = req.target_language or "it"
+    tone = req.tone or "educational"
+    
+    # 1. Extract related topics from the main topic
+    logger.info("Extracting related topics...")
+    with stage_deadline("topics"):
+        topics = await extract_topics_async(req.topic, target_lang)
+    if isinstance(topics, dict) and "error" in topics:
+        raise Exception(topics["error"])
+    
+    logger.info(f"Extracted topics: {topics}")
+    
+    # 2. Research the topics
+    logger.info("Researching topics...")
+    with stage_deadline("research"):
+        research_results = await research_topics_async(topics, target_lang)
+    
+    # 3. Generate script based on topic and research (no transcript)
+    logger.info(f"Generating script with tone: {tone}")
+    research_str = json.dumps(research_results, indent=2, ensure_ascii=False)
+    
+    # For topic-based generation, we use the topic as the "transcript" context
+    topic_context = f"Topic: {req.topic}\n\nRelated Topics: {', '.join(topics)}"
+    script = await generate_video_script_async(topic_context, research_str, target_lang, tone)
+    
+    return TopicGenerateResponse(
+        topics=topics,
+        market_research=research_results,
+        script_content=script
+    )
 
 @app.post("/api/generate-from-topic", response_model=TopicGenerateResponse)
 async def api_generate_from_topic(req: TopicGenerateRequest):
-    logger.info(f"Generating from topic: {req.topic}")
     try:
-        target_lang = req.target_language or "it"
-        tone = req.tone or "educational"
-        
-        # 1. Extract related topics from the main topic
-        logger.info("Extracting related topics...")
-        topics = extract_topics(req.topic, target_lang)
-        if isinstance(topics, dict) and "error" in topics:
-            raise Exception(topics["error"])
-        
-        logger.info(f"Extracted topics: {topics}")
-        
-        # 2. Research the topics
-        logger.info("Researching topics...")
-        research_results = research_topics(topics, target_lang)
-        
-        # 3. Generate script based on topic and research (no transcript)
-        logger.info(f"Generating script with tone: {tone}")
-        research_str = json.dumps(research_results, indent=2, ensure_ascii=False)
-        
-        # For topic-based generation, we use the topic as the "transcript" context
-        topic_context = f"Topic: {req.topic}\n\nRelated Topics: {', '.join(topics)}"
-        script = generate_video_script(topic_context, research_str, target_lang, tone)
-        
-        return TopicGenerateResponse(
-            topics=topics,
-            market_research=research_results,
-            script_content=script
-        )
+        return await run_generate_from_topic(req)
     except Exception as e:
         logger.error(f"Error generating from topic: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _http_error(e)
+
+@app.post("/api/generate-from-topic-stream")
+async def api_generate_from_topic_stream(req: TopicGenerateRequest, request: Request):
+    """
+    Streaming /api/generate-from-topic: topics as soon as they are extracted,
+    each research result as it completes, then the script tokens.
+    """
+    logger.info(f"Streaming generation from topic: {req.topic}")
+    ensure_capacity("openrouter", "perplexity")
+    target_lang = req.target_language or "it"
+    tone = req.tone or "educational"
+
+    async def topic_generator():
+        try:
+            yield ndjson_event("status", message="Extracting related topics...")
+            with stage_deadline("topics"):
+                topics = await extract_topics_async(req.topic, target_lang)
+            if isinstance(topics, dict) and "error" in topics:
+                raise Exception(topics["error"])
+            yield ndjson_event("topics", topics=topics)
+
+            yield ndjson_event("status", message="Researching topics...")
+            research_results = []
+            with stage_deadline("research"):
+                async for result in iter_research_topics(topics, target_lang):
+                    research_results.append(result)
+                    yield ndjson_event("research", **result)
+            # Back in topic order: the script prompt must not depend on which search finished first
+            research_results.sort(key=lambda r: topics.index(r["topic"]))
+
+            yield ndjson_event("status", message=f"Writing script ({tone})...")
+            research_str = json.dumps(research_results, indent=2, ensure_ascii=False)
+            topic_context = f"Topic: {req.topic}\n\nRelated Topics: {', '.join(topics)}"
+            async for c in generate_video_script_stream(topic_context, research_str, target_lang, tone):
+                yield ndjson_event("script", text=c)
+            yield ndjson_event("status", message="Done!")
+        except Exception as e:
+            logger.error(f"Topic generation stream error: {e}")
+            yield _error_event(e)
+
+    return StreamingResponse(
+        _until_disconnect(request, topic_generator(), "generate-from-topic-stream"), media_type="text/event-stream"
+    )
+
+# Background jobs: same pipelines as the endpoints above, run on a bounded worker pool
+# (nobody is waiting on the connection, so they get the longest deadline)
+JOB_DEADLINE_SECONDS = float(os.getenv("JOB_DEADLINE_SECONDS", str(MAX_REQUEST_DEADLINE_SECONDS)))
+JOB_TYPES = {
+    "transcribe": (VideoRequest, run_transcription),
+    "research": (ResearchRequest, run_research),
+    "generate": (ScriptRequest, run_generate),
+    "generate-from-topic": (TopicGenerateRequest, run_generate_from_topic),
+}
+
+def _job_handler(job_type, request_model, pipeline):
+    async def handler(payload):
+        set_endpoint(f"job:{job_type}")
+        set_deadline(JOB_DEADLINE_SECONDS)
+        response = await pipeline(request_model(**payload))
+        return response.model_dump()
+    return handler
+
+job_manager = JobManager()
+for _job_type, (_request_model, _pipeline) in JOB_TYPES.items():
+    job_manager.register(_job_type, _job_handler(_job_type, _request_model, _pipeline))
+
+def _job_response(job):
+    return JobResponse(**{field: job[field] for field in JobResponse.model_fields})
+
+@app.post("/api/jobs", response_model=JobResponse, status_code=202)
+async def api_submit_job(req: JobRequest):
+    if req.type not in JOB_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unknown job type: {req.type}")
+    request_model, _ = JOB_TYPES[req.type]
+    try:
+        # Validate now, so a bad payload fails here and not on the worker
+        payload = request_model(**req.payload).model_dump()
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors())
+    job_id = await job_manager.submit(req.type, payload)
+    logger.info(f"Queued {req.type} job {job_id}")
+    return _job_response(await job_manager.get(job_id))
+
+@app.get("/api/jobs/stats")
+async def api_job_stats():
+    return await job_manager.stats()
+
+@app.get("/api/jobs/{job_id}", response_model=JobResponse)
+async def api_get_job(job_id: str):
+    job = await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _job_response(job)
+
+@app.get("/api/jobs/{job_id}/stream")
+async def api_stream_job(job_id: str):
+    if await job_manager.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def job_events():
+        async for job in job_manager.watch(job_id):
+            yield ndjson_event("status", status=job["status"], attempts=job["attempts"])
+            if job["status"] in FINISHED_STATES:
+                if job["error"] is not None:
+                    yield ndjson_event("error", message=job["error"])
+                else:
+                    yield ndjson_event("result", result=job["result"])
+
+    return StreamingResponse(job_events(), media_type="text/event-stream")
 
 @app.post("/api/translate-stream")
-async def api_translate_stream(req: TranslateRequest):
+async def api_translate_stream(req: TranslateRequest, request: Request):
     """Stream translation to target language using LLM."""
     logger.info(f"Streaming translation to: {req.target_language}")
+    ensure_capacity("openrouter")
     
     language_names = {
         'it': 'Italian',
@@ -453,32 +1121,31 @@ async def api_translate_stream(req: TranslateRequest):
     }
     target_lang_name = language_names.get(req.target_language, req.target_language)
 
-    async def translation_generator():
-        try:
-            from execution.llm_utils import get_openrouter_client, get_fast_model, get_extra_headers
-            client = get_openrouter_client()
-            
-            prompt = f"""Translate the following text to {target_lang_name}.
+    async def translate_chunk(chunk):
+        prompt = f"""Translate the following text to {target_lang_name}.
 Preserve original formatting. Return ONLY translated text.
 
 Text:
-{req.text}"""
+{chunk}"""
 
-            response = client.chat.completions.create(
-                extra_headers=get_extra_headers(),
-                model=get_fast_model(),
-                messages=[{"role": "user", "content": prompt}],
-                stream=True,
-            )
+        async for c in chat_completion_stream(
+            stage="translate",
+            messages=[{"role": "user", "content": prompt}],
+        ):
+            yield c
 
-            for chunk in response:
-                if chunk.choices[0].delta.content:
-                    yield chunk.choices[0].delta.content
+    async def translation_generator():
+        try:
+            # Long texts are translated chunk by chunk in parallel, streamed in order
+            async for c in map_chunks_stream(split_text(req.text), translate_chunk):
+                yield c
         except Exception as e:
             logger.error(f"Streaming error: {e}")
             yield f"Error: {str(e)}"
 
-    return StreamingResponse(translation_generator(), media_type="text/plain")
+    return StreamingResponse(
+        _until_disconnect(request, translation_generator(), "translate-stream"), media_type="text/plain"
+    )
 
 @app.post("/api/translate", response_model=TranslateResponse)
 async def api_translate(req: TranslateRequest):
@@ -497,10 +1164,6 @@ async def api_translate(req: TranslateRequest):
     target_lang_name = language_names.get(req.target_language, req.target_language)
     
     try:
-        from execution.llm_utils import get_openrouter_client, get_fast_model, get_extra_headers
-        
-        client = get_openrouter_client()
-        
         # Use fast model for translation
         # Added special instruction for JSON-like strings to preserve keys and structure
         instruction = "Preserve the original formatting (line breaks, paragraphs). Return ONLY the translated text, no explanations."
@@ -513,16 +1176,14 @@ async def api_translate(req: TranslateRequest):
 Content to translate:
 {req.text}"""
         
-        completion = client.chat.completions.create(
-            extra_headers=get_extra_headers(),
-            model=get_fast_model(),
+        translated_text = await chat_completion(
+            stage="translate",
+            tier="fast",
             messages=[
                 {"role": "user", "content": prompt},
             ],
         )
         
-        translated_text = completion.choices[0].message.content
-        
         # Cleanup: if it looks like JSON, remove common LLM conversational bloat
         if req.text.strip().startswith('{') or req.text.strip().startswith('['):
             # Remove markdown code blocks if present
@@ -540,7 +1201,7 @@ Content to translate:
         
     except Exception as e:
         logger.error(f"Error translating: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _http_error(e)
 
 if __name__ == "__main__":
     import uvicorn
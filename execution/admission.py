@@ -0,0 +1,321 @@
+"""
+Controllo di ammissione verso gli upstream (OpenRouter, Perplexity, Apify).
+
+Ogni upstream, e ogni modello LLM, ha un Limiter con:
+- un limite di chiamate contemporanee (<UPSTREAM>_MAX_CONCURRENCY)
+- un limite di chiamate al secondo, a token bucket (<UPSTREAM>_RATE_PER_SECOND, 0 = nessuno)
+- una coda di attesa limitata (<UPSTREAM>_MAX_QUEUE)
+
+Le chiamate in eccesso aspettano in coda; se la coda è piena, o l'attesa stimata
+supera il tempo rimasto alla richiesta (execution.deadline), vengono scartate
+subito con Overloaded (503) invece di accumularsi fino al timeout.
+
+Un 429 dell'upstream mette in pausa il Limiter (dell'upstream, o del solo modello se a
+limitare è il provider a valle) per il Retry-After indicato (o per un backoff
+esponenziale se manca) e la chiamata, liberato il posto, viene ritentata finché c'è tempo;
+altrimenti RateLimited (429). Così sotto un picco il throughput resta al limite
+del provider invece di collassare in errori.
+"""
+import os
+import time
+import random
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+from execution.tracing import Counter, register
+from execution.deadline import remaining
+
+logger = logging.getLogger(__name__)
+
+# Default per upstream: (chiamate contemporanee, chiamate al secondo, coda massima)
+DEFAULT_LIMITS = {
+    "openrouter": (64, 0, 256),
+    "perplexity": (8, 2, 64),
+    "apify": (10, 5, 100),
+}
+# Limite per singolo modello LLM, sovrascrivibile con MODEL_LIMITS="modello=concorrenza[:al secondo],..."
+MODEL_MAX_CONCURRENCY = int(os.getenv("MODEL_MAX_CONCURRENCY", "32"))
+MODEL_MAX_QUEUE = int(os.getenv("MODEL_MAX_QUEUE", "128"))
+
+ADMISSION_MAX_RETRIES = int(os.getenv("ADMISSION_MAX_RETRIES", "3"))
+# Backoff quando il 429 non indica Retry-After: base * 2^tentativo, con jitter
+ADMISSION_BACKOFF_SECONDS = float(os.getenv("ADMISSION_BACKOFF_SECONDS", "1"))
+ADMISSION_MAX_BACKOFF_SECONDS = float(os.getenv("ADMISSION_MAX_BACKOFF_SECONDS", "30"))
+
+ADMISSION_REJECTED = register(Counter(
+    "admission_rejected_total",
+    "Upstream calls shed before being sent, by limiter and reason (queue_full, deadline, rate_limited).",
+    ("limiter", "reason"),
+))
+ADMISSION_RATE_LIMITED = register(Counter(
+    "admission_rate_limited_total",
+    "429 responses received from upstreams, by limiter.",
+    ("limiter",),
+))
+
+class Overloaded(Exception):
+    """La chiamata non può essere servita in tempo: coda piena o attesa oltre la scadenza (503)."""
+
+    def __init__(self, limiter, retry_after):
+        self.limiter = limiter
+        self.retry_after = retry_after
+        super().__init__(f"{limiter} is overloaded, retry in {retry_after:.0f}s")
+
+class RateLimited(Exception):
+    """L'upstream continua a rispondere 429 e non c'è più tempo per riprovare (429)."""
+
+    def __init__(self, limiter, retry_after):
+        self.limiter = limiter
+        self.retry_after = retry_after
+        super().__init__(f"{limiter} is rate limiting requests, retry in {retry_after:.0f}s")
+
+def _env_limits(upstream):
+    concurrency, rate, queue = DEFAULT_LIMITS[upstream]
+    prefix = upstream.upper()
+    return (
+        int(os.getenv(f"{prefix}_MAX_CONCURRENCY", str(concurrency))),
+        float(os.getenv(f"{prefix}_RATE_PER_SECOND", str(rate))),
+        int(os.getenv(f"{prefix}_MAX_QUEUE", str(queue))),
+    )
+
+def _model_limits():
+    limits = {}
+    for item in os.getenv("MODEL_LIMITS", "").split(","):
+        model, _, value = item.partition("=")
+        if model.strip() and value.strip():
+            concurrency, _, rate = value.partition(":")
+            limits[model.strip()] = (int(concurrency), float(rate or 0))
+    return limits
+
+class Limiter:
+    def __init__(self, name, concurrency, rate=0, max_queue=100):
+        self.name = name
+        self.concurrency = max(concurrency, 1)
+        self.rate = rate
+        self.max_queue = max_queue
+        self.active = 0
+        self.waiting = 0
+        self.paused_until = 0.0
+        self._changed = asyncio.Event()
+        self._tokens = float(max(rate, 1))
+        self._refilled = time.monotonic()
+        # Durata media di una chiamata (per stimare l'attesa in coda)
+        self._hold = 1.0
+
+    def _refill(self, now):
+        if self.rate:
+            self._tokens = min(max(self.rate, 1), self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def expected_wait(self):
+        """Stima dell'attesa per una nuova chiamata: pausa per 429, più la coda davanti."""
+        now = time.monotonic()
+        wait = max(self.paused_until - now, 0.0)
+        if self.active + self.waiting >= self.concurrency:
+            wait += (self.waiting + 1) / self.concurrency * self._hold
+        if self.rate:
+            wait = max(wait, self.waiting / self.rate)
+        return wait
+
+    def saturated(self):
+        return self.waiting >= self.max_queue
+
+    def _shed(self, reason, retry_after):
+        ADMISSION_REJECTED.inc(limiter=self.name, reason=reason)
+        raise Overloaded(self.name, max(retry_after, 1.0))
+
+    async def acquire(self):
+        if self.saturated():
+            self._shed("queue_full", self.expected_wait())
+        left = remaining()
+        expected = self.expected_wait()
+        if left is not None and expected > left:
+            # Non arriverebbe in tempo: meglio rifiutarla subito che dopo l'attesa
+            self._shed("deadline", expected)
+
+        self.waiting += 1
+        try:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                delay = self.paused_until - now
+                if delay <= 0 and self.rate and self._tokens < 1:
+                    delay = (1 - self._tokens) / self.rate
+                if delay <= 0 and self.active < self.concurrency:
+                    break
+                left = remaining()
+                if left is not None and left <= max(delay, 0):
+                    self._shed("deadline", max(delay, self.expected_wait()))
+                # Risvegli: a ogni release, o allo scadere della pausa / del prossimo token
+                timeout = delay if delay > 0 else None
+                if left is not None:
+                    timeout = left if timeout is None else min(timeout, left)
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            if self.rate:
+                self._tokens -= 1
+            self.active += 1
+        finally:
+            self.waiting -= 1
+        return time.monotonic()
+
+    def _notify(self):
+        # Sveglia chi è in coda; l'evento successivo vale per le attese future
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def release(self, acquired_at):
+        # Sincrona: va a buon fine anche da un task cancellato
+        self._hold = 0.9 * self._hold + 0.1 * (time.monotonic() - acquired_at)
+        self.active -= 1
+        self._notify()
+
+    def pause(self, seconds):
+        """Nessuna nuova chiamata per `seconds` (Retry-After di un 429)."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self._notify()
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "concurrency": self.concurrency,
+            "rate_per_second": self.rate,
+            "max_queue": self.max_queue,
+            "paused_seconds": round(max(self.paused_until - time.monotonic(), 0), 1),
+            "expected_wait_seconds": round(self.expected_wait(), 2),
+        }
+
+_limiters = {}
+_limiters_loop = None
+
+def _registry():
+    # Le code asyncio sono legate all'event loop: nuovi limiter se cambia il loop (es. asyncio.run negli script CLI)
+    global _limiters_loop
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    if loop is not _limiters_loop:
+        _limiters.clear()
+        _limiters_loop = loop
+    return _limiters
+
+def limiter(upstream):
+    _limiters = _registry()
+    lim = _limiters.get(upstream)
+    if lim is None:
+        lim = _limiters[upstream] = Limiter(upstream, *_env_limits(upstream))
+    return lim
+
+def model_limiter(model):
+    key = f"model:{model}"
+    _limiters = _registry()
+    lim = _limiters.get(key)
+    if lim is None:
+        concurrency, rate = _model_limits().get(model, (MODEL_MAX_CONCURRENCY, 0))
+        lim = _limiters[key] = Limiter(key, concurrency, rate, MODEL_MAX_QUEUE)
+    return lim
+
+def llm_upstream(model):
+    # Perplexity passa da OpenRouter ma ha limiti suoi, molto più stretti
+    return "perplexity" if model.startswith("perplexity/") else "openrouter"
+
+def _limiters_for(upstream, model):
+    return [limiter(upstream)] + ([model_limiter(model)] if model else [])
+
+@asynccontextmanager
+async def admitted(upstream, model=None):
+    """Occupa un posto sull'upstream (e sul modello): in coda se serve, Overloaded se non c'è tempo."""
+    held = []
+    try:
+        for lim in _limiters_for(upstream, model):
+            held.append((lim, await lim.acquire()))
+        yield
+    finally:
+        for lim, acquired_at in reversed(held):
+            lim.release(acquired_at)
+
+def ensure_capacity(*upstreams):
+    """Solleva Overloaded se uno degli upstream ha già la coda piena (scarto prima di iniziare la richiesta)."""
+    for upstream in upstreams:
+        lim = limiter(upstream)
+        if lim.saturated():
+            lim._shed("queue_full", lim.expected_wait())
+
+def _retry_after(error):
+    # openai: e.response.headers; apify-client espone solo status_code
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    value = headers.get("retry-after")
+    try:
+        return max(float(value), 0.0) if value is not None else None
+    except ValueError:
+        return None
+
+def is_rate_limited(error):
+    return getattr(error, "status_code", None) == 429
+
+def _rate_limited_scope(error, upstream, model):
+    """
+    Limiter da mettere in pausa per un 429: solo il modello se a limitarlo è il provider
+    a valle di OpenRouter (metadata.provider_name nel corpo dell'errore), altrimenti
+    l'intero upstream, perché il limite è quello dell'account.
+    """
+    if model:
+        body = getattr(error, "body", None)
+        metadata = body.get("metadata") if isinstance(body, dict) else None
+        if isinstance(metadata, dict) and metadata.get("provider_name"):
+            return [model_limiter(model)]
+        return [limiter(upstream), model_limiter(model)]
+    return [limiter(upstream)]
+
+def _pause_for_rate_limit(error, attempt, upstream, model):
+    """Mette in pausa i limiter colpiti dal 429 e restituisce l'attesa; RateLimited se non si può riprovare."""
+    limiters = _rate_limited_scope(error, upstream, model)
+    name = limiters[0].name
+    ADMISSION_RATE_LIMITED.inc(limiter=name)
+    delay = _retry_after(error)
+    if delay is None:
+        delay = min(ADMISSION_BACKOFF_SECONDS * 2 ** attempt, ADMISSION_MAX_BACKOFF_SECONDS)
+        delay *= random.uniform(0.8, 1.2)
+    for lim in limiters:
+        lim.pause(delay)
+    left = remaining()
+    if attempt == ADMISSION_MAX_RETRIES or (left is not None and delay >= left):
+        ADMISSION_REJECTED.inc(limiter=name, reason="rate_limited")
+        raise RateLimited(name, delay) from error
+    logger.warning(f"{name} answered 429, retrying in {delay:.1f}s")
+    return delay
+
+@asynccontextmanager
+async def admitted_call(call, upstream, model=None):
+    """
+    Occupa un posto sull'upstream (e sul modello) ed esegue `call()` (factory di coroutine);
+    il risultato è disponibile nel blocco, con il posto ancora occupato (es. per uno stream).
+    Su 429 il posto viene liberato, i limiter colpiti vanno in pausa per il Retry-After e
+    la chiamata si rimette in coda, al massimo ADMISSION_MAX_RETRIES volte e solo se c'è tempo.
+    """
+    for attempt in range(ADMISSION_MAX_RETRIES + 1):
+        async with admitted(upstream, model):
+            try:
+                result = await call()
+            except Exception as e:
+                if not is_rate_limited(e):
+                    raise
+                delay = _pause_for_rate_limit(e, attempt, upstream, model)
+            else:
+                yield result
+                return
+        # L'attesa avviene fuori dal posto: durante un'ondata di 429 i posti restano a chi è in coda
+        await asyncio.sleep(delay)
+
+async def retry_rate_limited(call, upstream, model=None):
+    """Come admitted_call, ma il posto si libera appena `call()` ha risposto."""
+    async with admitted_call(call, upstream, model) as result:
+        return result
+
+def admission_stats():
+    return {name: lim.stats() for name, lim in sorted(_limiters.items())}
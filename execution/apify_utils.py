@@ -0,0 +1,152 @@
+"""
+Run Apify non bloccanti.
+
+Invece di actor.call() (che attende la fine della run) e list_items() (che carica
+tutto il dataset in memoria):
+- run_actor() avvia la run e ne interroga lo stato ogni APIFY_POLL_SECONDS, fino a
+  una scadenza configurabile (o a quella della richiesta, se più vicina); se la
+  scadenza passa, o il chiamante viene cancellato (es. il client si è disconnesso),
+  la run viene abortita per non pagare tempo di actor che nessuno leggerà
+- iterate_dataset() legge gli elementi del dataset a pagine, man mano che servono
+- apify_progress() registra una callback che riceve lo stato delle run avviate
+  nel contesto corrente (per gli eventi di avanzamento dello stream NDJSON)
+"""
+import os
+import time
+import asyncio
+import logging
+from contextvars import ContextVar
+from contextlib import contextmanager
+from apify_client import ApifyClientAsync
+
+from execution.tracing import span
+from execution.deadline import DeadlineExceeded, remaining, bounded, wait_within
+from execution.admission import admitted_call
+
+logger = logging.getLogger(__name__)
+
+APIFY_RUN_TIMEOUT = float(os.getenv("APIFY_RUN_TIMEOUT", "300"))
+APIFY_POLL_SECONDS = float(os.getenv("APIFY_POLL_SECONDS", "2"))
+
+TERMINAL_STATUSES = {"SUCCEEDED", "FAILED", "ABORTED", "TIMED-OUT"}
+
+# Callback di avanzamento delle run avviate nel contesto corrente (e nei task figli)
+_progress_callback = ContextVar("apify_progress", default=None)
+
+class ApifyRunError(Exception):
+    """La run è terminata senza successo (FAILED, ABORTED, TIMED-OUT) o ha superato la scadenza."""
+
+@contextmanager
+def apify_progress(callback):
+    """
+    `callback(evento)` viene chiamata a ogni cambio di stato delle run avviate
+    dentro il blocco; evento: {"stage", "run_id", "status", "message", "elapsed"}.
+    """
+    token = _progress_callback.set(callback)
+    try:
+        yield
+    finally:
+        _progress_callback.reset(token)
+
+def get_client():
+    api_token = os.getenv("APIFY_API_TOKEN")
+    if not api_token:
+        raise ValueError("APIFY_API_TOKEN non trovato nel file .env")
+    return ApifyClientAsync(api_token)
+
+def _as_dict(run):
+    # apify-client 1.x/2.x restituisce dict, 3.x modelli pydantic (con alias camelCase)
+    if run is None or isinstance(run, dict):
+        return run
+    return run.model_dump(by_alias=True, mode="json")
+
+def _notify(stage, run, elapsed):
+    callback = _progress_callback.get()
+    if callback is None:
+        return
+    try:
+        callback({
+            "stage": stage,
+            "run_id": run.get("id"),
+            "status": run.get("status"),
+            "message": run.get("statusMessage") or "",
+            "elapsed": round(elapsed, 1),
+        })
+    except Exception as e:
+        logger.warning(f"Apify progress callback failed: {e}")
+
+async def _abort(client, run_id):
+    try:
+        await client.run(run_id).abort()
+        logger.info(f"Aborted Apify run {run_id}")
+    except Exception as e:
+        logger.warning(f"Could not abort Apify run {run_id}: {e}")
+
+async def run_actor(actor_id, run_input, stage="", timeout=None, client=None):
+    """
+    Avvia l'actor e attende la fine della run senza bloccare, interrogandone lo stato.
+    Restituisce la run (dict, con defaultDatasetId) se SUCCEEDED, altrimenti ApifyRunError.
+    """
+    client = client or get_client()
+    run_timeout = APIFY_RUN_TIMEOUT if timeout is None else timeout
+
+    with span("apify", "actor_run", stage=stage):
+        # Run contemporanee limitate (APIFY_MAX_CONCURRENCY): il posto resta occupato fino alla fine della run
+        async with admitted_call(
+            lambda: wait_within(client.actor(actor_id).start(run_input=run_input), stage=stage), "apify"
+        ) as run:
+            # La scadenza della richiesta, se più vicina, prevale su quella della run
+            started = time.monotonic()
+            left = remaining()
+            by_request = left is not None and left < run_timeout
+            timeout = bounded(run_timeout)
+            run = _as_dict(run)
+            run_id = run["id"]
+            last_seen = None
+            finished = False
+            try:
+                while True:
+                    elapsed = time.monotonic() - started
+                    seen = (run.get("status"), run.get("statusMessage"))
+                    if seen != last_seen:
+                        _notify(stage, run, elapsed)
+                        last_seen = seen
+                    if run.get("status") in TERMINAL_STATUSES:
+                        finished = True
+                        break
+                    if elapsed >= timeout:
+                        if by_request:
+                            raise DeadlineExceeded(stage)
+                        raise ApifyRunError(f"Run Apify {run_id} ({actor_id}) oltre la scadenza di {timeout:g}s")
+                    await asyncio.sleep(min(APIFY_POLL_SECONDS, timeout - elapsed))
+                    run = _as_dict(await wait_within(client.run(run_id).get(), stage=stage)) or run
+            finally:
+                if not finished:
+                    # Scadenza, errore o cancellazione: la run non serve più.
+                    # Lo shield fa arrivare l'abort anche se il task viene cancellato di nuovo.
+                    await asyncio.shield(_abort(client, run_id))
+
+    if run.get("status") != "SUCCEEDED":
+        raise ApifyRunError(
+            f"Run Apify {run_id} ({actor_id}) terminata con stato {run.get('status')}: {run.get('statusMessage') or ''}"
+        )
+    return run
+
+async def iterate_dataset(dataset_id, stage="", limit=None, client=None):
+    """Elementi del dataset letti a pagine, senza caricarlo tutto in memoria."""
+    client = client or get_client()
+    with span("apify", "dataset_fetch", stage=stage):
+        items = client.dataset(dataset_id).iterate_items(limit=limit).__aiter__()
+        while True:
+            try:
+                item = await wait_within(items.__anext__(), stage=stage)
+            except StopAsyncIteration:
+                return
+            yield item
+
+async def first_item(dataset_id, stage="", client=None):
+    """Il primo elemento del dataset, o None se è vuoto (una sola pagina da un elemento)."""
+    client = client or get_client()
+    with span("apify", "dataset_fetch", stage=stage):
+        page = await wait_within(client.dataset(dataset_id).list_items(limit=1), stage=stage)
+    return page.items[0] if page.items else None
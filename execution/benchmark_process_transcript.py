@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Nome Script: benchmark_process_transcript.py
+
+Scopo:
+    Microbenchmark offline (nessuna chiamata API) dell'elaborazione testuale dei transcript:
+    clean_transcript, format_transcript (con e senza caption), preparazione del prompt
+    del titolo, chunking e serializzazione degli eventi NDJSON dello stream, su transcript
+    sintetici da 1 minuto a 5 ore. Serve a capire se l'elaborazione del testo diventa
+    un collo di bottiglia con molte caption e a confrontare i risultati tra commit.
+
+Uso:
+    python execution/benchmark_process_transcript.py [--sizes 1,10,60,300] [--repeat 5]
+        [--only clean,format_captions] [--output file.json] [--compare baseline.json]
+
+Input:
+    - --sizes: durate dei video sintetici in minuti (default 1,10,60,180,300)
+    - --repeat: ripetizioni per misura; si riporta minimo e mediana (default 5)
+    - --only: esegue solo i benchmark indicati (nomi separati da virgola)
+    - --output: file JSON dei risultati (default .tmp/benchmarks/<data>_<commit>.json)
+    - --compare: file JSON di una run precedente da confrontare con questa
+
+Output:
+    Tabella dei tempi su stdout e risultati in JSON (con commit git, versione di Python e piattaforma).
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import statistics
+import subprocess
+
+# Permette l'esecuzione diretta dello script (python execution/benchmark_process_transcript.py)
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PROJECT_ROOT)
+
+from execution.process_transcript import clean_transcript, format_transcript, build_title_prompt
+from execution.chunking import split_text, split_captions
+from execution.caption_store import CaptionStore
+from execution.stream_utils import ndjson_event, ParagraphSplitter
+
+DEFAULT_SIZES = (1, 10, 60, 180, 300)
+BENCHMARK_DIR = os.path.join(PROJECT_ROOT, ".tmp", "benchmarks")
+
+# Parlato tipico: ~150 parole al minuto, una caption ogni ~3 secondi
+WORDS_PER_MINUTE = 150
+CAPTION_SECONDS = 3.0
+STREAM_DELTA_CHARS = 4  # dimensione media di un delta di testo nello stream LLM
+
+_VOCABULARY = (
+    "the of and to in is that it for you was on are with as this be at have from or one "
+    "video today we will talk about market growth data model people think really important "
+    "because example first second next finally result business content strategy youtube "
+    "channel audience idea question answer reason story time year world money product"
+).split()
+_NOISE = ("[Music]", "[Applause]", "(laughs)", "[Musica]", "(inaudible)")
+
+def synthetic_captions(minutes, seed=42):
+    """Caption sintetiche deterministiche: testo con rumore ([Music], (laughs)), pause e punteggiatura."""
+    rng = random.Random(seed + minutes)
+    captions = []
+    start = 0.0
+    words_per_caption = max(1, round(WORDS_PER_MINUTE * CAPTION_SECONDS / 60))
+    for i in range(int(minutes * 60 / CAPTION_SECONDS)):
+        words = [rng.choice(_VOCABULARY) for _ in range(words_per_caption)]
+        if rng.random() < 0.05:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(_NOISE))
+        text = " ".join(words)
+        if rng.random() < 0.3:
+            text += rng.choice(".!?")
+        dur = CAPTION_SECONDS * rng.uniform(0.8, 1.0)
+        captions.append({"text": text, "start": f"{start:.2f}", "dur": f"{dur:.2f}"})
+        # Ogni tanto una pausa oltre la soglia di silenzio del formatter
+        start += dur + (rng.uniform(0.3, 1.5) if rng.random() < 0.1 else 0.05)
+    return captions
+
+def _clean_captions_per_item(captions):
+    # Pulizia caption per caption su lista di dict (il percorso precedente a CaptionStore)
+    cleaned = []
+    for cap in captions:
+        text = clean_transcript(cap.get("text", ""))
+        if text:
+            cleaned.append({**cap, "text": text})
+    return cleaned
+
+def _format_caption_dicts(text, captions):
+    # Formatter su lista di dict com'era prima di CaptionStore (float() e strip() per caption);
+    # la punteggiatura finale è la stessa di format_transcript sul solo testo
+    SILENCE_THRESHOLD = 0.25
+    MAX_SEGMENTS_PER_PARAGRAPH = 5
+    formatted_chunks = []
+    current_paragraph = []
+    last_end = 0.0
+    segment_count = 0
+    for i, cap in enumerate(captions):
+        seg_text = cap.get('text', '').strip()
+        if not seg_text:
+            continue
+        try:
+            start = float(cap.get('start', 0))
+            end = start + float(cap.get('dur', 0))
+        except (ValueError, TypeError):
+            start, end = 0, 0
+        is_new_paragraph = i > 0 and (
+            start - last_end > SILENCE_THRESHOLD
+            or segment_count >= MAX_SEGMENTS_PER_PARAGRAPH
+            or (current_paragraph and current_paragraph[-1].rstrip().endswith(('.', '!', '?')))
+        )
+        if is_new_paragraph and current_paragraph:
+            formatted_chunks.append(" ".join(current_paragraph))
+            current_paragraph = []
+            segment_count = 0
+        current_paragraph.append(seg_text)
+        segment_count += 1
+        last_end = end
+    if current_paragraph:
+        formatted_chunks.append(" ".join(current_paragraph))
+    if formatted_chunks:
+        text = "\n\n".join(formatted_chunks)
+    return format_transcript(text)
+
+def _clean_captions(captions):
+    # Stessa pulizia fatta da /api/transcribe prima del formatter
+    return CaptionStore.from_captions(captions).clean()
+
+def _stream_events(formatted_text):
+    # Gli eventi di transcription_generator per un transcript: content + translation a piccoli
+    # delta, poi paraphrase e tags in un colpo solo
+    splitter = ParagraphSplitter()
+    lines = 0
+    for kind in ("content", "translation"):
+        for i in range(0, len(formatted_text), STREAM_DELTA_CHARS):
+            delta = formatted_text[i:i + STREAM_DELTA_CHARS]
+            lines += len(ndjson_event(kind, text=delta))
+            if kind == "content":
+                splitter.feed(delta)
+    splitter.flush()
+    lines += len(ndjson_event("paraphrase", text=formatted_text))
+    lines += len(ndjson_event("tags", tags=_VOCABULARY[:10]))
+    return lines
+
+def build_benchmarks(captions):
+    """Nome -> funzione senza argomenti, con gli input già preparati (fuori dalla misura)."""
+    raw_text = " ".join(c["text"] for c in captions)
+    cleaned_text = clean_transcript(raw_text)
+    cleaned_captions = _clean_captions(captions)
+    cleaned_dicts = _clean_captions_per_item(captions)
+    formatted = format_transcript(cleaned_text, captions=cleaned_captions)
+    return {
+        "clean": lambda: clean_transcript(raw_text),
+        "clean_captions": lambda: _clean_captions(captions),
+        "clean_captions_dicts": lambda: _clean_captions_per_item(captions),
+        "format_text": lambda: format_transcript(cleaned_text),
+        "format_captions": lambda: format_transcript(cleaned_text, captions=cleaned_captions),
+        "format_caption_dicts": lambda: _format_caption_dicts(cleaned_text, cleaned_dicts),
+        "title_prompt": lambda: build_title_prompt(cleaned_text),
+        "split_text": lambda: split_text(formatted),
+        "split_captions": lambda: split_captions(cleaned_captions),
+        "ndjson_stream": lambda: _stream_events(formatted),
+    }
+
+def measure(fn, repeat):
+    fn()  # warm-up (regex compilate, cache di Python)
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings), statistics.median(timings)
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def run(sizes, repeat, only=None):
+    results = []
+    for minutes in sizes:
+        captions = synthetic_captions(minutes)
+        chars = sum(len(c["text"]) + 1 for c in captions)
+        for name, fn in build_benchmarks(captions).items():
+            if only and name not in only:
+                continue
+            best, median = measure(fn, repeat)
+            results.append({
+                "benchmark": name,
+                "minutes": minutes,
+                "captions": len(captions),
+                "chars": chars,
+                "min_ms": round(best * 1000, 3),
+                "median_ms": round(median * 1000, 3),
+                "us_per_caption": round(best * 1e6 / max(len(captions), 1), 3),
+            })
+            print(f"{name:<22} {minutes:>4} min {len(captions):>7} caption  "
+                  f"min {best * 1000:>10.2f} ms  mediana {median * 1000:>10.2f} ms")
+    return results
+
+def compare(results, baseline_path):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    previous = {(r["benchmark"], r["minutes"]): r for r in baseline["results"]}
+    print(f"\nConfronto con {baseline_path} (commit {baseline.get('commit', '?')}):")
+    for r in results:
+        old = previous.get((r["benchmark"], r["minutes"]))
+        if old is None or not old["min_ms"]:
+            continue
+        ratio = r["min_ms"] / old["min_ms"]
+        flag = "  <-- più lento" if ratio > 1.10 else ("  <-- più veloce" if ratio < 0.90 else "")
+        print(f"{r['benchmark']:<22} {r['minutes']:>4} min  {old['min_ms']:>10.2f} -> {r['min_ms']:>10.2f} ms  x{ratio:.2f}{flag}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline dell'elaborazione dei transcript")
+    parser.add_argument("--sizes", default=",".join(str(s) for s in DEFAULT_SIZES), help="Durate in minuti, separate da virgola")
+    parser.add_argument("--repeat", type=int, default=5, help="Ripetizioni per misura")
+    parser.add_argument("--only", help="Benchmark da eseguire, separati da virgola")
+    parser.add_argument("--output", help="File JSON dei risultati")
+    parser.add_argument("--compare", help="File JSON di una run precedente")
+
+    args = parser.parse_args()
+
+    sizes = [float(s) if "." in s else int(s) for s in args.sizes.split(",") if s.strip()]
+    only = {s.strip() for s in args.only.split(",")} if args.only else None
+    commit = git_commit()
+
+    results = run(sizes, max(args.repeat, 1), only)
+
+    output = args.output or os.path.join(BENCHMARK_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}_{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            "commit": commit,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "results": results,
+        }, f, indent=2)
+    print(f"\nRisultati salvati in {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Rappresentazione compatta dei sottotitoli di Apify.
+
+Invece di una lista di dict {'text', 'start', 'dur'} (un dict e tre stringhe per
+segmento), CaptionStore tiene:
+- start e durata in due array('d') paralleli, convertiti a float una sola volta
+- tutti i testi in un'unica stringa, separati da \\x00, con gli offset in un array('q')
+
+La pulizia ([Music], (risate), spazi) e la divisione in paragrafi per pause di
+silenzio sono passate lineari su questi buffer, non regex e join per segmento.
+"""
+import re
+from array import array
+
+SEP = "\x00"
+
+# Come clean_transcript, ma senza mai attraversare il confine tra due segmenti
+_BRACKETS = re.compile(r"\[[^\]\x00\n]*\]")
+_PARENS = re.compile(r"\([^)\x00\n]*\)")
+_SPACES = re.compile(r"\s+")
+_EDGE_SPACES = re.compile(r" ?\x00 ?")
+
+# Soglia silenzio RIDOTTA per più interruzioni (0.25s invece di 0.5s)
+SILENCE_THRESHOLD = 0.25
+# Numero massimo di segmenti per paragrafo (per evitare paragrafi troppo lunghi)
+MAX_SEGMENTS_PER_PARAGRAPH = 5
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return None
+
+class CaptionStore:
+    __slots__ = ("starts", "durations", "buffer", "offsets")
+
+    def __init__(self, starts, durations, buffer, offsets):
+        self.starts = starts
+        self.durations = durations
+        self.buffer = buffer    # "testo0\x00testo1\x00...testoN\x00"
+        self.offsets = offsets  # inizio di ogni testo nel buffer, più la lunghezza totale
+
+    @classmethod
+    def from_captions(cls, captions):
+        """Costruisce lo store dal payload Apify; i segmenti vuoti vengono scartati."""
+        starts = array("d")
+        durations = array("d")
+        texts = []
+        for cap in captions:
+            text = (cap.get("text") or "").replace(SEP, "").strip()
+            if not text:
+                continue
+            start = _to_float(cap.get("start", 0))
+            dur = _to_float(cap.get("dur", 0))
+            if start is None or dur is None:
+                # Dati non numerici: come il formatter originale, segmento a 0-0
+                start, dur = 0.0, 0.0
+            starts.append(start)
+            durations.append(dur)
+            texts.append(text)
+        return cls._from_texts(starts, durations, texts)
+
+    @classmethod
+    def _from_texts(cls, starts, durations, texts):
+        offsets = array("q", [0])
+        position = 0
+        for text in texts:
+            position += len(text) + 1
+            offsets.append(position)
+        buffer = SEP.join(texts) + SEP if texts else ""
+        return cls(starts, durations, buffer, offsets)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def text_at(self, i):
+        return self.buffer[self.offsets[i]:self.offsets[i + 1] - 1]
+
+    def texts(self):
+        return self.buffer[:-1].split(SEP) if self.buffer else []
+
+    def text(self, separator=" "):
+        """Tutti i segmenti in un unico testo."""
+        return self.buffer[:-1].replace(SEP, separator)
+
+    def clean(self):
+        """
+        Nuovo store con i testi puliti come clean_transcript (tag tra [] e (),
+        spazi multipli), calcolato con poche regex sull'intero buffer.
+        I segmenti rimasti vuoti vengono scartati.
+        """
+        if not self.buffer:
+            return self
+        buffer = _BRACKETS.sub("", self.buffer)
+        buffer = _PARENS.sub("", buffer)
+        buffer = _SPACES.sub(" ", buffer)
+        buffer = _EDGE_SPACES.sub(SEP, buffer).strip(" ")
+        texts = buffer[:-1].split(SEP)
+
+        if all(texts):
+            return CaptionStore._from_texts(self.starts, self.durations, texts)
+        keep = [i for i, text in enumerate(texts) if text]
+        return CaptionStore._from_texts(
+            array("d", (self.starts[i] for i in keep)),
+            array("d", (self.durations[i] for i in keep)),
+            [texts[i] for i in keep],
+        )
+
+    def iter_paragraphs(self, silence_threshold=SILENCE_THRESHOLD, max_segments=MAX_SEGMENTS_PER_PARAGRAPH):
+        """
+        Paragrafi (pausa oltre la soglia, troppi segmenti o segmento precedente
+        chiuso da . ! ?), prodotti appena vengono chiusi: una passata lineare sugli array.
+        """
+        starts, durations, buffer, offsets = self.starts, self.durations, self.buffer, self.offsets
+        first = 0
+        last_end = 0.0
+        count = 0
+        for i in range(len(starts)):
+            start = starts[i]
+            if i and (
+                start - last_end > silence_threshold
+                or count >= max_segments
+                or buffer[offsets[i] - 2] in ".!?"  # ultimo carattere del segmento precedente
+            ):
+                # Un paragrafo è una sola fetta del buffer: niente liste di segmenti da unire
+                yield buffer[offsets[first]:offsets[i] - 1].replace(SEP, " ")
+                first = i
+                count = 0
+            count += 1
+            last_end = start + durations[i]
+        if len(starts):
+            yield buffer[offsets[first]:offsets[-1] - 1].replace(SEP, " ")
+
+    def paragraphs(self, silence_threshold=SILENCE_THRESHOLD, max_segments=MAX_SEGMENTS_PER_PARAGRAPH):
+        return list(self.iter_paragraphs(silence_threshold, max_segments))
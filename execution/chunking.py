@@ -0,0 +1,139 @@
+"""
+Elaborazione a blocchi (map-reduce) dei transcript lunghi, al posto del
+troncamento a N caratteri.
+
+Il testo viene spezzato ai confini di paragrafo, frase o sottotitolo in blocchi
+di al massimo CHUNK_MAX_CHARS caratteri; i blocchi vengono elaborati in
+parallelo (al massimo CHUNK_CONCURRENCY alla volta) e i risultati ricomposti
+nell'ordine originale.
+"""
+import os
+import re
+import asyncio
+
+from execution.stream_utils import ordered_map_stream
+
+CHUNK_MAX_CHARS = int(os.getenv("CHUNK_MAX_CHARS", "6000"))
+CHUNK_CONCURRENCY = int(os.getenv("CHUNK_CONCURRENCY", "4"))
+
+# Fine frase: punteggiatura (anche CJK) seguita da spazio, oppure subito dopo quella CJK
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+|(?<=[。！？])")
+
+def _pack(pieces, max_chars, separator):
+    """Unisce i pezzi in blocchi il più grandi possibile senza superare max_chars."""
+    chunks = []
+    current = []
+    size = 0
+    for piece in pieces:
+        extra = len(piece) + (len(separator) if current else 0)
+        if current and size + extra > max_chars:
+            chunks.append(separator.join(current))
+            current, size = [], 0
+            extra = len(piece)
+        current.append(piece)
+        size += extra
+    if current:
+        chunks.append(separator.join(current))
+    return chunks
+
+def _split_words(text, max_chars):
+    # Ultima risorsa (frase lunghissima o testo senza punteggiatura): spezza agli spazi
+    words = text.split()
+    if not words:
+        return []
+    pieces = []
+    for word in words:
+        # Parola più lunga di un blocco (es. testo CJK senza spazi): taglio netto
+        pieces.extend(word[i:i + max_chars] for i in range(0, len(word), max_chars))
+    return _pack(pieces, max_chars, " ")
+
+def _split_sentences(text, max_chars):
+    pieces = []
+    for sentence in _SENTENCE_END.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        if len(sentence) > max_chars:
+            pieces.extend(_split_words(sentence, max_chars))
+        else:
+            pieces.append(sentence)
+    return _pack(pieces, max_chars, " ")
+
+def split_text(text, max_chars=CHUNK_MAX_CHARS):
+    """
+    Spezza il testo in blocchi di al massimo max_chars caratteri.
+    Preferisce i confini di paragrafo ("\\n\\n"), poi quelli di frase, poi gli spazi.
+    """
+    text = (text or "").strip()
+    if not text:
+        return []
+    if len(text) <= max_chars:
+        return [text]
+
+    pieces = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) > max_chars:
+            pieces.extend(_split_sentences(paragraph, max_chars))
+        else:
+            pieces.append(paragraph)
+    return _pack(pieces, max_chars, "\n\n")
+
+def split_captions(captions, max_chars=CHUNK_MAX_CHARS):
+    """
+    Come split_text, ma per i sottotitoli (lista Apify o CaptionStore):
+    un blocco non spezza mai un sottotitolo.
+    """
+    texts = captions.texts() if hasattr(captions, "texts") else (c.get("text") for c in captions)
+    pieces = []
+    for text in texts:
+        text = (text or "").strip()
+        if not text:
+            continue
+        if len(text) > max_chars:
+            pieces.extend(_split_words(text, max_chars))
+        else:
+            pieces.append(text)
+    return _pack(pieces, max_chars, " ")
+
+async def map_chunks(chunks, fn, concurrency=CHUNK_CONCURRENCY):
+    """Esegue `await fn(blocco)` su tutti i blocchi in parallelo; risultati nell'ordine dei blocchi."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_one(chunk):
+        async with semaphore:
+            return await fn(chunk)
+
+    return await asyncio.gather(*(run_one(chunk) for chunk in chunks))
+
+async def map_chunks_stream(chunks, fn, concurrency=CHUNK_CONCURRENCY, separator="\n\n"):
+    """
+    Versione in streaming: `fn(blocco)` è un iteratore asincrono di frammenti.
+    I frammenti escono nell'ordine dei blocchi (il primo in tempo reale),
+    con `separator` tra un blocco e il successivo.
+    """
+    async def numbered():
+        for item in enumerate(chunks):
+            yield item
+
+    async def run_one(item):
+        index, chunk = item
+        if index > 0 and separator:
+            yield separator
+        async for piece in fn(chunk):
+            yield piece
+
+    async for piece in ordered_map_stream(numbered(), run_one, concurrency):
+        yield piece
+
+async def map_reduce(chunks, map_fn, reduce_fn, concurrency=CHUNK_CONCURRENCY):
+    """
+    map_fn su ogni blocco in parallelo, poi reduce_fn(lista dei risultati parziali).
+    Con un solo blocco il reduce non serve: si restituisce direttamente il risultato.
+    """
+    partials = await map_chunks(chunks, map_fn, concurrency)
+    if len(partials) == 1:
+        return partials[0]
+    return await reduce_fn(partials)
@@ -0,0 +1,169 @@
+"""
+Scadenza end-to-end di una richiesta, propagata a tutte le chiamate upstream.
+
+La scadenza (istante assoluto, time.monotonic) vive in un ContextVar: la imposta il
+middleware HTTP (header X-Request-Timeout o default dell'endpoint) o il worker dei
+job, e la ereditano i task figli. Le chiamate verso Apify, OpenRouter e le CDN
+usano come timeout il tempo rimasto (remaining/bounded/wait_within).
+
+Ogni stage può usare solo una quota del tempo rimasto quando parte
+(DEADLINE_STAGE_BUDGETS), così l'estrazione non consuma anche il tempo della
+formattazione. Gli stage opzionali (parafrasi, traduzione, tag, titolo) che
+sforano vengono saltati invece di far fallire tutta la pipeline.
+"""
+import os
+import time
+import asyncio
+import logging
+from contextvars import ContextVar
+from contextlib import contextmanager
+
+from execution.tracing import Counter, register
+
+logger = logging.getLogger(__name__)
+
+DEADLINE_HEADER = "X-Request-Timeout"
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "300"))
+MAX_REQUEST_DEADLINE_SECONDS = float(os.getenv("MAX_REQUEST_DEADLINE_SECONDS", "1800"))
+# Tempo tenuto da parte per chiudere la risposta (ultimi eventi, serializzazione)
+DEADLINE_RESERVE_SECONDS = float(os.getenv("DEADLINE_RESERVE_SECONDS", "2"))
+# Quota del proprio tempo a cui una richiesta rinuncia per unirsi a un'esecuzione già in corso
+DEADLINE_JOIN_TOLERANCE = float(os.getenv("DEADLINE_JOIN_TOLERANCE", "0.1"))
+
+# Quota del tempo rimasto all'avvio dello stage (stage non elencati: tutto il tempo rimasto)
+DEFAULT_STAGE_BUDGETS = (
+    "extract:0.6,ig_transcribe:0.5,detect_language:0.2,title:0.2,format:0.7,"
+    "tags:0.5,topics:0.2,research:0.7"
+)
+
+def _parse_budgets(value):
+    budgets = {}
+    for item in value.split(","):
+        stage, _, share = item.partition(":")
+        if stage.strip() and share.strip():
+            budgets[stage.strip()] = float(share)
+    return budgets
+
+STAGE_BUDGETS = _parse_budgets(os.getenv("DEADLINE_STAGE_BUDGETS", DEFAULT_STAGE_BUDGETS))
+
+DEADLINE_EXCEEDED = register(Counter(
+    "deadline_exceeded_total",
+    "Pipeline stages stopped by the request deadline, by stage and outcome (degraded, failed).",
+    ("stage", "outcome"),
+))
+
+_deadline = ContextVar("request_deadline", default=None)
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """Il tempo della richiesta (o dello stage) è finito."""
+
+    def __init__(self, stage=""):
+        self.stage = stage
+        super().__init__(f"Deadline exceeded{f' during {stage}' if stage else ''}")
+
+def parse_deadline(header_value, default=None):
+    """
+    Secondi concessi alla richiesta: l'header se valido (al massimo MAX_REQUEST_DEADLINE_SECONDS),
+    altrimenti `default` (REQUEST_DEADLINE_SECONDS se non indicato).
+    """
+    default = default or REQUEST_DEADLINE_SECONDS
+    try:
+        seconds = float(header_value)
+    except (TypeError, ValueError):
+        return default
+    if seconds <= 0:
+        return default
+    return min(seconds, MAX_REQUEST_DEADLINE_SECONDS)
+
+def set_deadline(seconds):
+    """Le chiamate successive (anche nei task figli) devono finire entro `seconds` da adesso."""
+    _deadline.set(time.monotonic() + seconds if seconds else None)
+
+def remaining():
+    """Secondi rimasti (mai negativi), o None se non c'è una scadenza."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return max(deadline - time.monotonic(), 0.0)
+
+def current_deadline():
+    """Scadenza della richiesta (istante time.monotonic), o None se non c'è."""
+    return _deadline.get()
+
+def covers(deadline, other):
+    """
+    True se chi scade a `other` può attendere un'esecuzione che scade a `deadline`: `deadline`
+    non arriva prima, salvo DEADLINE_JOIN_TOLERANCE del tempo rimasto a `other` (richieste
+    con lo stesso timeout arrivate a pochi istanti di distanza). None = nessuna scadenza.
+    """
+    if deadline is None:
+        return True
+    if other is None:
+        return False
+    return deadline + max(other - time.monotonic(), 0.0) * DEADLINE_JOIN_TOLERANCE >= other
+
+def bounded(timeout=None):
+    """Il timeout più stretto tra `timeout` e il tempo rimasto (None se nessuno dei due)."""
+    left = remaining()
+    if left is None:
+        return timeout
+    return left if timeout is None else min(timeout, left)
+
+def check(stage=""):
+    if remaining() == 0:
+        raise DeadlineExceeded(stage)
+
+async def wait_within(awaitable, timeout=None, stage=""):
+    """
+    Attende entro `timeout` e la scadenza: asyncio.TimeoutError se scade `timeout`,
+    DeadlineExceeded se scade prima la richiesta.
+    """
+    left = remaining()
+    if left is None or (timeout is not None and timeout < left):
+        if timeout is None:
+            return await awaitable
+        return await asyncio.wait_for(awaitable, timeout)
+    if left == 0:
+        # Niente da attendere: chiudiamo la coroutine senza avviarla
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise DeadlineExceeded(stage)
+    try:
+        return await asyncio.wait_for(awaitable, left)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded(stage) from None
+
+@contextmanager
+def stage_deadline(stage):
+    """
+    Restringe la scadenza per la durata dello stage a STAGE_BUDGETS[stage] del tempo
+    rimasto, tenendo DEADLINE_RESERVE_SECONDS per la fine della richiesta.
+    """
+    left = remaining()
+    if left is None:
+        yield
+        return
+    budget = min(left * STAGE_BUDGETS.get(stage, 1.0), max(left - DEADLINE_RESERVE_SECONDS, 0.0))
+    token = _deadline.set(time.monotonic() + budget)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+async def optional_stage(stage, awaitable, fallback=None):
+    """Esegue uno stage opzionale nel suo budget; se sfora restituisce `fallback` invece di fallire."""
+    with stage_deadline(stage):
+        try:
+            return await wait_within(awaitable, stage=stage)
+        except DeadlineExceeded:
+            record_degraded(stage)
+            return fallback
+
+def record_degraded(stage):
+    """Lo stage ha sforato ed è stato saltato (o sostituito da un ripiego)."""
+    logger.warning(f"Stage {stage} missed its deadline, degrading")
+    DEADLINE_EXCEEDED.inc(stage=stage, outcome="degraded")
+
+def record_failed(stage):
+    """Lo stage ha sforato e la richiesta è fallita."""
+    DEADLINE_EXCEEDED.inc(stage=stage, outcome="failed")
@@ -18,67 +18,108 @@ Output:
 import os
 import sys
 import json
+import asyncio
 import argparse
 from dotenv import load_dotenv
-from openai import OpenAI
 
-# Carica variabili d'ambiente
-load_dotenv()
+# Permette l'esecuzione diretta dello script (python execution/extract_topics.py)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-def extract_topics(transcript_text, target_language="it"):
-    api_key = os.getenv("OPENROUTER_API_KEY")
-    if not api_key:
-        raise ValueError("OPENROUTER_API_KEY non trovato nel file .env")
+from execution.llm_utils import chat_completion
+from execution.chunking import split_text, map_reduce
 
-    # Mapping target language code to full name
-    language_mapping = {
-        'it': 'Italian',
-        'en': 'English',
-        'ru': 'Russian',
-        'fr': 'French',
-        'zh': 'Chinese (Simplified)'
-    }
-    target_lang_name = language_mapping.get(target_language, 'Italian')
+# Carica variabili d'ambiente
+load_dotenv()
 
-    # Configurazione client OpenRouter (OpenAI compatible)
-    client = OpenAI(
-        base_url="https://openrouter.ai/api/v1",
-        api_key=api_key,
-    )
+def _parse_topics(content):
+    content = content.strip()
+    
+    # Pulizia basilare se il modello risponde con markdown ```json ... ```
+    if content.startswith("```json"):
+        content = content.replace("```json", "").replace("```", "")
+    
+    try:
+        topics = json.loads(content)
+    except json.JSONDecodeError:
+        topics = None
+    if isinstance(topics, list):
+        return topics
+    # Fallback nel caso il modello non ritorni JSON valido (o un JSON che non è una lista)
+    return {"error": "Failed to decode JSON", "raw_content": content}
 
+async def _topics_for_chunk(chunk, target_lang_name):
     prompt = f"""
     Analizza la seguente trascrizione di un video YouTube ed estrai i 3-5 argomenti principali (Main Topics).
     Restituisci i topic in lingua {target_lang_name}.
     Restituisci SOLO un array JSON di stringhe, senza altro testo.
     
     Trascrizione:
-    {transcript_text[:10000]} # Limitiamo a 10k caratteri per sicurezza, anche se Sonnet ha contesto ampio
+    {chunk}
     """
 
-    completion = client.chat.completions.create(
-        extra_headers={
-            "HTTP-Referer": "https://antigravity.app", # Opzionale, per OpenRouter rankings
-            "X-Title": "Antigravity App",
-        },
-        model="anthropic/claude-3.5-sonnet",
+    content = await chat_completion(
+        stage="topics",
+        tier="quality",
         messages=[
             {"role": "system", "content": f"Sei un esperto analista di contenuti. Estrai i topic principali in formato JSON rigoroso in lingua {target_lang_name}."},
             {"role": "user", "content": prompt},
         ],
     )
+    return _parse_topics(content)
 
-    content = completion.choices[0].message.content.strip()
-    
-    # Pulizia basilare se il modello risponde con markdown ```json ... ```
-    if content.startswith("```json"):
-        content = content.replace("```json", "").replace("```", "")
+async def _merge_topics(partials, target_lang_name):
+    # Reduce: dai topic dei singoli blocchi ai 3-5 topic dell'intero video
+    candidates = []
+    for topics in partials:
+        if isinstance(topics, list):
+            candidates.extend(t for t in topics if t not in candidates)
+    if not candidates:
+        return next(
+            (p for p in partials if isinstance(p, dict)),
+            {"error": "Failed to decode JSON", "raw_content": ""},
+        )
+
+    prompt = f"""
+    Questi sono i topic estratti dalle diverse parti di uno stesso video, in ordine.
+    Uniscili nei 3-5 argomenti principali (Main Topics) dell'intero video, in lingua {target_lang_name}.
+    Restituisci SOLO un array JSON di stringhe, senza altro testo.
     
-    try:
-        topics = json.loads(content)
-        return topics
-    except json.JSONDecodeError:
-        # Fallback nel caso il modello non ritorni JSON valido
-        return {"error": "Failed to decode JSON", "raw_content": content}
+    Topic:
+    {json.dumps(candidates, ensure_ascii=False)}
+    """
+
+    content = await chat_completion(
+        stage="topics",
+        tier="quality",
+        messages=[
+            {"role": "system", "content": f"Sei un esperto analista di contenuti. Estrai i topic principali in formato JSON rigoroso in lingua {target_lang_name}."},
+            {"role": "user", "content": prompt},
+        ],
+    )
+    return _parse_topics(content)
+
+async def extract_topics_async(transcript_text, target_language="it"):
+    # Mapping target language code to full name
+    language_mapping = {
+        'it': 'Italian',
+        'en': 'English',
+        'ru': 'Russian',
+        'fr': 'French',
+        'zh': 'Chinese (Simplified)'
+    }
+    target_lang_name = language_mapping.get(target_language, 'Italian')
+
+    # Trascrizioni lunghe: topic per blocco in parallelo, poi un passaggio di sintesi
+    chunks = split_text(transcript_text) or [""]
+    return await map_reduce(
+        chunks,
+        lambda chunk: _topics_for_chunk(chunk, target_lang_name),
+        lambda partials: _merge_topics(partials, target_lang_name),
+    )
+
+def extract_topics(transcript_text, target_language="it"):
+    """Versione sincrona per l'uso da riga di comando."""
+    return asyncio.run(extract_topics_async(transcript_text, target_language))
 
 def main():
     parser = argparse.ArgumentParser(description="Estrai topics da trascrizione")
@@ -18,18 +18,48 @@ Output:
 
 import os
 import sys
+import asyncio
 import argparse
 from dotenv import load_dotenv
-from openai import OpenAI
+
+# Permette l'esecuzione diretta dello script (python execution/generate_script.py)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from execution.llm_utils import chat_completion, chat_completion_stream
+from execution.chunking import split_text, map_chunks
 
 # Carica variabili d'ambiente
 load_dotenv()
 
-def generate_video_script(transcript_text, research_text, target_language="it", tone="educational"):
-    api_key = os.getenv("OPENROUTER_API_KEY")
-    if not api_key:
-        raise ValueError("OPENROUTER_API_KEY non trovato nel file .env")
+# Oltre questa lunghezza la trascrizione viene prima condensata a blocchi (map-reduce)
+SCRIPT_TRANSCRIPT_MAX_CHARS = int(os.getenv("SCRIPT_TRANSCRIPT_MAX_CHARS", "15000"))
+
+async def _condense_chunk(chunk):
+    prompt = f"""
+    Riassumi questa parte di una trascrizione video in appunti dettagliati, nella sua lingua originale.
+    Conserva tutti i fatti, i dati, gli esempi e l'ordine degli argomenti. Niente introduzioni o commenti.
+
+    Trascrizione (parte):
+    {chunk}
+    """
+    return await chat_completion(
+        stage="condense",
+        tier="fast",
+        messages=[{"role": "user", "content": prompt}],
+    )
+
+async def condense_transcript_async(transcript_text, max_chars=SCRIPT_TRANSCRIPT_MAX_CHARS):
+    """
+    Restituisce la trascrizione così com'è se entra in max_chars, altrimenti
+    gli appunti dei singoli blocchi (condensati in parallelo) nell'ordine originale.
+    """
+    if len(transcript_text) <= max_chars:
+        return transcript_text
+    notes = await map_chunks(split_text(transcript_text), _condense_chunk)
+    return "\n\n".join(note.strip() for note in notes)
 
+async def build_script_messages(transcript_text, research_text, target_language="it", tone="educational"):
+    """Messaggi per il modello che scrive lo script (la trascrizione lunga viene prima condensata)."""
     language_mapping = {
         'it': 'Italian',
         'en': 'English',
@@ -67,10 +97,8 @@ def generate_video_script(transcript_text, research_text, target_language="it",
     
     tone_instruction = tone_instructions.get(tone, tone_instructions['educational'])
 
-    client = OpenAI(
-        base_url="https://openrouter.ai/api/v1",
-        api_key=api_key,
-    )
+    # Video lunghi: appunti per blocco invece di tagliare la trascrizione
+    transcript_text = await condense_transcript_async(transcript_text)
 
     prompt = f"""
     Sei uno sceneggiatore professionista per YouTube. 
@@ -78,7 +106,7 @@ def generate_video_script(transcript_text, research_text, target_language="it",
     LO SCRIPT DEVE ESSERE SCRITTO IN LINGUA {target_lang_name}.
 
     1. VIDEO ORIGINALE (Trascrizione):
-    {transcript_text[:15000]}
+    {transcript_text}
 
     2. NUOVE INFORMAZIONI (Ricerca):
     {research_text[:10000]}
@@ -94,15 +122,32 @@ def generate_video_script(transcript_text, research_text, target_language="it",
     {tone_instruction}
     """
 
-    completion = client.chat.completions.create(
-        model="anthropic/claude-3.5-sonnet",
-        messages=[
-            {"role": "system", "content": f"Sei uno sceneggiatore esperto per creatori di contenuti tech/educational. Scrivi esclusivamente in lingua {target_lang_name}."},
-            {"role": "user", "content": prompt},
-        ],
+    return [
+        {"role": "system", "content": f"Sei uno sceneggiatore esperto per creatori di contenuti tech/educational. Scrivi esclusivamente in lingua {target_lang_name}."},
+        {"role": "user", "content": prompt},
+    ]
+
+async def generate_video_script_async(transcript_text, research_text, target_language="it", tone="educational"):
+    messages = await build_script_messages(transcript_text, research_text, target_language, tone)
+    return await chat_completion(
+        stage="script",
+        tier="quality",
+        messages=messages,
     )
 
-    return completion.choices[0].message.content
+async def generate_video_script_stream(transcript_text, research_text, target_language="it", tone="educational"):
+    """Come generate_video_script_async, ma produce lo script a frammenti man mano che il modello lo scrive."""
+    messages = await build_script_messages(transcript_text, research_text, target_language, tone)
+    async for piece in chat_completion_stream(
+        stage="script",
+        tier="quality",
+        messages=messages,
+    ):
+        yield piece
+
+def generate_video_script(transcript_text, research_text, target_language="it", tone="educational"):
+    """Versione sincrona per l'uso da riga di comando."""
+    return asyncio.run(generate_video_script_async(transcript_text, research_text, target_language, tone))
 
 def main():
     parser = argparse.ArgumentParser(description="Genera script video finale")
@@ -0,0 +1,147 @@
+"""
+Richieste LLM "hedged" per tagliare la coda di latenza delle chiamate brevi.
+
+Per gli stage elencati in LLM_HEDGE_STAGES (rilevamento lingua, tag, titolo, topic):
+se la prima chiamata non ha risposto entro il percentile LLM_HEDGE_PERCENTILE della
+latenza del modello per quello stage, ne parte un duplicato (sul modello successivo
+del tier, se LLM_HEDGE_OTHER_MODEL=1) e vince la prima risposta; l'altra viene cancellata.
+
+Il volume di duplicati è limitato: al massimo LLM_HEDGE_BUDGET delle chiamate
+hedgeable nella finestra del router (più LLM_HEDGE_BURST per l'avvio), così un
+rallentamento generale di OpenRouter non raddoppia il carico.
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import deque, Counter as Tally
+
+from execution.tracing import Counter, register
+from execution.model_router import router, ROUTER_WINDOW_SECONDS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HEDGE_STAGES = "detect_language,tags,title,topics"
+HEDGE_STAGES = {
+    s.strip() for s in os.getenv("LLM_HEDGE_STAGES", DEFAULT_HEDGE_STAGES).split(",") if s.strip()
+}
+HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.9"))
+# Attesa prima del duplicato finché il modello non ha abbastanza campioni di latenza
+HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "3"))
+HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.2"))
+# Quota massima di duplicati sulle chiamate hedgeable, più qualche duplicato "gratuito"
+HEDGE_BUDGET = float(os.getenv("LLM_HEDGE_BUDGET", "0.1"))
+HEDGE_BURST = int(os.getenv("LLM_HEDGE_BURST", "3"))
+HEDGE_OTHER_MODEL = os.getenv("LLM_HEDGE_OTHER_MODEL", "1") == "1"
+
+LLM_HEDGES = register(Counter(
+    "llm_hedges_total",
+    "Hedged LLM calls by stage and result (primary_won, hedge_won, failed, over_budget).",
+    ("stage", "result"),
+))
+
+# Esiti per /api/models (le stesse quantità della metrica, senza passare dal formato Prometheus)
+_results = Tally()
+
+def _count(stage, result):
+    LLM_HEDGES.inc(stage=stage, result=result)
+    _results[result] += 1
+
+def is_hedged(stage):
+    return stage in HEDGE_STAGES
+
+def hedge_delay(model, stage):
+    """Secondi da attendere prima del duplicato: il percentile della latenza del modello per lo stage."""
+    value = router.quantile(model, stage, HEDGE_PERCENTILE)
+    if value is None:
+        return HEDGE_DEFAULT_DELAY
+    return max(value, HEDGE_MIN_DELAY)
+
+class HedgeBudget:
+    """Istanti delle chiamate hedgeable e dei duplicati partiti, sugli ultimi ROUTER_WINDOW_SECONDS."""
+
+    def __init__(self, ratio=HEDGE_BUDGET, burst=HEDGE_BURST, window=ROUTER_WINDOW_SECONDS):
+        self.ratio = ratio
+        self.burst = burst
+        self.window = window
+        self._calls = deque()
+        self._hedges = deque()
+        self._lock = threading.Lock()
+
+    def _trim(self, now):
+        cutoff = now - self.window
+        for samples in (self._calls, self._hedges):
+            while samples and samples[0] < cutoff:
+                samples.popleft()
+
+    def call(self):
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            self._calls.append(now)
+
+    def acquire(self):
+        """True se un duplicato può partire (e lo conta)."""
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            if len(self._hedges) >= self.burst + self.ratio * len(self._calls):
+                return False
+            self._hedges.append(now)
+            return True
+
+    def stats(self):
+        with self._lock:
+            self._trim(time.monotonic())
+            return {"calls": len(self._calls), "hedges": len(self._hedges)}
+
+budget = HedgeBudget()
+
+async def hedged(primary, backup, delay, stage):
+    """
+    Attende `primary` (coroutine) fino a `delay` secondi; se non ha ancora risposto
+    e il budget lo consente avvia `backup()` (factory di coroutine) e restituisce
+    il primo risultato riuscito, cancellando l'altra chiamata.
+    Se falliscono entrambe viene sollevato l'errore della prima.
+    """
+    budget.call()
+    first = asyncio.ensure_future(primary)
+    second = None
+    try:
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            return first.result()
+        if not budget.acquire():
+            _count(stage, "over_budget")
+            return await first
+
+        logger.info(f"LLM stage {stage} slower than {delay:.2f}s, sending hedged request")
+        second = asyncio.ensure_future(backup())
+        pending = {first, second}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            # A parità di arrivo vince la prima chiamata
+            for task in sorted(done, key=lambda t: t is second):
+                if task.exception() is None:
+                    _count(stage, "hedge_won" if task is second else "primary_won")
+                    return task.result()
+        _count(stage, "failed")
+        raise first.exception()
+    finally:
+        losers = [t for t in (first, second) if t is not None and not t.done()]
+        for task in losers:
+            task.cancel()
+        if losers:
+            await asyncio.gather(*losers, return_exceptions=True)
+
+def hedge_stats():
+    decided = _results["hedge_won"] + _results["primary_won"]
+    return {
+        "stages": sorted(HEDGE_STAGES),
+        "percentile": HEDGE_PERCENTILE,
+        "budget": HEDGE_BUDGET,
+        "window": budget.stats(),
+        "results": dict(_results),
+        "hedge_win_rate": round(_results["hedge_won"] / decided, 3) if decided else None,
+    }
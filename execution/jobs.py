@@ -0,0 +1,337 @@
+"""
+Job in background: le pipeline lunghe (trascrizione, ricerca, script) vengono
+accodate e svolte da un pool limitato di worker asyncio, senza tenere aperta
+la connessione HTTP del client.
+
+- i job sono salvati su SQLite (.tmp/jobs.sqlite3): sopravvivono al riavvio
+- un job viene "preso" con un UPDATE atomico, quindi più processi uvicorn
+  possono condividere la stessa coda
+- i job rimasti "running" di un processo morto tornano in coda (all'avvio e ogni
+  JOB_RECOVER_INTERVAL secondi); dopo JOB_MAX_ATTEMPTS tentativi falliscono, così un
+  job che uccide il worker (OOM, crash di una dipendenza) non riparte all'infinito
+"""
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+import sqlite3
+from contextlib import contextmanager
+
+from execution.sqlite_cache import CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+JOB_RETENTION_HOURS = float(os.getenv("JOB_RETENTION_HOURS", "24"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RECOVER_INTERVAL = float(os.getenv("JOB_RECOVER_INTERVAL", "60"))
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+FINISHED_STATES = (SUCCEEDED, FAILED)
+
+class JobStore:
+    """Tabella dei job su SQLite. Metodi sincroni: usarli tramite asyncio.to_thread."""
+
+    def __init__(self, filename="jobs.sqlite3"):
+        self.path = filename if os.path.isabs(filename) else os.path.join(CACHE_DIR, filename)
+        self._initialized = False
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.row_factory = sqlite3.Row
+        if not self._initialized:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    type TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    worker_pid INTEGER,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                );
+                CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created_at);
+            """)
+            self._initialized = True
+        return conn
+
+    @contextmanager
+    def _session(self, immediate=False):
+        # Senza immediate ogni istruzione è una transazione a sé: le letture (get, counts,
+        # il polling di watch) non prendono il lock di scrittura del database.
+        # BEGIN IMMEDIATE solo dove lettura e scrittura non devono essere contese tra processi
+        conn = self._connect()
+        if not immediate:
+            try:
+                yield conn
+            finally:
+                conn.close()
+            return
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _to_dict(row):
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    def create(self, job_type, payload):
+        job_id = uuid.uuid4().hex
+        with self._session() as conn:
+            conn.execute(
+                "INSERT INTO jobs(id, type, payload, status, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, job_type, json.dumps(payload, ensure_ascii=False), QUEUED, time.time()),
+            )
+        return job_id
+
+    def get(self, job_id):
+        with self._session() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row)
+
+    def claim_next(self):
+        """Prende il job in coda più vecchio e lo segna come running per questo processo."""
+        with self._session(immediate=True) as conn:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)
+            ).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker_pid = ?, started_at = ?, attempts = attempts + 1 "
+                "WHERE id = ?",
+                (RUNNING, os.getpid(), now, row["id"]),
+            )
+        job = self._to_dict(row)
+        job.update(status=RUNNING, worker_pid=os.getpid(), started_at=now, attempts=job["attempts"] + 1)
+        return job
+
+    def finish(self, job_id, result):
+        with self._session() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, finished_at = ? WHERE id = ?",
+                (SUCCEEDED, json.dumps(result, ensure_ascii=False), time.time(), job_id),
+            )
+
+    def fail(self, job_id, error):
+        with self._session() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                (FAILED, error, time.time(), job_id),
+            )
+
+    def requeue(self, job_id):
+        # Interrotto dallo spegnimento, non dal job: il tentativo non conta per JOB_MAX_ATTEMPTS
+        with self._session() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker_pid = NULL, started_at = NULL, "
+                "attempts = MAX(attempts - 1, 0) WHERE id = ?",
+                (QUEUED, job_id),
+            )
+
+    def recover_orphans(self, startup=False, max_attempts=JOB_MAX_ATTEMPTS):
+        """
+        Job 'running' il cui processo non esiste più (crash/riavvio): tornano in coda,
+        o falliscono se hanno già esaurito max_attempts tentativi.
+        All'avvio (startup=True) sono orfani anche quelli con il pid di questo processo
+        (pid riusato, es. nei container); dopo, sono i job che questo processo sta eseguendo.
+        Restituisce (rimessi in coda, falliti).
+        """
+        requeued = failed = 0
+        with self._session(immediate=True) as conn:
+            rows = conn.execute(
+                "SELECT id, worker_pid, attempts FROM jobs WHERE status = ?", (RUNNING,)
+            ).fetchall()
+            for row in rows:
+                if row["worker_pid"] == os.getpid():
+                    if not startup:
+                        continue
+                elif _pid_alive(row["worker_pid"]):
+                    continue
+                if row["attempts"] >= max_attempts:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                        (FAILED, f"Worker died while running the job ({row['attempts']} attempts)",
+                         time.time(), row["id"]),
+                    )
+                    failed += 1
+                else:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, worker_pid = NULL, started_at = NULL WHERE id = ?",
+                        (QUEUED, row["id"]),
+                    )
+                    requeued += 1
+        return requeued, failed
+
+    def purge(self, older_than_seconds):
+        cutoff = time.time() - older_than_seconds
+        with self._session() as conn:
+            cur = conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                (*FINISHED_STATES, cutoff),
+            )
+        return cur.rowcount
+
+    def counts(self):
+        with self._session() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+def _pid_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+class JobManager:
+    """
+    Pool di worker asyncio che esegue i job salvati in JobStore.
+    Gli handler si registrano per tipo: async handler(payload) -> risultato serializzabile in JSON.
+    """
+
+    def __init__(self, store=None, workers=JOB_WORKERS):
+        self.store = store or JobStore()
+        self.workers = workers
+        self.handlers = {}
+        self._tasks = []
+        self._wakeup = None
+        self._changed = None
+
+    def register(self, job_type, handler):
+        self.handlers[job_type] = handler
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        self._changed = asyncio.Condition()
+        requeued, failed = await asyncio.to_thread(self.store.recover_orphans, True)
+        purged = await asyncio.to_thread(self.store.purge, JOB_RETENTION_HOURS * 3600)
+        if requeued or failed or purged:
+            logger.info(f"Jobs: {requeued} requeued and {failed} failed after restart, {purged} old jobs purged")
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._recover_periodically()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, job_type, payload):
+        if job_type not in self.handlers:
+            raise ValueError(f"Unknown job type: {job_type}")
+        job_id = await asyncio.to_thread(self.store.create, job_type, payload)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job_id
+
+    async def get(self, job_id):
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def stats(self):
+        counts = await asyncio.to_thread(self.store.counts)
+        return {"workers": self.workers, "jobs": counts}
+
+    async def watch(self, job_id, poll_interval=JOB_POLL_INTERVAL):
+        """
+        Produce lo stato del job ogni volta che cambia, fino a quando termina.
+        I cambi fatti da questo processo arrivano subito; quelli di altri
+        processi al successivo poll.
+        """
+        last_status = None
+        while True:
+            job = await self.get(job_id)
+            if job is None:
+                return
+            if job["status"] != last_status:
+                last_status = job["status"]
+                yield job
+            if job["status"] in FINISHED_STATES:
+                return
+            if self._changed is None:  # pool non avviato in questo processo
+                await asyncio.sleep(poll_interval)
+                continue
+            async with self._changed:
+                try:
+                    await asyncio.wait_for(self._changed.wait(), poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _recover_periodically(self):
+        # Un altro processo può morire mentre questo continua a girare: i suoi job non aspettano un riavvio
+        while True:
+            await asyncio.sleep(JOB_RECOVER_INTERVAL)
+            try:
+                requeued, failed = await asyncio.to_thread(self.store.recover_orphans)
+            except Exception as e:
+                logger.warning(f"Jobs: orphan recovery failed: {e}")
+                continue
+            if requeued or failed:
+                logger.info(f"Jobs: {requeued} orphaned jobs requeued, {failed} failed")
+                self._wakeup.set()
+                await self._notify()
+
+    async def _notify(self):
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def _worker(self, index):
+        while True:
+            # Si azzera prima del claim: un submit che arriva durante il claim non va perso
+            self._wakeup.clear()
+            job = await asyncio.to_thread(self.store.claim_next)
+            if job is None:
+                # Coda vuota: aspetta un submit locale o il prossimo poll (job di altri processi)
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._notify()
+            logger.info(f"Worker {index}: running {job['type']} job {job['id']}")
+            handler = self.handlers.get(job["type"])
+            try:
+                if handler is None:
+                    raise ValueError(f"Unknown job type: {job['type']}")
+                result = await handler(job["payload"])
+            except asyncio.CancelledError:
+                # Spegnimento: il job ripartirà al prossimo avvio
+                await asyncio.shield(asyncio.to_thread(self.store.requeue, job["id"]))
+                raise
+            except Exception as e:
+                logger.error(f"Job {job['id']} failed: {e}")
+                await asyncio.to_thread(self.store.fail, job["id"], str(e))
+            else:
+                await asyncio.to_thread(self.store.finish, job["id"], result)
+            await self._notify()
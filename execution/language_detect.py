@@ -0,0 +1,202 @@
+"""
+Rilevamento lingua locale (offline), senza chiamate LLM.
+
+1. Lingue con alfabeto proprio (cinese, russo, giapponese, coreano, arabo, greco...)
+   si riconoscono dallo script Unicode dei caratteri.
+2. Per le lingue in alfabeto latino usiamo un modello a trigrammi di caratteri,
+   costruito (una volta, in memoria) dai testi di riferimento qui sotto.
+
+detect_language() restituisce (codice ISO 639-1, confidenza 0..1): se la confidenza
+è bassa il chiamante può ripiegare sull'LLM.
+"""
+import math
+import re
+from collections import Counter
+
+# Testi di riferimento in stile "parlato da video": bastano poche centinaia di parole
+# per lingua per separare bene i trigrammi più frequenti.
+SEED_TEXTS = {
+    "en": """
+    Hi everyone and welcome back to the channel. Today we are going to talk about something that
+    a lot of you have been asking me about in the comments, and I think it is really important.
+    If you are new here, make sure you subscribe and hit the notification bell so you don't miss
+    the next video. So, let's get started. The first thing you need to understand is that this is
+    not something that happens overnight. It takes time, it takes practice, and it takes a lot of
+    patience. When I started, I had no idea what I was doing, and I made all of the mistakes that
+    you can imagine. But what I learned is that the people who succeed are the ones who keep going
+    when things get difficult. They show up every day, they work on their skills, and they are not
+    afraid to fail. Now, there are three things that I want you to remember from this video. First,
+    focus on what you can control. Second, be consistent with your work and your habits. Third,
+    surround yourself with people who push you to be better. If you do these things, I promise you
+    will see results. Let me know in the comments what you think about this, and if you have any
+    questions, I will try to answer all of them. Thank you so much for watching, and I will see you
+    in the next one. This is the kind of thing that would have helped me when I was just starting out,
+    which is why I wanted to share it with you. They would have been there with us, but they were not.
+    """,
+    "it": """
+    Ciao a tutti e bentornati sul canale. Oggi parliamo di una cosa che molti di voi mi hanno chiesto
+    nei commenti, e che secondo me è davvero importante. Se sei nuovo qui, iscriviti e attiva la
+    campanella delle notifiche così non perdi il prossimo video. Allora, cominciamo. La prima cosa che
+    devi capire è che questo non succede dall'oggi al domani. Ci vuole tempo, ci vuole pratica e ci
+    vuole tanta pazienza. Quando ho iniziato non avevo idea di cosa stessi facendo, e ho fatto tutti
+    gli errori che potete immaginare. Però ho imparato che le persone che ce la fanno sono quelle che
+    continuano anche quando le cose diventano difficili. Si presentano ogni giorno, lavorano sulle
+    proprie competenze e non hanno paura di sbagliare. Adesso ci sono tre cose che voglio che ricordiate
+    di questo video. Prima di tutto, concentratevi su quello che potete controllare. Secondo, siate
+    costanti nel lavoro e nelle abitudini. Terzo, circondatevi di persone che vi spingono a migliorare.
+    Se fate queste cose, vi prometto che vedrete i risultati. Fatemi sapere nei commenti cosa ne pensate,
+    e se avete domande cercherò di rispondere a tutte. Grazie mille per la visione e ci vediamo nel
+    prossimo video. Questo è il tipo di consiglio che mi sarebbe servito quando ho cominciato, ed è per
+    questo che volevo condividerlo con voi. Gli altri della nostra squadra sono stati con noi.
+    """,
+    "fr": """
+    Salut tout le monde et bienvenue sur la chaîne. Aujourd'hui on va parler de quelque chose que
+    beaucoup d'entre vous m'ont demandé dans les commentaires, et je pense que c'est vraiment important.
+    Si tu es nouveau ici, abonne-toi et active la cloche des notifications pour ne pas rater la
+    prochaine vidéo. Alors, on commence. La première chose que tu dois comprendre, c'est que ça ne se
+    fait pas du jour au lendemain. Il faut du temps, il faut de la pratique et il faut beaucoup de
+    patience. Quand j'ai commencé, je n'avais aucune idée de ce que je faisais, et j'ai fait toutes les
+    erreurs que vous pouvez imaginer. Mais j'ai appris que les personnes qui réussissent sont celles qui
+    continuent quand les choses deviennent difficiles. Elles sont là tous les jours, elles travaillent
+    leurs compétences et elles n'ont pas peur de se tromper. Maintenant, il y a trois choses que je veux
+    que vous reteniez de cette vidéo. D'abord, concentrez-vous sur ce que vous pouvez contrôler. Ensuite,
+    soyez réguliers dans votre travail et vos habitudes. Enfin, entourez-vous de gens qui vous poussent
+    à devenir meilleurs. Si vous faites ces choses, je vous promets que vous verrez des résultats.
+    Dites-moi dans les commentaires ce que vous en pensez, et si vous avez des questions, j'essaierai
+    de répondre à toutes. Merci beaucoup d'avoir regardé et on se retrouve dans la prochaine vidéo.
+    """,
+    "es": """
+    Hola a todos y bienvenidos de nuevo al canal. Hoy vamos a hablar de algo que muchos de ustedes me
+    han preguntado en los comentarios, y creo que es muy importante. Si eres nuevo aquí, suscríbete y
+    activa la campana de notificaciones para no perderte el próximo video. Bueno, empecemos. Lo primero
+    que tienes que entender es que esto no pasa de la noche a la mañana. Se necesita tiempo, se necesita
+    práctica y se necesita mucha paciencia. Cuando empecé no tenía ni idea de lo que estaba haciendo, y
+    cometí todos los errores que puedas imaginar. Pero aprendí que las personas que lo consiguen son las
+    que siguen adelante cuando las cosas se ponen difíciles. Aparecen todos los días, trabajan en sus
+    habilidades y no tienen miedo de equivocarse. Ahora hay tres cosas que quiero que recuerden de este
+    video. Primero, concéntrense en lo que pueden controlar. Segundo, sean constantes con su trabajo y
+    sus hábitos. Tercero, rodéense de personas que los empujen a ser mejores. Si hacen estas cosas, les
+    prometo que verán resultados. Díganme en los comentarios qué piensan de esto, y si tienen preguntas
+    intentaré responder a todas. Muchas gracias por ver el video y nos vemos en el próximo.
+    """,
+    "de": """
+    Hallo zusammen und willkommen zurück auf dem Kanal. Heute sprechen wir über etwas, wonach mich viele
+    von euch in den Kommentaren gefragt haben, und ich glaube, das ist wirklich wichtig. Wenn du neu hier
+    bist, abonniere den Kanal und aktiviere die Glocke, damit du das nächste Video nicht verpasst. Also,
+    fangen wir an. Das Erste, was du verstehen musst, ist, dass das nicht über Nacht passiert. Es braucht
+    Zeit, es braucht Übung und es braucht sehr viel Geduld. Als ich angefangen habe, hatte ich keine
+    Ahnung, was ich mache, und ich habe alle Fehler gemacht, die man sich vorstellen kann. Aber ich habe
+    gelernt, dass die Menschen, die es schaffen, diejenigen sind, die weitermachen, wenn es schwierig
+    wird. Sie sind jeden Tag da, sie arbeiten an ihren Fähigkeiten und sie haben keine Angst, Fehler zu
+    machen. Jetzt gibt es drei Dinge, die ihr euch aus diesem Video merken sollt. Erstens, konzentriert
+    euch auf das, was ihr kontrollieren könnt. Zweitens, seid beständig bei eurer Arbeit und euren
+    Gewohnheiten. Drittens, umgebt euch mit Menschen, die euch besser machen. Wenn ihr das macht, verspreche
+    ich euch, dass ihr Ergebnisse sehen werdet. Schreibt mir in die Kommentare, was ihr davon haltet,
+    und wenn ihr Fragen habt, versuche ich alle zu beantworten. Vielen Dank fürs Zuschauen und bis zum
+    nächsten Mal.
+    """,
+    "pt": """
+    Olá a todos e bem-vindos de volta ao canal. Hoje vamos falar sobre uma coisa que muitos de vocês me
+    perguntaram nos comentários, e eu acho que é muito importante. Se você é novo aqui, se inscreva e
+    ative o sininho das notificações para não perder o próximo vídeo. Então, vamos começar. A primeira
+    coisa que você precisa entender é que isso não acontece da noite para o dia. Leva tempo, precisa de
+    prática e precisa de muita paciência. Quando eu comecei, não fazia ideia do que estava fazendo, e
+    cometi todos os erros que vocês podem imaginar. Mas aprendi que as pessoas que conseguem são aquelas
+    que continuam quando as coisas ficam difíceis. Elas aparecem todos os dias, trabalham as suas
+    habilidades e não têm medo de errar. Agora, há três coisas que eu quero que vocês lembrem deste vídeo.
+    Primeiro, foquem no que vocês podem controlar. Segundo, sejam constantes no trabalho e nos hábitos.
+    Terceiro, fiquem perto de pessoas que fazem vocês serem melhores. Se fizerem isso, eu prometo que vão
+    ver resultados. Me digam nos comentários o que vocês acham disso, e se tiverem perguntas vou tentar
+    responder todas. Muito obrigado por assistir e até o próximo vídeo. Não se esqueça de compartilhar.
+    """,
+}
+
+# Intervalli Unicode -> lingua (per gli alfabeti non latini)
+SCRIPT_RANGES = [
+    ("ja", [(0x3040, 0x30FF)]),                    # Hiragana / Katakana (prima degli Han)
+    ("ko", [(0xAC00, 0xD7AF), (0x1100, 0x11FF)]),  # Hangul
+    ("zh", [(0x4E00, 0x9FFF), (0x3400, 0x4DBF)]),  # Han (CJK)
+    ("ru", [(0x0400, 0x04FF)]),                    # Cirillico
+    ("ar", [(0x0600, 0x06FF)]),                    # Arabo
+    ("he", [(0x0590, 0x05FF)]),                    # Ebraico
+    ("el", [(0x0370, 0x03FF)]),                    # Greco
+    ("hi", [(0x0900, 0x097F)]),                    # Devanagari
+    ("th", [(0x0E00, 0x0E7F)]),                    # Thai
+]
+
+# Trigrammi per profilo e quanti ne usiamo dal testo in input
+PROFILE_SIZE = 800
+MIN_LETTERS = 20
+
+_profiles = None
+_NON_LETTERS = re.compile(r"[^\w']+|[\d_]+")
+
+def _trigrams(text):
+    text = _NON_LETTERS.sub(" ", text.lower())
+    padded = f" {' '.join(text.split())} "
+    return Counter(padded[i:i + 3] for i in range(len(padded) - 2))
+
+def _build_profiles():
+    # Profilo = log-probabilità dei trigrammi più frequenti di ogni lingua,
+    # più una penalità fissa (floor) per i trigrammi che non compaiono nel profilo
+    profiles = {}
+    for lang, seed in SEED_TEXTS.items():
+        counts = _trigrams(seed)
+        top = counts.most_common(PROFILE_SIZE)
+        total = sum(c for _, c in top)
+        grams = {gram: math.log(c / total) for gram, c in top}
+        profiles[lang] = (grams, min(grams.values()) - 2.0)
+    return profiles
+
+def _script_language(text):
+    counts = Counter()
+    letters = 0
+    for ch in text:
+        if not ch.isalpha():
+            continue
+        letters += 1
+        code = ord(ch)
+        if code < 0x0370:
+            continue  # latino
+        for lang, ranges in SCRIPT_RANGES:
+            if any(lo <= code <= hi for lo, hi in ranges):
+                counts[lang] += 1
+                break
+    if not counts or letters == 0:
+        return None, 0.0
+    # I testi giapponesi contengono anche Han: basta una quota di kana per dire "ja"
+    if counts["ja"] and counts["ja"] >= 0.1 * letters:
+        return "ja", min(1.0, (counts["ja"] + counts["zh"]) / letters)
+    lang, n = counts.most_common(1)[0]
+    return lang, n / letters
+
+def detect_language(text, max_chars=500):
+    """
+    Restituisce (codice ISO 639-1, confidenza 0..1).
+    Confidenza 0 se il testo è troppo corto o non riconosciuto.
+    """
+    global _profiles
+    sample = (text or "")[:max_chars]
+
+    lang, share = _script_language(sample)
+    if lang and share >= 0.5:
+        return lang, share
+
+    grams = _trigrams(sample)
+    if sum(1 for ch in sample if ch.isalpha()) < MIN_LETTERS:
+        return None, 0.0
+
+    if _profiles is None:
+        _profiles = _build_profiles()
+
+    # Naive Bayes sui trigrammi: i trigrammi assenti dal profilo hanno una penalità fissa
+    total = sum(grams.values())
+    scores = {}
+    for code, (profile, floor) in _profiles.items():
+        scores[code] = sum(profile.get(g, floor) * n for g, n in grams.items()) / total
+
+    ranked = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
+    (best, best_score), (_, second_score) = ranked[0], ranked[1]
+    # Confidenza dal distacco (medio, per trigramma) tra la prima e la seconda lingua
+    confidence = 1 - math.exp(-(best_score - second_score) * 2)
+    return best, confidence
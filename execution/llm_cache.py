@@ -0,0 +1,56 @@
+"""
+Cache content-addressed delle chat completion.
+
+La chiave è l'hash di (model, messages, parametri): stesso prompt -> stessa risposta,
+senza rifare la chiamata. Abilitata solo per gli stage elencati in LLM_CACHE_STAGES
+(quelli deterministici: rilevamento lingua, titolo, tag, parafrasi, traduzione).
+"""
+import os
+import json
+import asyncio
+import hashlib
+
+from execution.sqlite_cache import SQLiteCache
+
+DEFAULT_CACHED_STAGES = "detect_language,title,tags,paraphrase,translate"
+CACHED_STAGES = {
+    s.strip() for s in os.getenv("LLM_CACHE_STAGES", DEFAULT_CACHED_STAGES).split(",") if s.strip()
+}
+
+# Dimensione dei frammenti quando una risposta in cache viene riprodotta come stream
+REPLAY_CHUNK_CHARS = 48
+
+_cache = SQLiteCache(
+    os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite3"),
+    ttl_seconds=int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600))),
+    max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "20000")),
+    max_bytes=int(os.getenv("LLM_CACHE_MAX_MB", "256")) * 1024 * 1024,
+)
+
+def is_cacheable(stage):
+    return stage is not None and stage in CACHED_STAGES
+
+def completion_cache_key(model, messages, params):
+    payload = json.dumps(
+        {"model": model, "messages": messages, "params": params},
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+async def get_cached_completion(key):
+    return await asyncio.to_thread(_cache.get, key)
+
+async def set_cached_completion(key, text):
+    await asyncio.to_thread(_cache.set, key, text)
+
+def replay_chunks(text):
+    """Spezza una risposta in cache in frammenti, come se arrivasse in streaming."""
+    for i in range(0, len(text), REPLAY_CHUNK_CHARS):
+        yield text[i:i + REPLAY_CHUNK_CHARS]
+
+def llm_cache_stats():
+    stats = _cache.stats()
+    stats["stages"] = sorted(CACHED_STAGES)
+    return stats
@@ -1,30 +1,362 @@
 import os
-from openai import OpenAI
+import time
+import asyncio
+import logging
+import httpx
+from openai import OpenAI, AsyncOpenAI
 from dotenv import load_dotenv
 
+from execution.tracing import span
+from execution.model_router import router, ROUTER_MAX_ATTEMPTS
+from execution.deadline import DeadlineExceeded, wait_within, check
+from execution.admission import admitted_call, retry_rate_limited, llm_upstream, Overloaded
+from execution.hedging import is_hedged, hedged, hedge_delay, HEDGE_OTHER_MODEL
+from execution.usage_ledger import record_call, track_usage
+from execution.llm_cache import (
+    is_cacheable,
+    completion_cache_key,
+    get_cached_completion,
+    set_cached_completion,
+    replay_chunks,
+)
+
 load_dotenv()
 
-def get_openrouter_client():
+logger = logging.getLogger(__name__)
+
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+
+# Pool di connessioni condiviso (configurabile da .env)
+OPENROUTER_MAX_CONNECTIONS = int(os.getenv("OPENROUTER_MAX_CONNECTIONS", "100"))
+OPENROUTER_MAX_KEEPALIVE = int(os.getenv("OPENROUTER_MAX_KEEPALIVE", "20"))
+OPENROUTER_KEEPALIVE_EXPIRY = float(os.getenv("OPENROUTER_KEEPALIVE_EXPIRY", "120"))
+OPENROUTER_TIMEOUT = float(os.getenv("OPENROUTER_TIMEOUT", "120"))
+OPENROUTER_CONNECT_TIMEOUT = float(os.getenv("OPENROUTER_CONNECT_TIMEOUT", "10"))
+OPENROUTER_HTTP2 = os.getenv("OPENROUTER_HTTP2", "1") == "1"
+OPENROUTER_WARMUP_CONNECTIONS = int(os.getenv("OPENROUTER_WARMUP_CONNECTIONS", "2"))
+
+_sync_client = None
+_async_client = None
+_async_http_client = None
+_async_client_loop = None
+
+def _get_api_key():
     api_key = os.getenv("OPENROUTER_API_KEY")
     if not api_key:
         raise ValueError("OPENROUTER_API_KEY non trovato nel file .env")
+    return api_key
+
+def _http_client_options():
+    # HTTP/2 solo se il pacchetto h2 è installato (httpx[http2])
+    try:
+        import h2  # noqa: F401
+        http2 = OPENROUTER_HTTP2
+    except ImportError:
+        http2 = False
+
+    return {
+        "http2": http2,
+        "limits": httpx.Limits(
+            max_connections=OPENROUTER_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENROUTER_MAX_KEEPALIVE,
+            keepalive_expiry=OPENROUTER_KEEPALIVE_EXPIRY,
+        ),
+        "timeout": httpx.Timeout(OPENROUTER_TIMEOUT, connect=OPENROUTER_CONNECT_TIMEOUT),
+    }
 
-    return OpenAI(
-        base_url="https://openrouter.ai/api/v1",
-        api_key=api_key,
+def get_openrouter_client():
+    """Client sincrono condiviso dal processo (connessioni keep-alive riusate)."""
+    global _sync_client
+    if _sync_client is None:
+        _sync_client = OpenAI(
+            base_url=OPENROUTER_BASE_URL,
+            api_key=_get_api_key(),
+            http_client=httpx.Client(**_http_client_options()),
+        )
+    return _sync_client
+
+def get_async_openrouter_client():
+    """
+    Client asincrono condiviso: un solo pool di connessioni per processo.
+    Le connessioni httpx sono legate all'event loop, quindi il client viene
+    ricreato solo se cambia il loop (es. asyncio.run negli script CLI).
+    """
+    global _async_client, _async_http_client, _async_client_loop
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+
+    if _async_client is None or _async_client_loop is not loop:
+        _async_http_client = httpx.AsyncClient(**_http_client_options())
+        _async_client = AsyncOpenAI(
+            base_url=OPENROUTER_BASE_URL,
+            api_key=_get_api_key(),
+            http_client=_async_http_client,
+        )
+        _async_client_loop = loop
+    return _async_client
+
+async def warmup_openrouter_client():
+    """
+    Apre in anticipo le connessioni (DNS + TLS) verso OpenRouter,
+    così la prima richiesta degli utenti non paga l'handshake.
+    """
+    try:
+        get_async_openrouter_client()
+    except Exception as e:
+        # Senza chiave (o con configurazione errata) l'app parte comunque: falliranno solo le chiamate LLM
+        logger.warning(f"OpenRouter warm-up saltato: {e}")
+        return
+
+    async def _ping():
+        # Richiesta leggera: serve solo ad aprire la connessione nel pool
+        await _async_http_client.head(f"{OPENROUTER_BASE_URL}/models")
+
+    results = await asyncio.gather(
+        *[_ping() for _ in range(max(OPENROUTER_WARMUP_CONNECTIONS, 1))],
+        return_exceptions=True,
     )
+    errors = [r for r in results if isinstance(r, Exception)]
+    if errors:
+        logger.warning(f"OpenRouter warm-up incompleto: {errors[0]}")
+
+async def close_openrouter_client():
+    global _async_client, _async_http_client, _async_client_loop
+    if _async_client is not None:
+        await _async_client.close()
+    _async_client = None
+    _async_http_client = None
+    _async_client_loop = None
 
 def get_claude_model():
-    """High quality model for complex tasks (slower)"""
-    return "anthropic/claude-3.5-sonnet"
+    """High quality model for complex tasks (slower): the router's current pick for the quality tier"""
+    return router.pick("quality")
 
 def get_fast_model():
-    """Fast model for simple tasks like title generation"""
-    # GPT-4o-mini is very fast and cheap for simple tasks
-    return "openai/gpt-4o-mini"
+    """Fast model for simple tasks like title generation: the router's current pick for the fast tier"""
+    return router.pick("fast")
 
 def get_extra_headers():
     return {
         "HTTP-Referer": "https://antigravity.app",
         "X-Title": "Antigravity App",
     }
+
+def _with_usage_accounting(params, stream=False):
+    # Chiede a OpenRouter il blocco usage completo (token e costo), anche negli stream
+    params = dict(params)
+    params["extra_body"] = {**params.get("extra_body", {}), "usage": {"include": True}}
+    if stream:
+        params["stream_options"] = {**params.get("stream_options", {}), "include_usage": True}
+    return params
+
+def _route(model, tier, stage):
+    """Modelli da provare in ordine: quello indicato esplicitamente, o i candidati del router per il tier."""
+    if model:
+        return [model]
+    candidates = router.candidates(tier or "fast", stage)[:max(ROUTER_MAX_ATTEMPTS, 1)]
+    if not candidates:
+        # Es. un override da env che svuota il tier: meglio un errore chiaro che nessun tentativo
+        raise ValueError(f"No models configured for tier {tier or 'fast'}")
+    return candidates
+
+def _cache_model(model, tier):
+    # Con il routing la chiave di cache è il tier: la risposta vale qualunque modello l'abbia data
+    return model or f"tier:{tier or 'fast'}"
+
+async def _within(awaitable, deadline, stage):
+    """
+    Attende entro l'istante `deadline` del router (perf_counter; None = nessun limite)
+    e comunque entro la scadenza della richiesta (DeadlineExceeded).
+    """
+    timeout = None if deadline is None else max(deadline - time.perf_counter(), 0)
+    return await wait_within(awaitable, timeout, stage)
+
+def _can_fail_over(error):
+    # Un modello saturo si evita passando al successivo; se è pieno l'intero upstream, no
+    return not isinstance(error, Overloaded) or error.limiter.startswith("model:")
+
+def _failover(tier, model, error, stage):
+    if isinstance(error, Overloaded):
+        reason = "overloaded"
+    else:
+        reason = "slow" if isinstance(error, asyncio.TimeoutError) else "error"
+    router.failover(tier or "fast", model, reason)
+    logger.warning(f"LLM {model} failed for stage {stage} ({reason}: {str(error) or type(error).__name__}), trying next model")
+
+async def _send(create, stage, timeout):
+    # Latenza e limite del router partono dall'invio, non dall'attesa in coda
+    started = time.perf_counter()
+    deadline = started + timeout if timeout else None
+    return await _within(create(), deadline, stage), started, deadline
+
+async def _complete_once(model, messages, stage, params, timeout):
+    client = get_async_openrouter_client()
+
+    def create():
+        return client.chat.completions.create(
+            extra_headers=get_extra_headers(),
+            model=model,
+            messages=messages,
+            **_with_usage_accounting(params),
+        )
+
+    try:
+        # Lo span include l'attesa in coda e le pause per 429
+        with span("openrouter", "chat_completion", stage=stage, model=model), track_usage(model, stage) as u:
+            completion, started, _ = await retry_rate_limited(
+                lambda: _send(create, stage, timeout), llm_upstream(model), model
+            )
+            u.usage = completion.usage
+    except (DeadlineExceeded, Overloaded):
+        raise  # finito il tempo della richiesta o coda piena: non colpa del modello
+    except Exception:
+        router.record(model, stage, ok=False)
+        raise
+    router.record(model, stage, latency=time.perf_counter() - started)
+    return completion.choices[0].message.content
+
+def _hedge_model(candidate, model, tier, stage):
+    # Il duplicato va sul modello successivo del tier (salvo modello esplicito o LLM_HEDGE_OTHER_MODEL=0)
+    if model or not HEDGE_OTHER_MODEL:
+        return candidate
+    others = [m for m in router.candidates(tier or "fast", stage, explore=False) if m != candidate]
+    return others[0] if others else candidate
+
+async def _complete_hedged(candidate, model, tier, messages, stage, params, timeout):
+    backup = _hedge_model(candidate, model, tier, stage)
+    backup_timeout = None if model else router.timeout(backup, stage)
+    return await hedged(
+        _complete_once(candidate, messages, stage, params, timeout),
+        lambda: _complete_once(backup, messages, stage, params, backup_timeout),
+        hedge_delay(candidate, stage),
+        stage,
+    )
+
+async def chat_completion(messages, model=None, stage=None, tier=None, hedge=None, **params):
+    """
+    Chat completion asincrona via OpenRouter.
+    Restituisce direttamente il testo della risposta.
+    `stage` identifica il passo della pipeline (es. "title", "tags"): se lo stage
+    è abilitato in LLM_CACHE_STAGES la risposta viene servita/salvata in cache.
+    Senza `model` il modello è scelto dal router tra quelli del `tier` (default "fast"),
+    con failover sul successivo in caso di errore o lentezza.
+    `hedge` forza (True) o esclude (False) le richieste duplicate; di default valgono
+    per gli stage in LLM_HEDGE_STAGES.
+    """
+    cache_key = None
+    if is_cacheable(stage):
+        cache_key = completion_cache_key(_cache_model(model, tier), messages, params)
+        cached = await get_cached_completion(cache_key)
+        if cached is not None:
+            record_call(_cache_model(model, tier), stage, 0.0, cached=True)
+            return cached
+
+    check(stage)
+    candidates = _route(model, tier, stage)
+    for attempt, candidate in enumerate(candidates):
+        timeout = None if model else router.timeout(candidate, stage)
+        try:
+            if hedge if hedge is not None else is_hedged(stage):
+                content = await _complete_hedged(candidate, model, tier, messages, stage, params, timeout)
+            else:
+                content = await _complete_once(candidate, messages, stage, params, timeout)
+            break
+        except DeadlineExceeded:
+            raise  # nessun failover: un altro modello non avrebbe più tempo
+        except Exception as e:
+            if attempt == len(candidates) - 1 or not _can_fail_over(e):
+                raise
+            _failover(tier, candidate, e, stage)
+
+    if cache_key and content:
+        await set_cached_completion(cache_key, content)
+    return content
+
+async def _stream_once(model, messages, stage, params, timeout):
+    """Stream da un solo modello; `timeout` vale fino al primo token (poi il failover non è più possibile)."""
+    client = get_async_openrouter_client()
+
+    def create():
+        return client.chat.completions.create(
+            extra_headers=get_extra_headers(),
+            model=model,
+            messages=messages,
+            stream=True,
+            **_with_usage_accounting(params, stream=True),
+        )
+
+    ttft = None
+    try:
+        with span("openrouter", "chat_completion_stream", stage=stage, model=model) as s, track_usage(model, stage) as u:
+            # Il posto sull'upstream resta occupato per tutta la durata dello stream
+            async with admitted_call(
+                lambda: _send(create, stage, timeout), llm_upstream(model), model
+            ) as (response, started, deadline):
+                try:
+                    chunks = response.__aiter__()
+                    while True:
+                        try:
+                            # Il limite del router vale fino al primo token, la scadenza della richiesta sempre
+                            chunk = await _within(chunks.__anext__(), deadline if ttft is None else None, stage)
+                        except StopAsyncIteration:
+                            break
+                        if chunk.usage:
+                            u.usage = chunk.usage  # ultimo chunk, senza choices
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            if ttft is None:
+                                ttft = time.perf_counter() - started
+                                s.first_token()
+                            yield chunk.choices[0].delta.content
+                finally:
+                    # Stream interrotto (es. client disconnesso): chiudere la connessione
+                    # fa smettere OpenRouter di generare token che nessuno leggerà
+                    await response.close()
+    except (DeadlineExceeded, Overloaded):
+        raise  # finito il tempo della richiesta o coda piena: non colpa del modello
+    except Exception:
+        router.record(model, stage, ok=False)
+        raise
+    router.record(model, stage, latency=ttft if ttft is not None else time.perf_counter() - started)
+
+async def chat_completion_stream(messages, model=None, stage=None, tier=None, **params):
+    """
+    Come chat_completion, ma produce i frammenti di testo man mano che arrivano.
+    Una risposta in cache viene riprodotta come stream, quindi il client non vede differenze.
+    Il failover su un altro modello del tier è possibile solo prima del primo frammento.
+    """
+    cache_key = None
+    if is_cacheable(stage):
+        cache_key = completion_cache_key(_cache_model(model, tier), messages, params)
+        cached = await get_cached_completion(cache_key)
+        if cached is not None:
+            record_call(_cache_model(model, tier), stage, 0.0, cached=True)
+            for piece in replay_chunks(cached):
+                yield piece
+            return
+
+    parts = []
+    check(stage)
+    candidates = _route(model, tier, stage)
+    for attempt, candidate in enumerate(candidates):
+        timeout = None if model else router.timeout(candidate, stage)
+        stream = _stream_once(candidate, messages, stage, params, timeout)
+        try:
+            async for piece in stream:
+                parts.append(piece)
+                yield piece
+            break
+        except DeadlineExceeded:
+            raise  # nessun failover: un altro modello non avrebbe più tempo
+        except Exception as e:
+            if parts or attempt == len(candidates) - 1 or not _can_fail_over(e):
+                raise
+            _failover(tier, candidate, e, stage)
+        finally:
+            # Chiusura esplicita: se il consumatore smette di leggere la risposta va chiusa subito
+            await stream.aclose()
+
+    # Salviamo solo risposte complete (uno stream interrotto non arriva qui)
+    if cache_key and parts:
+        await set_cached_completion(cache_key, "".join(parts))
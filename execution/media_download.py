@@ -0,0 +1,115 @@
+"""
+Download asincrono dei video (es. MP4 di Instagram) da passare ai modelli multimodali.
+
+Il video viene scaricato in streaming e codificato in base64 a blocchi, con il
+limite di dimensione verificato prima (HEAD / Content-Length) e durante il download:
+un file troppo grande viene scartato subito, senza tenerlo tutto in memoria.
+"""
+import os
+import base64
+import asyncio
+from contextlib import asynccontextmanager
+
+import httpx
+
+from execution.tracing import span
+from execution.deadline import bounded, wait_within
+
+BROWSER_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+}
+
+# OpenRouter accetta ~50MB, ma restiamo prudenti
+MAX_VIDEO_BYTES = int(float(os.getenv("VIDEO_MAX_MB", "25")) * 1024 * 1024)
+# Quanti video possono stare in memoria (download + chiamata LLM) nello stesso momento
+MAX_CONCURRENT_VIDEOS = int(os.getenv("VIDEO_MAX_CONCURRENT", "2"))
+DOWNLOAD_CHUNK_BYTES = 3 * 64 * 1024  # multiplo di 3: ogni blocco si codifica senza padding
+
+_client = None
+_client_loop = None
+_video_slots = None
+
+class VideoTooLargeError(Exception):
+    pass
+
+class VideoDownloadError(Exception):
+    pass
+
+def _get_client():
+    # Sessione condivisa (keep-alive verso le CDN), ricreata solo se cambia l'event loop
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client_loop is not loop:
+        _client = httpx.AsyncClient(
+            headers=BROWSER_HEADERS,
+            timeout=httpx.Timeout(30, connect=10),
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=5),
+        )
+        _client_loop = loop
+    return _client
+
+@asynccontextmanager
+async def video_slot():
+    """Limita i video tenuti in memoria contemporaneamente (vedi VIDEO_MAX_CONCURRENT)."""
+    global _video_slots
+    if _video_slots is None:
+        _video_slots = asyncio.Semaphore(MAX_CONCURRENT_VIDEOS)
+    async with _video_slots:
+        yield
+
+def _check_length(headers, max_bytes):
+    length = headers.get("Content-Length")
+    if length and length.isdigit() and int(length) > max_bytes:
+        raise VideoTooLargeError(f"Video di {int(length) / 1024 / 1024:.1f} MB (limite {max_bytes / 1024 / 1024:.0f} MB)")
+
+async def download_video_data_url(video_url, max_bytes=MAX_VIDEO_BYTES, timeout=30):
+    """
+    Scarica il video e restituisce un data URL base64 ("data:video/mp4;base64,...").
+    Solleva VideoTooLargeError appena si capisce che il file supera max_bytes,
+    VideoDownloadError se il server non risponde 200.
+    """
+    # `timeout` vale per ogni operazione HTTP; il download intero deve finire entro la scadenza della richiesta
+    timeout = bounded(timeout)
+    with span("cdn", "video_download", stage="ig_transcribe"):
+        return await wait_within(_download_data_url(_get_client(), video_url, max_bytes, timeout), stage="ig_transcribe")
+
+async def _download_data_url(client, video_url, max_bytes, timeout):
+    # 1. Pre-check economico: molte CDN dichiarano la dimensione già nella HEAD
+    try:
+        head = await client.head(video_url, timeout=timeout)
+        if head.status_code == 200:
+            _check_length(head.headers, max_bytes)
+    except httpx.HTTPError:
+        pass  # HEAD non supportata: controlliamo durante il download
+
+    # 2. Download in streaming con codifica base64 incrementale
+    async with client.stream("GET", video_url, timeout=timeout) as resp:
+        if resp.status_code != 200:
+            raise VideoDownloadError(f"Download fallito: HTTP {resp.status_code}")
+        _check_length(resp.headers, max_bytes)
+        content_type = resp.headers.get("Content-Type", "video/mp4")
+
+        encoded = [f"data:{content_type};base64,"]
+        pending = b""
+        total = 0
+        async for chunk in resp.aiter_bytes(DOWNLOAD_CHUNK_BYTES):
+            total += len(chunk)
+            if total > max_bytes:
+                raise VideoTooLargeError(f"Video oltre il limite di {max_bytes / 1024 / 1024:.0f} MB")
+            pending += chunk
+            # Codifichiamo solo multipli di 3 byte; il resto passa al blocco successivo
+            cut = len(pending) - len(pending) % 3
+            encoded.append(base64.b64encode(pending[:cut]).decode("ascii"))
+            pending = pending[cut:]
+        if pending:
+            encoded.append(base64.b64encode(pending).decode("ascii"))
+
+    return "".join(encoded)
+
+async def close_download_client():
+    global _client, _client_loop
+    if _client is not None:
+        await _client.aclose()
+    _client = None
+    _client_loop = None
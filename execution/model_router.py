@@ -0,0 +1,208 @@
+"""
+Router dei modelli LLM per livello (tier).
+
+Ogni tier (fast, quality, research, video) ha una classe di modelli equivalenti,
+configurabile da .env: MODEL_TIER_<TIER> con gli ID OpenRouter separati da
+virgola, in ordine di preferenza.
+
+Per ogni modello il router tiene, sugli ultimi ROUTER_WINDOW_SECONDS:
+- la latenza delle chiamate riuscite (p50/p95, per stage: un titolo e uno script
+  non sono confrontabili); negli stream conta il time-to-first-token
+- l'esito delle chiamate (tasso di errore), più un periodo di pausa dopo
+  ROUTER_MAX_CONSECUTIVE_ERRORS errori di fila
+
+e sceglie il modello sano più veloce. chat_completion passa al candidato
+successivo se il modello scelto fallisce o supera di molto il suo p95.
+"""
+import os
+import time
+import random
+import logging
+from collections import deque
+
+from execution.tracing import Counter, register
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIERS = {
+    "fast": "openai/gpt-4o-mini,google/gemini-2.0-flash-001",
+    "quality": "anthropic/claude-3.5-sonnet,openai/gpt-4o",
+    "research": "perplexity/sonar,openai/gpt-4o-mini:online",
+    "video": "google/gemini-2.0-flash-001,google/gemini-2.5-flash",
+}
+
+ROUTER_WINDOW_SECONDS = float(os.getenv("ROUTER_WINDOW_SECONDS", "300"))
+# Sotto questo numero di campioni la latenza di un modello non è considerata affidabile
+ROUTER_MIN_SAMPLES = int(os.getenv("ROUTER_MIN_SAMPLES", "5"))
+ROUTER_MAX_ERROR_RATE = float(os.getenv("ROUTER_MAX_ERROR_RATE", "0.5"))
+ROUTER_MAX_CONSECUTIVE_ERRORS = int(os.getenv("ROUTER_MAX_CONSECUTIVE_ERRORS", "3"))
+ROUTER_COOLDOWN_SECONDS = float(os.getenv("ROUTER_COOLDOWN_SECONDS", "60"))
+# Una chiamata più lenta di p95 * ROUTER_SLOW_FACTOR (e di ROUTER_MIN_TIMEOUT) passa al modello successivo
+ROUTER_SLOW_FACTOR = float(os.getenv("ROUTER_SLOW_FACTOR", "3"))
+ROUTER_MIN_TIMEOUT = float(os.getenv("ROUTER_MIN_TIMEOUT", "10"))
+# Quota di chiamate mandate a un altro modello sano, per tenerne aggiornata la latenza
+ROUTER_EXPLORE_RATE = float(os.getenv("ROUTER_EXPLORE_RATE", "0.05"))
+# Modelli provati al massimo per una chiamata (il primo più i failover)
+ROUTER_MAX_ATTEMPTS = int(os.getenv("ROUTER_MAX_ATTEMPTS", "2"))
+
+ROUTER_FAILOVERS = register(Counter(
+    "llm_router_failovers_total",
+    "LLM calls moved to the next model of the tier, by failed model and reason (error, slow, overloaded).",
+    ("tier", "model", "reason"),
+))
+
+def _tier_models(tier):
+    value = os.getenv(f"MODEL_TIER_{tier.upper()}", DEFAULT_TIERS[tier])
+    return [m.strip() for m in value.split(",") if m.strip()]
+
+def _percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+class _Window:
+    """Campioni (istante, valore) degli ultimi ROUTER_WINDOW_SECONDS."""
+
+    def __init__(self, maxlen=500):
+        self.samples = deque(maxlen=maxlen)
+
+    def add(self, value, now):
+        self.samples.append((now, value))
+
+    def values(self, now):
+        cutoff = now - ROUTER_WINDOW_SECONDS
+        while self.samples and self.samples[0][0] < cutoff:
+            self.samples.popleft()
+        return [value for _, value in self.samples]
+
+class _ModelHealth:
+    def __init__(self):
+        self.outcomes = _Window()  # 1 = errore, 0 = ok
+        self.latency = {}          # stage -> _Window
+        self.consecutive_errors = 0
+        self.cooldown_until = 0.0
+
+class ModelRouter:
+    def __init__(self, tiers=None):
+        self.tiers = tiers or {tier: _tier_models(tier) for tier in DEFAULT_TIERS}
+        self._health = {}
+
+    def _model(self, model):
+        health = self._health.get(model)
+        if health is None:
+            health = self._health[model] = _ModelHealth()
+        return health
+
+    def models(self, tier):
+        if tier not in self.tiers:
+            raise ValueError(f"Tier sconosciuto: {tier} (disponibili: {', '.join(self.tiers)})")
+        return self.tiers[tier]
+
+    def record(self, model, stage=None, latency=None, ok=True):
+        """Registra l'esito di una chiamata (latenza in secondi solo per quelle riuscite)."""
+        now = time.monotonic()
+        health = self._model(model)
+        health.outcomes.add(0 if ok else 1, now)
+        if ok:
+            health.consecutive_errors = 0
+            if latency is not None:
+                window = health.latency.get(stage or "")
+                if window is None:
+                    window = health.latency[stage or ""] = _Window()
+                window.add(latency, now)
+        else:
+            health.consecutive_errors += 1
+            if health.consecutive_errors >= ROUTER_MAX_CONSECUTIVE_ERRORS:
+                health.cooldown_until = now + ROUTER_COOLDOWN_SECONDS
+                health.consecutive_errors = 0
+                logger.warning(f"Model {model} paused for {ROUTER_COOLDOWN_SECONDS:g}s after repeated errors")
+
+    def latency(self, model, stage=None, now=None):
+        """(p50, p95, campioni) della latenza del modello per lo stage; p50/p95 None senza campioni."""
+        now = now or time.monotonic()
+        window = self._model(model).latency.get(stage or "")
+        values = sorted(window.values(now)) if window else []
+        if not values:
+            return None, None, 0
+        return _percentile(values, 0.5), _percentile(values, 0.95), len(values)
+
+    def quantile(self, model, stage=None, q=0.95):
+        """Percentile q della latenza per lo stage, o None finché i campioni sono meno di ROUTER_MIN_SAMPLES."""
+        window = self._model(model).latency.get(stage or "")
+        values = sorted(window.values(time.monotonic())) if window else []
+        if len(values) < ROUTER_MIN_SAMPLES:
+            return None
+        return _percentile(values, q)
+
+    def error_rate(self, model, now=None):
+        """(tasso di errore, chiamate) nella finestra."""
+        outcomes = self._model(model).outcomes.values(now or time.monotonic())
+        return (sum(outcomes) / len(outcomes) if outcomes else 0.0), len(outcomes)
+
+    def healthy(self, model, now=None):
+        now = now or time.monotonic()
+        if self._model(model).cooldown_until > now:
+            return False
+        rate, calls = self.error_rate(model, now)
+        return calls < ROUTER_MIN_SAMPLES or rate <= ROUTER_MAX_ERROR_RATE
+
+    def candidates(self, tier, stage=None, explore=True):
+        """
+        Modelli del tier nell'ordine in cui provarli: il sano più veloce per lo stage,
+        poi gli altri sani in ordine di preferenza, infine quelli non sani (ultima risorsa).
+        """
+        now = time.monotonic()
+        models = self.models(tier)
+        healthy = [m for m in models if self.healthy(m, now)]
+        unhealthy = [m for m in models if m not in healthy]
+        if not healthy:
+            return unhealthy
+
+        chosen = healthy[0]
+        if explore and len(healthy) > 1 and random.random() < ROUTER_EXPLORE_RATE:
+            chosen = random.choice(healthy[1:])
+        else:
+            p50, _, samples = self.latency(chosen, stage, now)
+            # Finché il preferito non ha abbastanza campioni resta lui (avvio a freddo)
+            if samples >= ROUTER_MIN_SAMPLES:
+                for model in healthy[1:]:
+                    other_p50, _, other_samples = self.latency(model, stage, now)
+                    if other_samples >= ROUTER_MIN_SAMPLES and other_p50 < p50:
+                        chosen, p50 = model, other_p50
+        return [chosen] + [m for m in healthy if m != chosen] + unhealthy
+
+    def pick(self, tier, stage=None, explore=True):
+        return self.candidates(tier, stage, explore)[0]
+
+    def timeout(self, model, stage=None):
+        """Oltre questa durata la chiamata è considerata lenta (None finché mancano i campioni)."""
+        _, p95, samples = self.latency(model, stage)
+        if samples < ROUTER_MIN_SAMPLES:
+            return None
+        return max(p95 * ROUTER_SLOW_FACTOR, ROUTER_MIN_TIMEOUT)
+
+    def failover(self, tier, model, reason):
+        ROUTER_FAILOVERS.inc(tier=tier, model=model, reason=reason)
+
+    def stats(self):
+        now = time.monotonic()
+        tiers = {}
+        for tier, models in self.tiers.items():
+            tiers[tier] = {"preferred": self.pick(tier, explore=False), "models": {}}
+            for model in models:
+                health = self._model(model)
+                rate, calls = self.error_rate(model, now)
+                stages = {}
+                for stage in sorted(health.latency):
+                    p50, p95, samples = self.latency(model, stage, now)
+                    if samples:
+                        stages[stage or "-"] = {"p50": round(p50, 3), "p95": round(p95, 3), "samples": samples}
+                tiers[tier]["models"][model] = {
+                    "healthy": self.healthy(model, now),
+                    "error_rate": round(rate, 3),
+                    "calls": calls,
+                    "cooldown_seconds": round(max(health.cooldown_until - now, 0), 1),
+                    "latency": stages,
+                }
+        return {"window_seconds": ROUTER_WINDOW_SECONDS, "tiers": tiers}
+
+# Router condiviso dal processo
+router = ModelRouter()
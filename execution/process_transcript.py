@@ -2,7 +2,9 @@
 Script per processare e migliorare la trascrizione.
 """
 import re
-from execution.llm_utils import get_openrouter_client, get_claude_model, get_extra_headers
+import asyncio
+from execution.llm_utils import chat_completion
+from execution.caption_store import CaptionStore
 
 def clean_transcript(text):
     """Rimuove tag come [Music], [Applause] e pulisce spazi extra."""
@@ -14,113 +16,99 @@ def clean_transcript(text):
     text = re.sub(r'\s+', ' ', text).strip()
     return text
 
-def format_transcript(text, captions=None):
+_SPACE_AFTER_PUNCTUATION = re.compile(r'([.!?])([^\s\n])')
+_SENTENCE_BREAK = re.compile(r'([.!?])\s+')
+_EXTRA_NEWLINES = re.compile(r'\n{3,}')
+
+def _clean_paragraph(paragraph):
+    # Assicuriamoci che ci siano spazi dopo la punteggiatura
+    return _EXTRA_NEWLINES.sub('\n\n', _SPACE_AFTER_PUNCTUATION.sub(r'\1 \2', paragraph))
+
+def iter_format_transcript(text, captions=None):
     """
-    Formatta il testo per renderlo più leggibile.
-    Se disponibili i captions, usa i timestamp per rilevare pause (silenzio) e creare paragrafi.
-    Altrimenti usa la punteggiatura.
+    Come format_transcript, ma produce i paragrafi uno alla volta, appena le regole
+    (silenzio, numero di segmenti, punteggiatura) li chiudono: il primo paragrafo
+    è disponibile senza aspettare di aver formattato tutto il video.
+    "\n\n".join(iter_format_transcript(...)) == format_transcript(...)
     """
-    
-    # 1. Se abbiamo i metadati dei caption (lista di segmenti)
-    if captions and isinstance(captions, list) and len(captions) > 0:
-        formatted_chunks = []
-        current_paragraph = []
-        
-        # Soglia silenzio RIDOTTA per più interruzioni (0.25s invece di 0.5s)
-        SILENCE_THRESHOLD = 0.25
-        # Numero massimo di segmenti per paragrafo (per evitare paragrafi troppo lunghi)
-        MAX_SEGMENTS_PER_PARAGRAPH = 5
-        
-        last_end = 0.0
-        segment_count = 0
-        
-        for i, cap in enumerate(captions):
-            # Normalizza dati segmento
-            seg_text = cap.get('text', '').strip()
-            if not seg_text:
+    # 1. Se abbiamo i metadati dei caption (lista di segmenti o CaptionStore)
+    if captions is not None and len(captions) > 0:
+        if not isinstance(captions, CaptionStore):
+            captions = CaptionStore.from_captions(captions)
+        # Paragrafi per pause di silenzio, numero massimo di segmenti o punteggiatura forte:
+        # una passata lineare sugli array dello store
+        first = None
+        for index, paragraph in enumerate(captions.iter_paragraphs()):
+            if index == 0:
+                # Se resta l'unico paragrafo va spezzato per frasi: lo teniamo finché non arriva il secondo
+                first = paragraph
                 continue
-                
-            try:
-                start = float(cap.get('start', 0))
-                dur = float(cap.get('dur', 0))
-                end = start + dur
-            except (ValueError, TypeError):
-                # Fallback se i dati non sono numerici
-                start, end = 0, 0
-            
-            # Calcola gap dal segmento precedente
-            gap = start - last_end
-            
-            # Determina se iniziare nuovo paragrafo
-            is_new_paragraph = False
-            
-            if i > 0:
-                # Break se pausa significativa
-                if gap > SILENCE_THRESHOLD:
-                    is_new_paragraph = True
-                # Break se troppi segmenti nel paragrafo corrente
-                elif segment_count >= MAX_SEGMENTS_PER_PARAGRAPH:
-                    is_new_paragraph = True
-                # Break se il testo precedente finisce con punteggiatura forte
-                elif current_paragraph and current_paragraph[-1].rstrip().endswith(('.', '!', '?')):
-                    is_new_paragraph = True
-            
-            # Aggiungi al paragrafo corrente o iniziane uno nuovo
-            if is_new_paragraph and current_paragraph:
-                formatted_chunks.append(" ".join(current_paragraph))
-                current_paragraph = []
-                segment_count = 0
-            
-            current_paragraph.append(seg_text)
-            segment_count += 1
-            last_end = end
-        
-        # Aggiungi l'ultimo pezzo
-        if current_paragraph:
-            formatted_chunks.append(" ".join(current_paragraph))
-            
-        text = "\n\n".join(formatted_chunks)
+            if first is not None:
+                yield _clean_paragraph(first)
+                first = None
+            yield _clean_paragraph(paragraph)
+        if first is None:
+            return
+        text = first
     
     # 2. Fallback / Post-processing con punteggiatura
     # Assicuriamoci che ci siano spazi dopo la punteggiatura
-    text = re.sub(r'([.!?])([^\s\n])', r'\1 \2', text)
+    text = _SPACE_AFTER_PUNCTUATION.sub(r'\1 \2', text)
     
     # Se il testo è ancora un blocco unico (es. niente caption data), usa regex
     if "\n\n" not in text:
          # Aggiunge un doppio a capo dopo ogni punto seguito da spazio
-         text = re.sub(r'([.!?])\s+', r'\1\n\n', text)
+         text = _SENTENCE_BREAK.sub(r'\1\n\n', text)
     
     # 3. Pulizia finale: rimuovi paragrafi vuoti multipli
-    text = re.sub(r'\n{3,}', '\n\n', text)
+    text = _EXTRA_NEWLINES.sub('\n\n', text)
 
-    return text
+    yield from text.split("\n\n")
 
-def generate_title(text):
-    """Genera un titolo basato sul contenuto usando LLM (fast model)."""
-    if not text or len(text) < 50:
-        return "Video Transcript"
-    
-    # Import fast model for speed
-    from execution.llm_utils import get_fast_model
-        
-    client = get_openrouter_client()
-    
+def format_transcript(text, captions=None):
+    """
+    Formatta il testo per renderlo più leggibile.
+    Se disponibili i captions (lista Apify o CaptionStore), usa i timestamp per rilevare
+    pause (silenzio) e creare paragrafi. Altrimenti usa la punteggiatura.
+    """
+    if captions is not None and len(captions) > 0:
+        store = captions if isinstance(captions, CaptionStore) else CaptionStore.from_captions(captions)
+        paragraphs = store.paragraphs()
+        if len(paragraphs) > 1:
+            # Con più paragrafi la pulizia va sul testo intero: due regex in tutto invece che
+            # due per paragrafo (i segmenti sono già senza spazi ai bordi, il risultato è lo stesso)
+            return _clean_paragraph("\n\n".join(paragraphs))
+    return "\n\n".join(iter_format_transcript(text, captions))
+
+def build_title_prompt(text):
+    """Prompt per generate_title_async (separato per poterlo misurare senza chiamare l'LLM)."""
     # Use only first 500 chars for speed (enough to understand topic)
-    prompt = f"""Generate a short, engaging video title (max 8 words) based on this transcript snippet.
+    return f"""Generate a short, engaging video title (max 8 words) based on this transcript snippet.
 Return ONLY the title, no quotes or extra text.
 
 Transcript: {text[:500]}"""
+
+async def generate_title_async(text):
+    """Genera un titolo basato sul contenuto usando LLM (fast model)."""
+    if not text or len(text) < 50:
+        return "Video Transcript"
+    
+    prompt = build_title_prompt(text)
     
     try:
-        completion = client.chat.completions.create(
-            extra_headers=get_extra_headers(),
-            model=get_fast_model(),  # Fast model for quick response
+        title = await chat_completion(
+            stage="title",
+            tier="fast",  # Fast model for quick response
             messages=[
                 {"role": "user", "content": prompt},
             ],
             max_tokens=50,  # Limit output for speed
         )
-        return completion.choices[0].message.content.strip().replace('"', '')
+        return title.strip().replace('"', '')
     except Exception as e:
         print(f"Error generating title: {e}")
         return "Video Transcript"
+
+def generate_title(text):
+    """Versione sincrona di generate_title_async."""
+    return asyncio.run(generate_title_async(text))
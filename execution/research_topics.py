@@ -18,16 +18,23 @@ Output:
 import os
 import sys
 import json
+import asyncio
 import argparse
 from dotenv import load_dotenv
-from openai import OpenAI
+
+# Permette l'esecuzione diretta dello script (python execution/research_topics.py)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from execution.llm_utils import chat_completion
+from execution.deadline import DeadlineExceeded, wait_within
+from execution.admission import Overloaded, RateLimited
 
 # Carica variabili d'ambiente
 load_dotenv()
 
-def research_simple(query, client, target_language="it", model="perplexity/sonar"):
+async def research_simple(query, target_language="it", model=None):
     """
-    Esegue una singola ricerca su Perplexity
+    Esegue una singola ricerca (Perplexity sonar, o il modello del tier "research" scelto dal router)
     """
     language_mapping = {
         'it': 'Italian',
@@ -38,50 +45,90 @@ def research_simple(query, client, target_language="it", model="perplexity/sonar
     }
     target_lang_name = language_mapping.get(target_language, 'Italian')
 
-    completion = client.chat.completions.create(
+    return await chat_completion(
+        stage="research",
         model=model,
+        tier="research",
         messages=[
             {"role": "system", "content": f"Sei un assistente di ricerca accurato. Cerca informazioni recenti e dettagliate. Rispondi in lingua {target_lang_name}."},
             {"role": "user", "content": f"Cerca informazioni dettagliate e recenti su: {query}. Fornisci sintesi con fonti in lingua {target_lang_name}."},
         ],
     )
-    return completion.choices[0].message.content
-
-def research_topics(topics, target_language="it"):
-    api_key = os.getenv("OPENROUTER_API_KEY")
-    if not api_key:
-        raise ValueError("OPENROUTER_API_KEY non trovato nel file .env")
 
-    client = OpenAI(
-        base_url="https://openrouter.ai/api/v1",
-        api_key=api_key,
-    )
-    
-    # Perplexity sonar via OpenRouter
-    model = "perplexity/sonar" 
+# Ricerche in parallelo (limite configurabile) e timeout per singolo topic
+RESEARCH_CONCURRENCY = int(os.getenv("RESEARCH_CONCURRENCY", "5"))
+RESEARCH_TOPIC_TIMEOUT = float(os.getenv("RESEARCH_TOPIC_TIMEOUT", "90"))
 
-    results = []
-    
-    for topic in topics:
-        # print(f"Ricerca in corso per: {topic}...", file=sys.stderr)
+async def _research_one(topic, target_language, semaphore, timeout):
+    async with semaphore:
         try:
-            content = research_simple(topic, client, target_language, model)
-            results.append({
+            content = await wait_within(research_simple(topic, target_language), timeout, stage="research")
+            return {
                 "topic": topic,
                 "research": content
-            })
+            }
+        except DeadlineExceeded:
+            return {
+                "topic": topic,
+                "error": "Timeout: tempo della richiesta esaurito"
+            }
+        except asyncio.TimeoutError:
+            return {
+                "topic": topic,
+                "error": f"Timeout: nessuna risposta entro {timeout:g}s"
+            }
+        except (Overloaded, RateLimited):
+            raise  # Perplexity saturo: la richiesta va rifiutata (503/429), non completata senza ricerca
         except Exception as e:
-            results.append({
+            return {
                 "topic": topic,
                 "error": str(e)
-            })
-            
-    return results
+            }
+
+def _start_research(topics, target_language, concurrency, timeout):
+    semaphore = asyncio.Semaphore(concurrency or RESEARCH_CONCURRENCY)
+    timeout = timeout or RESEARCH_TOPIC_TIMEOUT
+    return [
+        asyncio.ensure_future(_research_one(topic, target_language, semaphore, timeout))
+        for topic in topics
+    ]
+
+async def research_topics_async(topics, target_language="it", concurrency=None, timeout=None):
+    """
+    Ricerca tutti i topic in parallelo (al massimo `concurrency` alla volta).
+    Il tempo totale è quello della ricerca più lenta, non la somma.
+    I risultati mantengono l'ordine dei topic in input.
+    """
+    tasks = _start_research(topics, target_language, concurrency, timeout)
+    try:
+        return list(await asyncio.gather(*tasks))
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def iter_research_topics(topics, target_language="it", concurrency=None, timeout=None):
+    """
+    Variante in streaming: produce il risultato di ogni topic appena è pronto
+    (ordine di completamento, non di input).
+    """
+    tasks = _start_research(topics, target_language, concurrency, timeout)
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # Se il consumatore si ferma prima, non lasciamo ricerche orfane
+        for task in tasks:
+            task.cancel()
+
+def research_topics(topics, target_language="it", concurrency=None):
+    """Versione sincrona per l'uso da riga di comando."""
+    return asyncio.run(research_topics_async(topics, target_language, concurrency))
 
 def main():
     parser = argparse.ArgumentParser(description="Ricerca topics con Perplexity")
     parser.add_argument("input", help="JSON string o file path dei topics")
     parser.add_argument("--json", action="store_true", help="Output JSON invece che testo formattato")
+    parser.add_argument("--concurrency", type=int, default=None, help="Ricerche in parallelo (default: RESEARCH_CONCURRENCY)")
     
     args = parser.parse_args()
     
@@ -102,7 +149,7 @@ def main():
          sys.exit(1)
 
     try:
-        research_results = research_topics(topics_data)
+        research_results = research_topics(topics_data, concurrency=args.concurrency)
         
         if args.json:
             print(json.dumps(research_results, indent=2, ensure_ascii=False))
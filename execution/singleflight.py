@@ -0,0 +1,161 @@
+"""
+Single-flight: richieste identiche in corso nello stesso momento condividono
+un'unica esecuzione (una sola run Apify, una sola catena di chiamate LLM).
+
+- SingleFlight: per funzioni che restituiscono un valore (es. /api/transcribe)
+- StreamSingleFlight: per stream di eventi (es. /api/transcribe-stream); chi
+  arriva dopo riceve prima gli eventi già emessi, poi segue quelli nuovi in diretta
+
+L'esecuzione condivisa gira in un task separato: se il client che l'ha avviata
+si disconnette, gli altri continuano a ricevere i risultati. Quando se ne vanno
+tutti prima della fine, l'esecuzione viene cancellata (e con lei le chiamate
+upstream in corso): nessuno ne leggerebbe il risultato.
+
+L'esecuzione condivisa gira con la scadenza di chi l'ha avviata (execution.deadline):
+una richiesta si unisce solo se quella scadenza non arriva prima della sua; altrimenti
+ne avvia una nuova, che prende il posto della precedente per chi arriva dopo.
+"""
+import asyncio
+
+from execution.deadline import current_deadline, covers
+
+class SingleFlight:
+    def __init__(self):
+        self._flights = {}
+        self._deadlines = {}  # task -> scadenza di chi l'ha avviato
+        self._waiters = {}  # task -> chiamanti in attesa
+        self.coalesced = 0
+        self.cancelled = 0
+
+    async def call(self, key, factory):
+        """
+        Esegue `await factory()` una sola volta per chiave tra le chiamate concorrenti.
+        Con key None la deduplicazione è disattivata.
+        """
+        if key is None:
+            return await factory()
+        deadline = current_deadline()
+        task = self._flights.get(key)
+        if (
+            task is None
+            or task.get_loop() is not asyncio.get_running_loop()
+            or not covers(self._deadlines.get(task), deadline)
+        ):
+            task = asyncio.ensure_future(factory())
+            self._flights[key] = task
+            self._deadlines[task] = deadline
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            self.coalesced += 1
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            # shield: se questo chiamante viene cancellato, gli altri non ne risentono
+            return await asyncio.shield(task)
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+                if not task.done():
+                    # Era l'ultimo chiamante: il risultato non serve più a nessuno
+                    task.cancel()
+                    self.cancelled += 1
+                    if self._flights.get(key) is task:
+                        del self._flights[key]
+
+    def _forget(self, key, task):
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        self._deadlines.pop(task, None)
+        if not task.cancelled():
+            task.exception()  # evita il warning "exception was never retrieved"
+
+    def stats(self):
+        return {"in_flight": len(self._flights), "coalesced": self.coalesced, "cancelled": self.cancelled}
+
+class _StreamFlight:
+    def __init__(self):
+        self.events = []
+        self.error = None
+        self.done = False
+        self.changed = asyncio.Event()
+        self.task = None
+        self.deadline = None
+        self.subscribers = 0
+
+    def _publish(self):
+        # Sveglia chi aspetta e prepara un nuovo Event per il prossimo cambiamento
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+class StreamSingleFlight:
+    def __init__(self):
+        self._flights = {}
+        self.coalesced = 0
+        self.cancelled = 0
+
+    async def subscribe(self, key, factory):
+        """
+        Iteratore asincrono sugli eventi di `factory()` (un generatore asincrono),
+        avviato una sola volta per chiave tra gli abbonati concorrenti.
+        Con key None la deduplicazione è disattivata.
+        """
+        if key is None:
+            iterator = factory()
+            try:
+                async for event in iterator:
+                    yield event
+            finally:
+                await iterator.aclose()
+            return
+
+        deadline = current_deadline()
+        flight = self._flights.get(key)
+        if (
+            flight is None
+            or flight.task.get_loop() is not asyncio.get_running_loop()
+            or not covers(flight.deadline, deadline)
+        ):
+            flight = _StreamFlight()
+            flight.deadline = deadline
+            flight.task = asyncio.ensure_future(self._pump(key, flight, factory()))
+            self._flights[key] = flight
+        else:
+            self.coalesced += 1
+
+        flight.subscribers += 1
+        try:
+            index = 0
+            while True:
+                if index < len(flight.events):
+                    yield flight.events[index]
+                    index += 1
+                    continue
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                await flight.changed.wait()
+        finally:
+            flight.subscribers -= 1
+            if not flight.subscribers and not flight.done:
+                # Ultimo abbonato uscito prima della fine: si ferma la pipeline
+                flight.task.cancel()
+                self.cancelled += 1
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+
+    async def _pump(self, key, flight, iterator):
+        try:
+            async for event in iterator:
+                flight.events.append(event)
+                flight._publish()
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            flight._publish()
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def stats(self):
+        return {"in_flight": len(self._flights), "coalesced": self.coalesced, "cancelled": self.cancelled}
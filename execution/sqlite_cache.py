@@ -0,0 +1,127 @@
+"""
+Cache persistente chiave/valore su SQLite, condivisa tra i worker uvicorn.
+
+- TTL per voce
+- eviction LRU limitata per numero di voci e dimensione totale (byte)
+- contatori hit/miss salvati nel DB, quindi aggregati tra processi
+"""
+import os
+import json
+import time
+import sqlite3
+from contextlib import contextmanager
+
+# I file intermedi vivono in .tmp/ (vedi GEMINI.md)
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(PROJECT_ROOT, ".tmp"))
+
+class SQLiteCache:
+    def __init__(self, filename, ttl_seconds, max_entries=10000, max_bytes=512 * 1024 * 1024):
+        self.path = filename if os.path.isabs(filename) else os.path.join(CACHE_DIR, filename)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._initialized = False
+
+    def _connect(self):
+        # Una connessione per operazione: sicuro con asyncio.to_thread e più processi
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if not self._initialized:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries(last_access);
+                CREATE TABLE IF NOT EXISTS counters (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                );
+            """)
+            self._initialized = True
+        return conn
+
+    @contextmanager
+    def _session(self):
+        conn = self._connect()
+        try:
+            with conn:  # commit/rollback automatico
+                yield conn
+        finally:
+            conn.close()
+
+    def _bump(self, conn, name):
+        conn.execute(
+            "INSERT INTO counters(name, value) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (name,),
+        )
+
+    def get(self, key):
+        """Restituisce il valore (già deserializzato) o None se assente/scaduto."""
+        now = time.time()
+        with self._session() as conn:
+            row = conn.execute(
+                "SELECT value, expires_at FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] < now:
+                if row is not None:
+                    conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._bump(conn, "misses")
+                return None
+            conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+            self._bump(conn, "hits")
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl_seconds=None):
+        payload = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self._session() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries(key, value, size, expires_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, payload, len(payload.encode("utf-8")), now + ttl, now),
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        conn.execute("DELETE FROM entries WHERE expires_at < ?", (now,))
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+
+        # Elimina le voci usate meno di recente finché rientriamo nei limiti
+        evicted = 0
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY last_access ASC").fetchall():
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            count -= 1
+            total -= size
+            evicted += 1
+        conn.execute(
+            "INSERT INTO counters(name, value) VALUES ('evictions', ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + ?",
+            (evicted, evicted),
+        )
+
+    def stats(self):
+        if not os.path.exists(self.path):
+            return {"hits": 0, "misses": 0, "evictions": 0, "entries": 0, "bytes": 0}
+        with self._session() as conn:
+            counters = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+            count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {
+            "hits": counters.get("hits", 0),
+            "misses": counters.get("misses", 0),
+            "evictions": counters.get("evictions", 0),
+            "entries": count,
+            "bytes": total,
+        }
@@ -0,0 +1,192 @@
+"""
+Utility per gli stream NDJSON dell'API: serializzazione degli eventi e
+multiplexing di più generatori asincroni che lavorano in parallelo.
+"""
+import json
+import asyncio
+
+def ndjson_event(event_type, **fields):
+    """Una riga NDJSON: {"type": ..., **fields}."""
+    return json.dumps({"type": event_type, **fields}) + "\n"
+
+_DONE = object()
+
+async def merge_async_iterators(*iterators):
+    """
+    Esegue più generatori asincroni in parallelo e produce i loro elementi
+    man mano che arrivano (ordine di arrivo).
+    Se uno dei generatori solleva un'eccezione, gli altri vengono cancellati
+    e l'eccezione viene propagata al consumatore.
+    """
+    queue = asyncio.Queue()
+
+    async def pump(iterator):
+        try:
+            async for item in iterator:
+                await queue.put(item)
+        except Exception as e:
+            await queue.put(e)
+        finally:
+            await queue.put(_DONE)
+
+    tasks = [asyncio.create_task(pump(it)) for it in iterators]
+    remaining = len(tasks)
+    try:
+        while remaining:
+            item = await queue.get()
+            if item is _DONE:
+                remaining -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+async def iterate_queue(queue):
+    """Legge da una asyncio.Queue finché non arriva None (fine dello stream)."""
+    while True:
+        item = await queue.get()
+        if item is None:
+            return
+        yield item
+
+async def iterate_queue_until(queue, task):
+    """Legge dalla coda finché il task non termina, poi restituisce gli elementi rimasti."""
+    getter = None
+    try:
+        while not task.done():
+            getter = asyncio.ensure_future(queue.get())
+            await asyncio.wait((getter, task), return_when=asyncio.FIRST_COMPLETED)
+            if getter.done():
+                yield getter.result()
+            else:
+                getter.cancel()
+            getter = None
+        while not queue.empty():
+            yield queue.get_nowait()
+    finally:
+        if getter is not None:
+            getter.cancel()
+
+async def cancel_on_disconnect(iterator, wait_disconnected, on_cancel=None):
+    """
+    Inoltra gli elementi di `iterator` finché il client resta connesso.
+    L'iteratore gira in un task separato: quando `await wait_disconnected()` termina
+    (il client se n'è andato), o se chi consuma smette di leggere, il task viene
+    cancellato e con lui le chiamate upstream ancora in corso.
+    `on_cancel()` viene chiamata se l'iteratore viene interrotto prima della fine.
+    """
+    queue = asyncio.Queue()
+
+    async def pump():
+        try:
+            async for item in iterator:
+                queue.put_nowait(item)
+        except Exception as e:
+            queue.put_nowait(e)
+        finally:
+            queue.put_nowait(_DONE)
+            if hasattr(iterator, "aclose"):
+                await iterator.aclose()
+
+    pump_task = asyncio.create_task(pump())
+    watcher = asyncio.ensure_future(wait_disconnected())
+    getter = None
+    try:
+        while True:
+            getter = asyncio.ensure_future(queue.get())
+            await asyncio.wait((getter, watcher), return_when=asyncio.FIRST_COMPLETED)
+            if not getter.done():
+                return  # client disconnesso
+            item = getter.result()
+            getter = None
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        if getter is not None:
+            getter.cancel()
+        watcher.cancel()
+        if not pump_task.done():
+            pump_task.cancel()
+            if on_cancel is not None:
+                on_cancel()
+        await asyncio.gather(pump_task, watcher, return_exceptions=True)
+
+class ParagraphSplitter:
+    """
+    Accumula i frammenti di uno stream di testo e restituisce i paragrafi
+    completi (separati da una riga vuota) appena vengono chiusi.
+    """
+    def __init__(self):
+        self._buffer = ""
+
+    def feed(self, text):
+        self._buffer += text
+        if "\n\n" not in self._buffer:
+            return []
+        *complete, self._buffer = self._buffer.split("\n\n")
+        return [p.strip() for p in complete if p.strip()]
+
+    def flush(self):
+        rest, self._buffer = self._buffer.strip(), ""
+        return [rest] if rest else []
+
+async def ordered_map_stream(source, fn, concurrency=4):
+    """
+    Per ogni elemento di `source` (iteratore asincrono) avvia `fn(elemento)`,
+    che è a sua volta un iteratore asincrono di frammenti, con al massimo
+    `concurrency` elaborazioni in corso.
+    I frammenti vengono prodotti nell'ordine degli elementi: quelli del primo
+    elemento in tempo reale, quelli dei successivi bufferizzati finché non tocca a loro.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    order = asyncio.Queue()
+    tasks = []
+
+    async def run_one(item, out):
+        try:
+            async with semaphore:
+                async for piece in fn(item):
+                    await out.put(piece)
+        except Exception as e:
+            await out.put(e)
+        finally:
+            await out.put(_DONE)
+
+    async def feed():
+        try:
+            async for item in source:
+                out = asyncio.Queue()
+                tasks.append(asyncio.create_task(run_one(item, out)))
+                await order.put(out)
+        except Exception as e:
+            await order.put(e)
+        finally:
+            await order.put(_DONE)
+
+    feeder = asyncio.create_task(feed())
+    try:
+        while True:
+            out = await order.get()
+            if out is _DONE:
+                return
+            if isinstance(out, Exception):
+                raise out
+            while True:
+                piece = await out.get()
+                if piece is _DONE:
+                    break
+                if isinstance(piece, Exception):
+                    raise piece
+                yield piece
+    finally:
+        feeder.cancel()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(feeder, *tasks, return_exceptions=True)
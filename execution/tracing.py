@@ -0,0 +1,232 @@
+"""
+Tracing delle chiamate upstream (Apify, OpenRouter, download dei video) e
+degli stage della pipeline.
+
+- span(): misura durata ed esito di una chiamata (e il time-to-first-token
+  degli stream) e la registra negli istogrammi esposti su /metrics
+- Trace: raccoglie gli span di una singola richiesta (via contextvar), per
+  mandarli al client come eventi `timing` nello stream NDJSON
+
+Le metriche sono per processo, in formato testo Prometheus, senza dipendenze esterne.
+"""
+import time
+import threading
+from contextvars import ContextVar
+
+# Secondi: dalle chiamate LLM veloci fino alle run Apify più lente
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series["counts"]):
+                    labels = _format_labels(self.labelnames, key, [("le", f"{bound:g}")])
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.labelnames, key, [("le", "+Inf")])
+                lines.append(f"{self.name}_bucket{labels} {series['count']}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {series['sum']:.6f}")
+                lines.append(f"{self.name}_count{labels} {series['count']}")
+        return lines
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value:g}")
+        return lines
+
+_registry = []
+
+def register(metric):
+    _registry.append(metric)
+    return metric
+
+def render_metrics():
+    """Tutte le metriche registrate, in formato testo Prometheus (text/plain; version=0.0.4)."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+UPSTREAM_DURATION = register(Histogram(
+    "upstream_request_duration_seconds",
+    "Duration of calls to upstream services (Apify, OpenRouter, video CDNs).",
+    ("upstream", "operation", "stage"),
+))
+UPSTREAM_REQUESTS = register(Counter(
+    "upstream_requests_total",
+    "Calls to upstream services by outcome (ok, error, cancelled).",
+    ("upstream", "operation", "stage", "outcome"),
+))
+TIME_TO_FIRST_TOKEN = register(Histogram(
+    "llm_time_to_first_token_seconds",
+    "Time from request to first streamed token for streamed LLM stages.",
+    ("model", "stage"),
+    buckets=(0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 3, 5, 10, 30),
+))
+STAGE_DURATION = register(Histogram(
+    "pipeline_stage_duration_seconds",
+    "Duration of pipeline stages (extraction, language detection, format, paraphrase, ...).",
+    ("endpoint", "stage"),
+))
+
+STREAM_CANCELLATIONS = register(Counter(
+    "stream_cancellations_total",
+    "Streaming responses cancelled before completion because the client went away.",
+    ("endpoint",),
+))
+
+class Trace:
+    """Span conclusi di una richiesta, in ordine di fine."""
+
+    def __init__(self, endpoint=""):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.spans = []
+        self._drained = 0
+
+    def add(self, record):
+        record["start_ms"] = round((record.pop("_started") - self.started) * 1000, 1)
+        self.spans.append(record)
+
+    def drain(self):
+        """Span conclusi dall'ultima chiamata a drain()."""
+        new = self.spans[self._drained:]
+        self._drained = len(self.spans)
+        return new
+
+    def elapsed_ms(self):
+        return round((time.perf_counter() - self.started) * 1000, 1)
+
+_current_trace = ContextVar("trace", default=None)
+
+def start_trace(endpoint=""):
+    """Attiva un Trace per il contesto corrente (e i task creati da qui in poi)."""
+    trace = Trace(endpoint)
+    _current_trace.set(trace)
+    return trace
+
+def current_trace():
+    return _current_trace.get()
+
+class span:
+    """
+    Misura una chiamata upstream:
+
+        with span("apify", "actor_run", stage="transcribe"):
+            ...
+
+    Negli stream chiamare first_token() all'arrivo del primo frammento.
+    """
+
+    def __init__(self, upstream, operation, stage="", model=""):
+        self.upstream = upstream
+        self.operation = operation
+        self.stage = stage or ""
+        self.model = model or ""
+        self.ttft = None
+
+    def first_token(self):
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - self.started
+            TIME_TO_FIRST_TOKEN.observe(self.ttft, model=self.model, stage=self.stage)
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.started
+        if exc_type is None:
+            outcome = "ok"
+        elif issubclass(exc_type, Exception):
+            outcome = "error"
+        else:
+            outcome = "cancelled"  # CancelledError / GeneratorExit: nessuno aspetta più il risultato
+        labels = {"upstream": self.upstream, "operation": self.operation, "stage": self.stage}
+        UPSTREAM_DURATION.observe(duration, **labels)
+        UPSTREAM_REQUESTS.inc(outcome=outcome, **labels)
+
+        trace = _current_trace.get()
+        if trace is not None:
+            record = {
+                "name": f"{self.upstream}.{self.operation}",
+                "stage": self.stage,
+                "duration_ms": round(duration * 1000, 1),
+                "outcome": outcome,
+                "_started": self.started,
+            }
+            if self.model:
+                record["model"] = self.model
+            if self.ttft is not None:
+                record["ttft_ms"] = round(self.ttft * 1000, 1)
+            trace.add(record)
+        return False
+
+class stage_span:
+    """Misura uno stage della pipeline (più chiamate upstream) in pipeline_stage_duration_seconds."""
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.started
+        trace = _current_trace.get()
+        endpoint = trace.endpoint if trace is not None else ""
+        STAGE_DURATION.observe(duration, endpoint=endpoint, stage=self.stage)
+        if trace is not None:
+            trace.add({
+                "name": "stage",
+                "stage": self.stage,
+                "duration_ms": round(duration * 1000, 1),
+                "outcome": "ok" if exc_type is None else "error",
+                "_started": self.started,
+            })
+        return False
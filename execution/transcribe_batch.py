@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Nome Script: transcribe_batch.py
+
+Scopo:
+    Estrae molti video (YouTube e Instagram) con il minor numero possibile di run Apify.
+    L'avvio a freddo dell'actor domina la durata di una run, quindi:
+    - Instagram: fino a INSTAGRAM_BATCH_SIZE post per run di apify/instagram-scraper
+      (directUrls multipli), con i risultati riabbinati agli URL tramite shortcode
+    - YouTube: pintostudio/youtube-transcript-scraper accetta un solo videoUrl per run,
+      quindi le run partono in parallelo (al massimo BATCH_CONCURRENCY alla volta)
+    URL già in cache non avviano nessuna run; URL duplicati (stesso ID canonico) ne usano una sola.
+
+Uso:
+    python execution/transcribe_batch.py <url1> <url2> ...
+
+Input:
+    - url: uno o più URL di video YouTube o Instagram
+
+Output:
+    Una riga JSON per URL, nell'ordine di completamento: {"url", "data"} oppure {"url", "error"}.
+"""
+
+import os
+import sys
+import json
+import asyncio
+import logging
+from dotenv import load_dotenv
+
+# Permette l'esecuzione diretta dello script (python execution/transcribe_batch.py)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from execution.transcript_cache import get_cached_transcript, set_cached_transcript
+from execution.transcribe_video import transcribe_video_async
+from execution.transcribe_instagram import parse_post
+from execution.video_ids import canonical_video_id, instagram_shortcode
+from execution.apify_utils import get_client, run_actor, iterate_dataset
+
+# Carica variabili d'ambiente
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+INSTAGRAM_ACTOR_ID = "apify/instagram-scraper"
+# Post per run dell'actor Instagram: oltre, la run si allunga più di quanto si risparmia in avvio
+INSTAGRAM_BATCH_SIZE = int(os.getenv("INSTAGRAM_BATCH_SIZE", "25"))
+# Run Apify contemporanee per un batch
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+
+def _item_shortcode(item):
+    # L'actor riporta lo shortcode, l'URL del post e l'URL richiesto (inputUrl)
+    return (
+        item.get("shortCode")
+        or instagram_shortcode(item.get("url"))
+        or instagram_shortcode(item.get("inputUrl"))
+    )
+
+async def _instagram_run(client, urls, semaphore):
+    """
+    Una run dell'actor per tutti gli URL del gruppo.
+    Restituisce {url: dati} oppure {url: eccezione} per ogni URL.
+    """
+    run_input = {
+        "directUrls": urls,
+        "resultsLimit": 1,
+        "proxy": {"useApifyProxy": True}
+    }
+    logger.debug(f"Avvio actor {INSTAGRAM_ACTOR_ID} per {len(urls)} URL")
+
+    async with semaphore:
+        run = await run_actor(INSTAGRAM_ACTOR_ID, run_input, stage="instagram_batch", client=client)
+
+    # Il dataset viene letto a pagine; il primo risultato per shortcode vince (resultsLimit vale per URL)
+    by_shortcode = {}
+    async for item in iterate_dataset(run["defaultDatasetId"], stage="instagram_batch", client=client):
+        shortcode = _item_shortcode(item)
+        if shortcode and shortcode not in by_shortcode:
+            by_shortcode[shortcode] = item
+
+    results = {}
+    for url in urls:
+        item = by_shortcode.get(instagram_shortcode(url))
+        if item is None:
+            results[url] = Exception(f"Nessun dato ritornato per {url}. Il post potrebbe essere privato o rimosso.")
+        elif item.get("error"):
+            results[url] = Exception(f"Errore dallo scraper: {item.get('errorDescription') or item['error']}")
+        else:
+            results[url] = parse_post(item)
+            await set_cached_transcript(url, results[url])
+    return results
+
+async def transcribe_batch_async(urls):
+    """
+    Estrae tutti gli URL e produce (url, dati, errore) appena ciascun risultato è pronto:
+    prima gli URL in cache, poi quelli delle run Apify man mano che finiscono.
+    Esattamente una tupla per URL ricevuto; errore è None in caso di successo.
+    """
+    # URL con lo stesso ID canonico condividono la stessa estrazione
+    groups = {}
+    for url in urls:
+        key = canonical_video_id(url)
+        if key is None:
+            yield url, None, "Unsupported platform. Use YouTube or Instagram."
+            continue
+        groups.setdefault(key, []).append(url)
+
+    instagram_urls = []
+    youtube_urls = []
+    for key, same_video in groups.items():
+        url = same_video[0]
+        cached = await get_cached_transcript(url)
+        if cached is not None:
+            for u in same_video:
+                yield u, cached, None
+        elif key.startswith("instagram:"):
+            instagram_urls.append(url)
+        else:
+            youtube_urls.append(url)
+
+    if not instagram_urls and not youtube_urls:
+        return
+
+    results = asyncio.Queue()
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def instagram_batch(batch):
+        try:
+            outcome = await _instagram_run(get_client(), batch, semaphore)
+        except Exception as e:
+            logger.warning(f"Errore Scraper ({len(batch)} URL Instagram): {e}")
+            outcome = dict.fromkeys(batch, e)
+        for url, value in outcome.items():
+            results.put_nowait((url, value))
+
+    async def youtube_one(url):
+        try:
+            async with semaphore:
+                value = await transcribe_video_async(url)
+        except Exception as e:
+            value = e
+        results.put_nowait((url, value))
+
+    tasks = [
+        asyncio.create_task(instagram_batch(instagram_urls[i:i + INSTAGRAM_BATCH_SIZE]))
+        for i in range(0, len(instagram_urls), INSTAGRAM_BATCH_SIZE)
+    ]
+    tasks.extend(asyncio.create_task(youtube_one(url)) for url in youtube_urls)
+
+    try:
+        for _ in range(len(instagram_urls) + len(youtube_urls)):
+            url, value = await results.get()
+            for u in groups[canonical_video_id(url)]:
+                if isinstance(value, Exception):
+                    yield u, None, str(value)
+                else:
+                    yield u, value, None
+    finally:
+        # Il consumatore ha smesso di leggere: le run ancora in corso non servono più
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+async def _collect(urls):
+    return [item async for item in transcribe_batch_async(urls)]
+
+def transcribe_batch(urls):
+    """Versione sincrona per l'uso da riga di comando."""
+    return asyncio.run(_collect(urls))
+
+if __name__ == "__main__":
+    for url, data, error in transcribe_batch(sys.argv[1:]):
+        line = {"url": url, "error": error} if error else {"url": url, "data": data}
+        print(json.dumps(line, ensure_ascii=False))
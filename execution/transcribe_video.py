@@ -19,23 +19,30 @@ Output:
 import os
 import sys
 import json
+import asyncio
 import argparse
 from dotenv import load_dotenv
-from apify_client import ApifyClient
+
+# Permette l'esecuzione diretta dello script (python execution/transcribe_video.py)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from execution.transcript_cache import get_cached_transcript, set_cached_transcript
+from execution.apify_utils import get_client, run_actor, first_item
 
 # Carica variabili d'ambiente
 load_dotenv()
 
-def transcribe_video(video_url):
+async def transcribe_video_async(video_url):
     """
     Esegue la trascrizione del video usando Apify.
     Restituisce un dizionario con la trascrizione e metadati.
+    I risultati sono in cache per ID video: un URL già visto non rilancia l'actor.
     """
-    api_token = os.getenv("APIFY_API_TOKEN")
-    if not api_token:
-        raise ValueError("APIFY_API_TOKEN non trovato nel file .env")
+    cached = await get_cached_transcript(video_url)
+    if cached is not None:
+        return cached
 
-    client = ApifyClient(api_token)
+    client = get_client()
 
     run_input = {
         "videoUrl": video_url,
@@ -44,22 +51,19 @@ def transcribe_video(video_url):
         "saveSubsToKVS": False,
     }
 
-    # Avvia l'actor e attendi la fine
+    # Avvia l'actor e attendi la fine (polling, abort alla scadenza o se il chiamante rinuncia)
     # pintostudio/youtube-transcript-scraper
     actor_id = "pintostudio/youtube-transcript-scraper"
     
     # print(f"Avviando trascrizione per: {video_url}...", file=sys.stderr)
-    run = client.actor(actor_id).call(run_input=run_input)
-
-    # Recupera i risultati dal dataset
-    dataset_items = client.dataset(run["defaultDatasetId"]).list_items().items
-    
-    if not dataset_items:
-        raise Exception(f"Nessun dato ritornato da Apify per il video: {video_url}")
+    run = await run_actor(actor_id, run_input, stage="youtube", client=client)
 
     # L'output di questo actor è una lista di oggetti, uno per video.
     # Prendiamo il primo (e unico) risultato.
-    video_data = dataset_items[0]
+    video_data = await first_item(run["defaultDatasetId"], stage="youtube", client=client)
+    
+    if not video_data:
+        raise Exception(f"Nessun dato ritornato da Apify per il video: {video_url}")
     
     # Robustness: Some Apify results are wrapped in "data"
     if "data" in video_data:
@@ -82,9 +86,14 @@ def transcribe_video(video_url):
     # Controlla se c'è un errore specifico nel risultato
     if "error" in video_data:
         raise Exception(f"Errore dallo scraper: {video_data['error']}")
-        
+
+    await set_cached_transcript(video_url, video_data)
     return video_data
 
+def transcribe_video(video_url):
+    """Versione sincrona per l'uso da riga di comando."""
+    return asyncio.run(transcribe_video_async(video_url))
+
 def main():
     parser = argparse.ArgumentParser(description="Trascrivi video YouTube con Apify")
     parser.add_argument("url", help="URL del video YouTube")
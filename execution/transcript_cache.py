@@ -0,0 +1,39 @@
+"""
+Cache persistente dei risultati Apify, indicizzata per ID canonico del video.
+Evita di rilanciare l'actor (lo step più lento della pipeline) per URL già visti.
+"""
+import os
+import asyncio
+
+from execution.sqlite_cache import SQLiteCache
+from execution.video_ids import canonical_video_id
+
+# Le trascrizioni YouTube non cambiano; gli URL video di Instagram sono link CDN firmati
+# che scadono, quindi per Instagram il TTL è più breve.
+YOUTUBE_TTL = int(os.getenv("TRANSCRIPT_CACHE_TTL_YOUTUBE", str(7 * 24 * 3600)))
+INSTAGRAM_TTL = int(os.getenv("TRANSCRIPT_CACHE_TTL_INSTAGRAM", str(3 * 3600)))
+
+_cache = SQLiteCache(
+    os.getenv("TRANSCRIPT_CACHE_PATH", "transcript_cache.sqlite3"),
+    ttl_seconds=YOUTUBE_TTL,
+    max_entries=int(os.getenv("TRANSCRIPT_CACHE_MAX_ENTRIES", "5000")),
+    max_bytes=int(os.getenv("TRANSCRIPT_CACHE_MAX_MB", "256")) * 1024 * 1024,
+)
+
+def _ttl_for(key):
+    return INSTAGRAM_TTL if key.startswith("instagram:") else YOUTUBE_TTL
+
+async def get_cached_transcript(video_url):
+    key = canonical_video_id(video_url)
+    if key is None:
+        return None
+    return await asyncio.to_thread(_cache.get, key)
+
+async def set_cached_transcript(video_url, data):
+    key = canonical_video_id(video_url)
+    if key is None:
+        return
+    await asyncio.to_thread(_cache.set, key, data, _ttl_for(key))
+
+def transcript_cache_stats():
+    return _cache.stats()
@@ -0,0 +1,206 @@
+"""
+Registro dei consumi LLM: token, costo e latenza di ogni chat completion,
+aggregati per endpoint, modello e stage.
+
+I contatori vivono in memoria e vengono scritti periodicamente (e all'uscita)
+su SQLite (.tmp/usage.sqlite3), sommati per giorno: /api/stats legge da lì,
+quindi i totali includono tutti i processi e i riavvii.
+"""
+import os
+import time
+import atexit
+import asyncio
+import logging
+import sqlite3
+import threading
+from contextvars import ContextVar
+from contextlib import contextmanager
+
+from execution.sqlite_cache import CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+USAGE_FLUSH_SECONDS = float(os.getenv("USAGE_FLUSH_SECONDS", "30"))
+USAGE_DB_PATH = os.getenv("USAGE_DB_PATH", "usage.sqlite3")
+
+# Endpoint (o job) che ha originato le chiamate LLM del contesto corrente
+_current_endpoint = ContextVar("usage_endpoint", default="cli")
+
+FIELDS = ("calls", "cache_hits", "errors", "prompt_tokens", "completion_tokens", "cost_usd", "latency_seconds")
+
+_pending = {}
+_lock = threading.Lock()
+_flush_task = None
+
+def set_endpoint(name):
+    """Attribuisce le chiamate LLM successive (anche nei task figli) a `name`."""
+    _current_endpoint.set(name)
+
+def current_endpoint():
+    return _current_endpoint.get()
+
+def record_call(model, stage, latency, usage=None, cached=False, error=False):
+    """
+    Registra una chat completion. `usage` è il blocco usage della risposta
+    (prompt_tokens, completion_tokens e, da OpenRouter, cost in dollari).
+    """
+    key = (time.strftime("%Y-%m-%d", time.gmtime()), _current_endpoint.get(), model or "", stage or "")
+    with _lock:
+        row = _pending.get(key)
+        if row is None:
+            row = _pending[key] = dict.fromkeys(FIELDS, 0)
+        row["calls"] += 1
+        row["cache_hits"] += int(cached)
+        row["errors"] += int(error)
+        row["latency_seconds"] += latency
+        if usage is not None:
+            row["prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+            row["completion_tokens"] += getattr(usage, "completion_tokens", 0) or 0
+            row["cost_usd"] += float(getattr(usage, "cost", 0) or 0)
+
+class track_usage:
+    """
+    Registra una chat completion al termine del blocco:
+
+        with track_usage(model, stage) as u:
+            response = ...
+            u.usage = response.usage
+    """
+
+    def __init__(self, model, stage):
+        self.model = model
+        self.stage = stage
+        self.usage = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        error = exc_type is not None and issubclass(exc_type, Exception)
+        record_call(self.model, self.stage, time.perf_counter() - self.started, self.usage, error=error)
+        return False
+
+def _db_path():
+    return USAGE_DB_PATH if os.path.isabs(USAGE_DB_PATH) else os.path.join(CACHE_DIR, USAGE_DB_PATH)
+
+@contextmanager
+def _session():
+    path = _db_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=10)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS usage (
+                day TEXT NOT NULL,
+                endpoint TEXT NOT NULL,
+                model TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                calls INTEGER NOT NULL DEFAULT 0,
+                cache_hits INTEGER NOT NULL DEFAULT 0,
+                errors INTEGER NOT NULL DEFAULT 0,
+                prompt_tokens INTEGER NOT NULL DEFAULT 0,
+                completion_tokens INTEGER NOT NULL DEFAULT 0,
+                cost_usd REAL NOT NULL DEFAULT 0,
+                latency_seconds REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, endpoint, model, stage)
+            )
+        """)
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+def flush_usage():
+    """Somma su SQLite i contatori accumulati in memoria dall'ultimo flush."""
+    global _pending
+    with _lock:
+        pending, _pending = _pending, {}
+    if not pending:
+        return 0
+    columns = ", ".join(FIELDS)
+    updates = ", ".join(f"{f} = {f} + excluded.{f}" for f in FIELDS)
+    try:
+        with _session() as conn:
+            conn.executemany(
+                f"INSERT INTO usage (day, endpoint, model, stage, {columns}) "
+                f"VALUES (?, ?, ?, ?, {', '.join('?' * len(FIELDS))}) "
+                f"ON CONFLICT(day, endpoint, model, stage) DO UPDATE SET {updates}",
+                [(*key, *(row[f] for f in FIELDS)) for key, row in pending.items()],
+            )
+    except sqlite3.Error:
+        # Non perdiamo i contatori: torneranno nel prossimo flush
+        with _lock:
+            for key, row in pending.items():
+                current = _pending.setdefault(key, dict.fromkeys(FIELDS, 0))
+                for f in FIELDS:
+                    current[f] += row[f]
+        raise
+    return len(pending)
+
+def _summarize(rows):
+    summary = dict.fromkeys(FIELDS, 0)
+    for row in rows:
+        for f in FIELDS:
+            summary[f] += row[f]
+    summary["cost_usd"] = round(summary["cost_usd"], 6)
+    summary["avg_latency_seconds"] = round(
+        summary["latency_seconds"] / max(summary["calls"] - summary["cache_hits"], 1), 3
+    )
+    summary["latency_seconds"] = round(summary["latency_seconds"], 3)
+    return summary
+
+def usage_stats(days=7):
+    """Riepilogo per endpoint, modello e stage degli ultimi `days` giorni (UTC)."""
+    try:
+        flush_usage()
+    except sqlite3.Error as e:
+        # Una lettura non fallisce per una scrittura: si riporta quanto è già salvato
+        # (i contatori non scritti restano in memoria per il prossimo flush)
+        logger.warning(f"Usage ledger flush failed, stats may lag: {e}")
+    since = time.strftime("%Y-%m-%d", time.gmtime(time.time() - (days - 1) * 86400))
+    if not os.path.exists(_db_path()):
+        rows = []
+    else:
+        with _session() as conn:
+            conn.row_factory = sqlite3.Row
+            rows = [dict(r) for r in conn.execute("SELECT * FROM usage WHERE day >= ?", (since,))]
+
+    def group_by(field):
+        groups = {}
+        for row in rows:
+            groups.setdefault(row[field], []).append(row)
+        return {name: _summarize(group) for name, group in sorted(groups.items())}
+
+    return {
+        "since": since,
+        "total": _summarize(rows),
+        "by_endpoint": group_by("endpoint"),
+        "by_model": group_by("model"),
+        "by_stage": group_by("stage"),
+    }
+
+async def _flush_loop():
+    while True:
+        await asyncio.sleep(USAGE_FLUSH_SECONDS)
+        try:
+            await asyncio.to_thread(flush_usage)
+        except sqlite3.Error as e:
+            logger.warning(f"Usage ledger flush failed: {e}")
+
+def start_usage_flusher():
+    global _flush_task
+    if _flush_task is None or _flush_task.done():
+        _flush_task = asyncio.create_task(_flush_loop())
+
+async def stop_usage_flusher():
+    global _flush_task
+    if _flush_task is not None:
+        _flush_task.cancel()
+        await asyncio.gather(_flush_task, return_exceptions=True)
+        _flush_task = None
+    await asyncio.to_thread(flush_usage)
+
+# Script da riga di comando: niente flusher, scriviamo tutto all'uscita
+atexit.register(flush_usage)
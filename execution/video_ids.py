@@ -0,0 +1,27 @@
+"""
+Estrazione degli ID canonici dei video dagli URL (YouTube e Instagram).
+Lo stesso video può arrivare con URL diversi (youtu.be, shorts, parametri di tracking...),
+quindi cache e deduplicazione usano sempre l'ID canonico.
+"""
+import re
+
+YOUTUBE_ID_RE = re.compile(r'(?:v=|youtu\.be/|embed/|shorts/|live/)([a-zA-Z0-9_-]{11})')
+INSTAGRAM_SHORTCODE_RE = re.compile(r'instagram\.com/(?:[A-Za-z0-9_.]+/)?(?:p|reel|reels|tv)/([A-Za-z0-9_-]+)')
+
+def youtube_video_id(url):
+    match = YOUTUBE_ID_RE.search(url or "")
+    return match.group(1) if match else None
+
+def instagram_shortcode(url):
+    match = INSTAGRAM_SHORTCODE_RE.search(url or "")
+    return match.group(1) if match else None
+
+def canonical_video_id(url):
+    """Restituisce 'youtube:<id>' o 'instagram:<shortcode>', oppure None se non riconosciuto."""
+    if "youtube.com" in url or "youtu.be" in url:
+        video_id = youtube_video_id(url)
+        return f"youtube:{video_id}" if video_id else None
+    if "instagram.com" in url:
+        shortcode = instagram_shortcode(url)
+        return f"instagram:{shortcode}" if shortcode else None
+    return None